@@ -0,0 +1,61 @@
+"""Compare dateutil-based date formatting with MarkdownFormatter.format_date.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_format_date --timestamps 100000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytz
+from dateutil import parser as date_parser
+
+from llm_context_providers.asana_context_provider import MarkdownFormatter, _format_date_cached
+
+def legacy_format_date(date_str, tz_name):
+    date = date_parser.parse(date_str).astimezone(pytz.timezone(tz_name))
+    day = date.day
+    suffix = 'th' if 4 <= day % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
+    return date.strftime(f'%B {day}{suffix}, %Y %I:%M %p')
+
+def make_timestamps(count, distinct, seed=0):
+    rng = random.Random(seed)
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    pool = []
+    for _ in range(distinct):
+        moment = base + timedelta(seconds=rng.randrange(0, 365 * 24 * 3600), milliseconds=rng.randrange(1000))
+        if rng.random() < 0.2:
+            pool.append(moment.strftime('%Y-%m-%d'))
+        else:
+            pool.append(moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z')
+    return [rng.choice(pool) for _ in range(count)]
+
+def measure(label, func, timestamps, tz_name):
+    start = time.perf_counter()
+    results = [func(value, tz_name) for value in timestamps]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<38} {elapsed:8.3f} s  {len(timestamps) / elapsed:12,.0f} dates/s")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--timestamps', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=20000,
+                        help="distinct values among the timestamps; repeats exercise the memo cache")
+    parser.add_argument('--timezone', default="America/Toronto")
+    args = parser.parse_args()
+
+    timestamps = make_timestamps(args.timestamps, args.distinct)
+    legacy = measure("dateutil + pytz.timezone per call", legacy_format_date, timestamps, args.timezone)
+    _format_date_cached.cache_clear()
+    cold = measure("format_date (cold cache)", MarkdownFormatter.format_date, timestamps, args.timezone)
+    warm = measure("format_date (warm cache)", MarkdownFormatter.format_date, timestamps, args.timezone)
+    assert legacy == cold == warm
+    _format_date_cached.cache_clear()
+    unique = list(dict.fromkeys(timestamps))
+    measure(f"format_date ({len(unique)} unique, no reuse)", MarkdownFormatter.format_date, unique, args.timezone)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Measure how long importing the package and constructing a ContextManager take in a fresh interpreter.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_import --runs 10
+
+Each run starts a new `python -X importtime` process, so nothing is already cached in sys.modules.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('asana', 'urllib3', 'pytz', 'dateutil', 'asyncio', 'multiprocessing')
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from llm_context_providers import ContextManager
+imported = time.perf_counter()
+ContextManager({'context_providers': {'asana': {'enabled': True, 'project_id': '1', 'personal_access_token': 'token'}}})
+constructed = time.perf_counter()
+print(imported - start, constructed - imported, ','.join(name for name in %r if name in sys.modules))
+""" % (HEAVY_MODULES,)
+
+def run_once():
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", SCRIPT], capture_output=True, text=True,
+                            check=True)
+    # -X importtime reports microseconds: "import time: self | cumulative | name"
+    package = next(int(line.split('|')[1]) for line in result.stderr.splitlines()
+                   if line.rstrip().endswith('| llm_context_providers'))
+    imported, constructed, loaded = result.stdout.split(' ')
+    return package / 10 ** 6, float(imported), float(constructed), loaded.strip()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(f"{'importtime llm_context_providers':<36} {statistics.median(run[0] for run in runs) * 1000:8.1f} ms")
+    print(f"{'import (wall)':<36} {statistics.median(run[1] for run in runs) * 1000:8.1f} ms")
+    print(f"{'ContextManager(config) (wall)':<36} {statistics.median(run[2] for run in runs) * 1000:8.1f} ms")
+    print(f"heavy modules loaded after construction: {runs[-1][3] or 'none'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Measure the memory a fetched Asana snapshot holds: raw API dicts versus compact task records.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_memory --tasks 20000 --stories 5
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from llm_context_providers.asana_context_provider import DEFAULT_TASK_FIELDS, TaskRecord, TaskSnapshot
+
+from llm_context_providers.benchmark.synthetic import make_tasks
+
+def api_payload(tasks):
+    # Stories as Asana returns them without opt_fields; JSON text so every string is decoded afresh, as from the SDK
+    for task in tasks:
+        for story in task['stories']:
+            story['resource_type'] = 'story'
+            story['created_by']['resource_type'] = 'user'
+    return json.dumps(tasks)
+
+def measure(label, build, payload):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    held = build(payload)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} held {current / 2 ** 20:8.1f} MB  peak {peak / 2 ** 20:8.1f} MB  {elapsed:6.2f} s")
+    del held
+    return current
+
+def build_raw(payload):
+    return json.loads(payload)
+
+def build_records(payload):
+    fields = DEFAULT_TASK_FIELDS.values()
+    records = [TaskRecord.from_dict(task, fields) for task in json.loads(payload)]
+    return TaskSnapshot(records, None)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=20000)
+    parser.add_argument('--stories', type=int, default=5, help="stories per task")
+    args = parser.parse_args()
+
+    payload = api_payload(make_tasks(args.tasks, args.stories))
+    print(f"{args.tasks} tasks, {args.stories} stories each, {len(payload) / 2 ** 20:.1f} MB of JSON")
+    raw = measure("raw API dicts", build_raw, payload)
+    compact = measure("TaskRecord snapshot", build_records, payload)
+    print(f"compact records hold {raw / compact:.1f}x less memory")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Render a large project inline and on thread and process pools of 1, 2, 4 and 8 workers.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_parallel_render --tasks 50000
+
+Thread pools keep the event loop responsive but share the GIL, so they render no faster than inline.
+Process pools scale with the cores available, less the cost of pickling tasks out and sections back.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from llm_context_providers.asana_context_provider import (
+    DEFAULT_TASK_FIELDS, TaskRecord, _format_date_cached, _format_epoch_cached,
+    render_task_sections, render_task_sections_async
+)
+from llm_context_providers.render_pool import get_render_pool, shutdown_render_pools
+from llm_context_providers.benchmark.synthetic import make_tasks
+
+TIMEZONE = "America/Toronto"
+
+def clear_date_caches():
+    # Every run starts cold, as a first render after startup would
+    _format_date_cached.cache_clear()
+    _format_epoch_cached.cache_clear()
+
+async def render_with_ticker(tasks, pool, workers):
+    # The longest gap between 5 ms ticks is how long the event loop was blocked
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            stalls.append(now - last)
+            last = now
+
+    tick = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    if pool is None:
+        sections = render_task_sections(tasks, DEFAULT_TASK_FIELDS, TIMEZONE)
+    else:
+        sections = await render_task_sections_async(tasks, DEFAULT_TASK_FIELDS, TIMEZONE, pool, workers)
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick
+    return sections, elapsed, max(stalls, default=elapsed)
+
+def measure(label, tasks, pool, workers, baseline):
+    # A small warm-up render starts the pool's workers outside the timed run
+    if pool is not None:
+        render_task_sections(tasks[:workers], DEFAULT_TASK_FIELDS, TIMEZONE, pool, workers, chunk_size=1)
+    clear_date_caches()
+    sections, elapsed, stall = asyncio.run(render_with_ticker(tasks, pool, workers))
+    if baseline is not None and sections != baseline[0]:
+        raise AssertionError(f"{label} rendered different output")
+    speedup = baseline[1] / elapsed if baseline is not None else 1.0
+    print(f"{label:<20} {elapsed:8.2f} s  {speedup:5.2f}x  longest event loop stall {stall * 1000:8.1f} ms")
+    return sections, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=50000)
+    parser.add_argument('--stories', type=int, default=5, help="stories per task")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    fields = DEFAULT_TASK_FIELDS.values()
+    tasks = [TaskRecord.from_dict(task, fields) for task in make_tasks(args.tasks, args.stories)]
+    print(f"{args.tasks} tasks, {args.stories} stories each, {os.cpu_count()} CPUs")
+    baseline = measure("inline", tasks, None, 1, None)
+    try:
+        for kind in ("thread", "process"):
+            for workers in args.workers:
+                measure(f"{kind} x{workers}", tasks, get_render_pool(kind, workers), workers, baseline)
+    finally:
+        shutdown_render_pools()
+
+if __name__ == '__main__':
+    main()
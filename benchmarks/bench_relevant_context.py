@@ -0,0 +1,71 @@
+"""Measure query-scoped retrieval: latency of get_relevant_context and its size against the full context.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_relevant_context --tasks 50000
+
+The project is fetched once from the local fake Asana API. Each query then searches the index and renders only
+the top hits, so its cost depends on the number of hits rather than on the size of the project.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from llm_context_providers.context_manager import ContextManager
+from llm_context_providers.token_budget import estimate_tokens
+from llm_context_providers.benchmark.fake_server import FakeAsanaServer
+from llm_context_providers.benchmark.synthetic import make_project, make_tasks, words
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def timed_queries(manager, queries, budget):
+    latencies = []
+    sizes = []
+    for query in queries:
+        start = time.perf_counter()
+        context = manager.get_relevant_context(query, budget=budget)
+        latencies.append((time.perf_counter() - start) * 1000)
+        sizes.append(estimate_tokens(context))
+    return latencies, sizes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=50000)
+    parser.add_argument('--stories', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--results', type=int, default=20, help="hits merged per query")
+    parser.add_argument('--budget', type=int, default=8000, help="token budget per query")
+    args = parser.parse_args()
+
+    project = make_project()
+    server = FakeAsanaServer(project, make_tasks(args.tasks, args.stories))
+    with server:
+        manager = ContextManager({
+            'context_providers': {'asana': {
+                'enabled': True, 'project_id': project['gid'], 'personal_access_token': 'benchmark-token',
+                'host': server.url, 'requests_per_minute': 10 ** 7
+            }},
+            'retrieval': {'results': args.results, 'cache_size': args.queries}
+        })
+        start = time.perf_counter()
+        manager.fetch_contexts()
+        fetched = time.perf_counter() - start
+    full = estimate_tokens(manager.get_combined_context())
+    print(f"{args.tasks} tasks fetched in {fetched:.1f} s, full context ~{full:,} tokens")
+
+    rng = random.Random(1)
+    queries = [words(rng, rng.randint(1, 3)) for _ in range(args.queries)]
+    start = time.perf_counter()
+    manager.get_relevant_context("warm up")
+    print(f"first query, building the index: {time.perf_counter() - start:.2f} s")
+
+    for label in ("uncached", "cached"):
+        latencies, sizes = timed_queries(manager, queries, args.budget)
+        print(f"{label:<9} p50 {statistics.median(latencies):8.2f} ms  p99 {percentile(latencies, 0.99):8.2f} ms  "
+              f"context ~{statistics.median(sizes):,.0f} tokens ({full / max(statistics.median(sizes), 1):,.0f}x smaller)")
+
+if __name__ == '__main__':
+    main()
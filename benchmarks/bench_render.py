@@ -0,0 +1,122 @@
+"""Compare the original string-concatenating renderer with the streaming one.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_render --tasks 10000
+"""
+import argparse
+import io
+import os
+import time
+import tracemalloc
+
+from llm_context_providers import ContextManager, ContextProvider
+from llm_context_providers.asana_context_provider import MarkdownFormatter, DEFAULT_TASK_FIELDS
+from llm_context_providers.benchmark.synthetic import make_project, make_tasks
+
+def legacy_generate_project_markdown(formatter, project, tasks, task_fields, timezone):
+    markdown = ""
+    markdown += formatter.heading1(f"Project: {project['name']}")
+    markdown += formatter.format_field("Project ID", project['gid'])
+    markdown += formatter.format_field("Created At", formatter.format_date(project['created_at'], timezone))
+    markdown += formatter.format_field("Modified At", formatter.format_date(project['modified_at'], timezone))
+    markdown += formatter.format_field("Owner", project['owner']['name'] if project['owner'] else 'N/A')
+    markdown += formatter.format_field("Notes", project['notes'])
+    markdown += formatter.format_field("Start On", project.get('start_on', 'N/A'))
+    markdown += formatter.format_field("Due On", project.get('due_on', 'N/A'))
+    markdown += "\n"
+    markdown += formatter.heading2("Tasks")
+    for task in tasks:
+        markdown += formatter.heading3(f"Task: {task['name']}")
+        for field_name, field in task_fields.items():
+            value = task.get(field, 'N/A')
+            if field in ['created_at', 'modified_at', 'due_on']:
+                value = formatter.format_date(value, timezone)
+            elif field == 'assignee':
+                value = value.get('name', 'N/A') if isinstance(value, dict) else 'N/A'
+            markdown += formatter.format_field(field_name, value)
+        markdown += formatter.heading4("Stories")
+        for story in task['stories']:
+            story_text = f"{formatter.format_date(story['created_at'], timezone)} by {story['created_by']['name']}: {story['text']}"
+            markdown += formatter.list_item(story_text)
+        markdown += "\n"
+    return markdown
+
+def measure(label, func):
+    # Time and memory are measured in separate runs because tracemalloc slows allocation-heavy code down
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<45} {elapsed:8.2f} s  peak {peak / 2 ** 20:8.1f} MiB")
+    return result
+
+class StaticContextProvider(ContextProvider):
+    def __init__(self, context):
+        super().__init__()
+        self.context_info = context
+
+    async def fetch_context_async(self, full_fetch: bool = False):
+        pass
+
+    def get_context(self):
+        return self.context_info
+
+    async def index_context(self):
+        pass
+
+    async def search_index(self, query: str):
+        pass
+
+    def load_from_index(self, search_results):
+        pass
+
+def legacy_get_combined_context(manager):
+    combined_context = ""
+    for provider in manager.context_providers.values():
+        context = provider.get_context()
+        if context:
+            combined_context += context + "\n"
+    return combined_context
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--stories', type=int, default=5)
+    parser.add_argument('--providers', type=int, default=4)
+    args = parser.parse_args()
+
+    project = make_project()
+    tasks = make_tasks(args.tasks, args.stories)
+    formatter = MarkdownFormatter()
+    timezone = "America/Toronto"
+
+    legacy = measure("legacy += rendering", lambda: legacy_generate_project_markdown(
+        formatter, project, tasks, DEFAULT_TASK_FIELDS, timezone))
+    current = measure("generate_project_markdown", lambda: formatter.generate_project_markdown(
+        project, tasks, DEFAULT_TASK_FIELDS, timezone))
+    assert legacy == current
+    with open(os.devnull, 'w') as sink:
+        measure("write_project_markdown to a file sink", lambda: formatter.write_project_markdown(
+            sink, project, tasks, DEFAULT_TASK_FIELDS, timezone))
+    measure("write_project_markdown to StringIO", lambda: formatter.write_project_markdown(
+        io.StringIO(), project, tasks, DEFAULT_TASK_FIELDS, timezone))
+    print(f"rendered {len(current) / 2 ** 20:.1f} MiB for {args.tasks} tasks")
+
+    manager = ContextManager({})
+    for index in range(args.providers):
+        manager.context_providers[f"provider{index}"] = StaticContextProvider(current)
+    del legacy, current
+    combined = measure(f"legacy combined context ({args.providers} providers)", lambda: legacy_get_combined_context(manager))
+    assert combined == manager.get_combined_context()
+    del combined
+    measure("get_combined_context", manager.get_combined_context)
+    with open(os.devnull, 'w') as sink:
+        measure("write_combined_context to a file sink", lambda: manager.write_combined_context(sink))
+
+if __name__ == '__main__':
+    main()
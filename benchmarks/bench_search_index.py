@@ -0,0 +1,63 @@
+"""Measure BM25 index build, incremental update and query latency on a synthetic project.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_search_index --tasks 50000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from llm_context_providers.asana_context_provider import DEFAULT_TASK_FIELDS, AsanaContextProvider, TaskRecord
+from llm_context_providers.search_index import BM25Index
+from llm_context_providers.benchmark.synthetic import VOCABULARY, make_tasks, words
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=50000)
+    parser.add_argument('--stories', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--changed', type=int, default=500)
+    args = parser.parse_args()
+
+    tasks = make_tasks(args.tasks, args.stories)
+    fields = DEFAULT_TASK_FIELDS.values()
+    texts = {task['gid']: AsanaContextProvider._index_text(TaskRecord.from_dict(task, fields)) for task in tasks}
+
+    index = BM25Index()
+    start = time.perf_counter()
+    for task in tasks:
+        index.add(task['gid'], texts[task['gid']], task['modified_at'])
+    build = time.perf_counter() - start
+    print(f"build {len(tasks)} tasks: {build:.2f} s ({len(tasks) / build:,.0f} tasks/s), {len(index.postings)} terms")
+
+    rng = random.Random(1)
+    changed = rng.sample(tasks, min(args.changed, len(tasks)))
+    start = time.perf_counter()
+    for task in changed:
+        index.add(task['gid'], texts[task['gid']] + " updated", task['modified_at'] + "x")
+    update = time.perf_counter() - start
+    print(f"re-index {len(changed)} changed tasks: {update * 1000:.1f} ms")
+
+    index.search("warm up")
+    query_sets = {
+        "specific terms": lambda: " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 3))),
+        "frequency-weighted terms": lambda: words(rng, rng.randint(1, 3)),
+    }
+    for label, make_query in query_sets.items():
+        latencies = []
+        for _ in range(args.queries):
+            query = make_query()
+            start = time.perf_counter()
+            index.search(query, limit=10)
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"query latency, {label}: p50 {statistics.median(latencies):.2f} ms, "
+              f"p99 {percentile(latencies, 0.99):.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Compare warm starts from the JSON and the memory-mapped binary snapshot cache: load time, time to full
+materialization and resident memory in fresh processes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_snapshot_format --tasks 50000 --processes 4
+
+The project is fetched once from the local fake Asana API and saved with both backends. Each load then runs in
+new processes, all holding the snapshot at once, so "shared" shows the mapped pages they have in common. The
+JSON backend parses and builds every task up front; the mmap backend decodes a task only when it is used.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from llm_context_providers.asana_context_provider import AsanaContextProvider
+from llm_context_providers.snapshot_cache import create_snapshot_cache
+from llm_context_providers.benchmark.fake_server import FakeAsanaServer
+from llm_context_providers.benchmark.synthetic import make_project, make_tasks
+
+BACKENDS = ("file", "mmap")
+CACHE_KEY = "asana-benchmark"
+
+def memory():
+    # Resident, private and proportional (shared pages split between their processes) memory in MB
+    values = {}
+    for path in ("/proc/self/status", "/proc/self/smaps_rollup"):
+        try:
+            with open(path) as file:
+                for line in file:
+                    key, _, value = line.partition(":")
+                    if value.strip().endswith("kB"):
+                        values[key] = int(value.split()[0]) / 1024
+        except OSError:
+            pass
+    private = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return {'rss': values.get('VmRSS', 0), 'private': private, 'pss': values.get('Pss', 0),
+            'shared': values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0)}
+
+def child(backend, path, project_id, host):
+    start = time.perf_counter()
+    provider = AsanaContextProvider(project_id=project_id, personal_access_token="benchmark-token", host=host)
+    provider.attach_cache(create_snapshot_cache({'backend': backend, 'path': path}), CACHE_KEY)
+    provider.load_from_cache()
+    context = provider.get_context()
+    loaded = time.perf_counter() - start
+    print("ready", flush=True)
+    sys.stdin.readline()
+    after_load = memory()
+    start = time.perf_counter()
+    # Everything a full render or a refresh could touch
+    for task in provider._snapshot.tasks.values():
+        task.stories
+    len(list(provider._snapshot.sections.values()))
+    materialized = loaded + time.perf_counter() - start
+    print(json.dumps({'load': loaded, 'materialize': materialized, 'context': len(context),
+                      'after_load': after_load, 'after_materialize': memory()}), flush=True)
+
+def run_processes(backend, path, project_id, host, count):
+    command = [sys.executable, "-m", "benchmarks.bench_snapshot_format", "--child", backend, path, project_id, host]
+    processes = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                 for _ in range(count)]
+    # Memory is read once every process holds the snapshot, so mapped pages are counted as shared
+    for process in processes:
+        if process.stdout.readline().strip() != "ready":
+            raise RuntimeError(f"{backend} load failed")
+    results = []
+    for process in processes:
+        output, _ = process.communicate("go\n")
+        results.append(json.loads(output))
+    return results
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(*sys.argv[2:6])
+        return
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=50000)
+    parser.add_argument('--stories', type=int, default=5, help="stories per task")
+    parser.add_argument('--processes', type=int, default=4, help="processes loading each backend at once")
+    args = parser.parse_args()
+
+    project = make_project()
+    server = FakeAsanaServer(project, make_tasks(args.tasks, args.stories))
+    with server:
+        provider = AsanaContextProvider(project_id=project['gid'], personal_access_token="benchmark-token",
+                                        host=server.url, requests_per_minute=10 ** 7)
+        provider.fetch_context()
+        # Children only read the cache, but the host is part of the provider's config
+        host = server.url
+    print(f"{args.tasks} tasks, {args.stories} stories each, {args.processes} processes per backend")
+    print(f"{'backend':<8} {'file MB':>8} {'save s':>7} {'load s':>7} {'all tasks s':>11} {'RSS MB':>7} "
+          f"{'private MB':>10} {'shared MB':>9} {'PSS MB':>7} {'RSS after all MB':>16}")
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in BACKENDS:
+            path = os.path.join(directory, backend)
+            provider.attach_cache(create_snapshot_cache({'backend': backend, 'path': path}), CACHE_KEY)
+            start = time.perf_counter()
+            provider.save_to_cache()
+            saved = time.perf_counter() - start
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            results = run_processes(backend, path, project['gid'], host, args.processes)
+            if any(result['context'] != len(provider.get_context()) for result in results):
+                raise AssertionError(f"{backend} loaded a different context")
+            median = lambda key, field=None: statistics.median(
+                result[key][field] if field else result[key] for result in results)
+            print(f"{backend:<8} {size / 2 ** 20:>8.1f} {saved:>7.2f} {median('load'):>7.3f} "
+                  f"{median('materialize'):>11.2f} {median('after_load', 'rss'):>7.1f} "
+                  f"{median('after_load', 'private'):>10.1f} {median('after_load', 'shared'):>9.1f} "
+                  f"{median('after_load', 'pss'):>7.1f} {median('after_materialize', 'rss'):>16.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Compare requests, response bytes and held stories for each story policy against the local fake Asana API.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_story_policies --tasks 500 --stories 300
+
+Asana cannot filter stories by type or date, so comment-only, max and since policies save memory and context
+size but still page through every story. Skipping completed tasks and max_stories=0 save whole requests.
+"""
+import argparse
+import time
+
+from llm_context_providers.asana_context_provider import AsanaContextProvider
+from llm_context_providers.benchmark.fake_server import FakeAsanaServer
+from llm_context_providers.benchmark.synthetic import make_project, make_tasks
+
+POLICIES = {
+    "all stories": {},
+    "comments only": {'story_types': "comments"},
+    "newest 20": {'max_stories': 20},
+    "since 2024-06-01": {'stories_since': "2024-06-01"},
+    "skip completed": {'skip_completed_stories': True},
+    "comments, newest 20, skip completed": {'story_types': "comments", 'max_stories': 20,
+                                            'skip_completed_stories': True},
+    "no stories": {'max_stories': 0},
+}
+
+def measure(server, project, options):
+    provider = AsanaContextProvider(project_id=project['gid'], personal_access_token="benchmark-token",
+                                    host=server.url, requests_per_minute=10 ** 7, **options)
+    server.reset_counts()
+    start = time.perf_counter()
+    provider.fetch_context()
+    elapsed = time.perf_counter() - start
+    stories = sum(len(task.stories) for task in provider._snapshot.tasks.values())
+    return sum(server.request_counts.values()), server.response_bytes, stories, len(provider.get_context()), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=500)
+    parser.add_argument('--stories', type=int, default=300, help="stories per task")
+    args = parser.parse_args()
+
+    project = make_project()
+    server = FakeAsanaServer(project, make_tasks(args.tasks, args.stories))
+    print(f"{args.tasks} tasks, {args.stories} stories each")
+    print(f"{'policy':<38} {'requests':>8} {'response MB':>12} {'stories held':>13} {'context MB':>11} {'seconds':>8}")
+    with server:
+        results = {label: measure(server, project, options) for label, options in POLICIES.items()}
+    for label, (requests, received, stories, context, elapsed) in results.items():
+        print(f"{label:<38} {requests:>8} {received / 2 ** 20:>12.1f} {stories:>13} {context / 2 ** 20:>11.1f} "
+              f"{elapsed:>8.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Measure semantic index build, incremental update and query latency at 10k and 100k chunks on CPU.
+
+Run from the repository root (needs NumPy):
+
+    python -m benchmarks.bench_vector_index --chunks 10000 100000
+
+Chunks are embedded with the hashing embedder, so build times show the cost of the index itself; a model
+embedder adds its own time per chunk. Queries are timed one at a time and in batches scored by a single
+matrix multiplication.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from llm_context_providers.asana_context_provider import DEFAULT_TASK_FIELDS, AsanaContextProvider, TaskRecord
+from llm_context_providers.vector_index import DEFAULT_CHUNK_WORDS, HashingEmbedder, VectorIndex, chunk_text
+from llm_context_providers.benchmark.synthetic import make_tasks, words
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def make_documents(chunks, stories, chunk_words):
+    # Just enough synthetic tasks to fill the requested number of chunks
+    fields = DEFAULT_TASK_FIELDS.values()
+    documents = []
+    total = 0
+    for task in make_tasks(chunks, stories):
+        record = TaskRecord.from_dict(task, fields)
+        text = AsanaContextProvider._index_text(record)
+        documents.append((record.gid, text, record.modified_at))
+        total += len(chunk_text(text, chunk_words))
+        if total >= chunks:
+            break
+    return documents
+
+def measure(documents, args):
+    index = VectorIndex(HashingEmbedder(args.dimensions), args.chunk_words)
+    start = time.perf_counter()
+    index.add_many(documents)
+    build = time.perf_counter() - start
+    matrix = index.chunk_count * index.dimensions * 4 / 2 ** 20
+    print(f"{index.chunk_count:,} chunks from {len(documents):,} tasks: build {build:.2f} s "
+          f"({index.chunk_count / build:,.0f} chunks/s), matrix {matrix:.1f} MB")
+
+    rng = random.Random(1)
+    changed = rng.sample(documents, max(1, len(documents) // 100))
+    embedded = index.embedded_chunks
+    start = time.perf_counter()
+    index.add_many((doc_id, text + " updated", version + 1) for doc_id, text, version in changed)
+    update = time.perf_counter() - start
+    print(f"  re-index {len(changed)} changed tasks: {update * 1000:.1f} ms, "
+          f"{index.embedded_chunks - embedded} chunks re-embedded")
+
+    queries = [words(rng, rng.randint(1, 4)) for _ in range(args.queries)]
+    index.search("warm up")
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, limit=args.limit)
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"  one query at a time: p50 {statistics.median(latencies):.2f} ms, p99 {percentile(latencies, 0.99):.2f} ms")
+
+    start = time.perf_counter()
+    for offset in range(0, len(queries), args.batch):
+        index.search_many(queries[offset:offset + args.batch], limit=args.limit)
+    batched = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"  batches of {args.batch}: {batched:.2f} ms per query ({statistics.median(latencies) / batched:.1f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--stories', type=int, default=3)
+    parser.add_argument('--dimensions', type=int, default=256)
+    parser.add_argument('--chunk-words', type=int, default=DEFAULT_CHUNK_WORDS)
+    parser.add_argument('--queries', type=int, default=256)
+    parser.add_argument('--batch', type=int, default=32)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    for chunks in args.chunks:
+        measure(make_documents(chunks, args.stories, args.chunk_words), args)
+
+if __name__ == '__main__':
+    main()
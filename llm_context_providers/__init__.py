@@ -1,6 +1,5 @@
 from .context_manager import ContextManager
 from .context_provider import ContextProvider, Status
-from .asana_context_provider import AsanaContextProvider
 
 __all__ = [
     'ContextManager',
@@ -8,3 +7,10 @@ __all__ = [
     'Status',
     'AsanaContextProvider'
 ]
+
+def __getattr__(name):
+    # Provider classes are imported on first access so that importing the package stays cheap
+    if name == 'AsanaContextProvider':
+        from .asana_context_provider import AsanaContextProvider
+        return AsanaContextProvider
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
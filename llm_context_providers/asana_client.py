@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+
+DEFAULT_HOST = "https://app.asana.com/api/1.0"
+# Asana's documented limit for free workspaces; paid workspaces allow 1500
+DEFAULT_REQUESTS_PER_MINUTE = 150
+DEFAULT_POOL_SIZE = 20
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+MAX_BACKOFF = 60
+
+class TokenBucket:
+    def __init__(self, requests_per_minute, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive.")
+        self.rate = requests_per_minute / 60.0
+        self.capacity = capacity or requests_per_minute
+        self.tokens = float(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until a request may be sent and returns how long it waited
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        # Holds back every caller sharing this bucket, e.g. for a 429 Retry-After
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+class AsanaClient:
+    def __init__(self, personal_access_token, host=DEFAULT_HOST, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 pool_size=DEFAULT_POOL_SIZE):
+        # The SDK takes most of a second to import, so it is only loaded once a client is needed
+        import asana
+        from urllib3.util.retry import Retry
+        configuration = asana.Configuration()
+        configuration.access_token = personal_access_token
+        configuration.host = host
+        configuration.connection_pool_maxsize = pool_size
+        self.api_client = asana.ApiClient(configuration)
+        # urllib3 would otherwise sleep through 429/503 Retry-After on its own; leave those to the
+        # provider's retry loop so the pause applies to every provider sharing this token
+        self.api_client.rest_client.pool_manager.connection_pool_kw['retries'] = Retry(
+            total=3, respect_retry_after_header=False)
+        self.projects_api = asana.ProjectsApi(self.api_client)
+        self.portfolios_api = asana.PortfoliosApi(self.api_client)
+        self.tasks_api = asana.TasksApi(self.api_client)
+        self.stories_api = asana.StoriesApi(self.api_client)
+        self.batch_api = asana.BatchAPIApi(self.api_client)
+        self.rate_limiter = TokenBucket(requests_per_minute)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_shared_client(personal_access_token, host=DEFAULT_HOST, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                      pool_size=DEFAULT_POOL_SIZE):
+    # One client, connection pool and rate limiter per token; the first caller's settings win
+    key = (personal_access_token, host)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = AsanaClient(personal_access_token, host, requests_per_minute, pool_size)
+            _clients[key] = client
+        return client
+
+def clear_shared_clients():
+    with _clients_lock:
+        _clients.clear()
+
+def api_error_type():
+    # Resolved when an error is handled, so importing the provider does not load the asana SDK
+    from asana.rest import ApiException
+    return ApiException
+
+def retry_after_seconds(exception):
+    headers = getattr(exception, 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+def backoff_delay(attempt, base_delay, max_delay=MAX_BACKOFF):
+    # Exponential backoff with equal jitter: half the step is fixed, half is random
+    step = min(max_delay, base_delay * 2 ** attempt)
+    return step / 2 + random.uniform(0, step / 2)
@@ -1,11 +1,30 @@
 import os
-import asana
-from asana.rest import ApiException
-from datetime import datetime
-from dateutil import parser
-import pytz
+import asyncio
+import collections
+import copy
+import functools
+import hashlib
+import importlib.util
+import itertools
+import logging
+import math
+import re
+import sys
+import threading
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
 import time
 from .context_provider import ContextProvider, Status
+from .search_index import BM25Index
+from .snapshot_format import LazyMapping, MappedSnapshot
+from .render_pool import RENDER_POOLS, discard_render_pool, get_render_pool
+from .token_budget import cached_token_count
+from .asana_client import (
+    DEFAULT_HOST, DEFAULT_POOL_SIZE, DEFAULT_REQUESTS_PER_MINUTE, RETRYABLE_STATUSES,
+    api_error_type, backoff_delay, get_shared_client, retry_after_seconds
+)
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_TASK_FIELDS = {
     "Task": "name",
@@ -18,133 +37,1332 @@ DEFAULT_TASK_FIELDS = {
     "Notes": "notes"
 }
 
+FETCH_MODES = ("batch", "per_task")
+# Set from the shared client the first time any of them is used
+CLIENT_ATTRIBUTES = ('client', 'api_client', 'projects_api', 'portfolios_api', 'tasks_api', 'stories_api', 'batch_api')
+# Asana accepts at most 10 actions per batch request and 100 items per page
+STORY_BATCH_SIZE = 10
+MAX_PAGE_SIZE = 100
+# Stories are only ever rendered or indexed through these fields
+STORY_OPT_FIELDS = "created_at,created_by.name,text"
+# "comments" keeps only comments, dropping system events such as assignment and field changes
+STORY_TYPES = ("all", "comments")
+# "keyword" is a BM25 index; "semantic" embeds chunks of each task and needs NumPy
+INDEX_TYPES = ("keyword", "semantic")
+
+# Asana timestamps look like 2024-07-10T12:34:56.789Z and dates like 2024-07-10
+ISO_DATETIME_RE = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?(Z|[+-]\d{2}:\d{2})$'
+)
+ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Incremental refreshes ask for changes since the previous one started, less this margin, so a task saved
+# by a server whose clock is behind ours is still picked up. Tasks fetched twice reuse their rendered section.
+MODIFIED_SINCE_MARGIN = timedelta(seconds=60)
+FORMAT_DATE_CACHE_SIZE = 65536
+# Below this many tasks per chunk, handing work to a pool costs more than it saves
+MIN_RENDER_CHUNK = 250
+# Trimmed contexts kept per published snapshot, one per budget and counting function
+MAX_BUDGET_RESULTS = 4
+
 class AsanaContextProvider(ContextProvider):
-    def __init__(self, project_id, personal_access_token=None, fields=None, timezone="America/Toronto", **kwargs):
+    def __init__(self, project_id=None, personal_access_token=None, fields=None, timezone="America/Toronto", max_concurrency=10,
+                 fetch_mode="batch", page_size=MAX_PAGE_SIZE, host=DEFAULT_HOST,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, pool_size=DEFAULT_POOL_SIZE,
+                 portfolio_id=None, team_id=None, workspace_id=None, render_workers=0, render_pool="thread",
+                 render_chunk_size=None, story_types="all", max_stories=None, stories_since=None,
+                 skip_completed_stories=False, index_type="keyword", embedder=None, **kwargs):
         super().__init__()
         self.personal_access_token = personal_access_token or os.getenv('ASANA_PERSONAL_ACCESS_TOKEN')
         self.project_id = project_id
+        self.project_ids = _as_list(project_id)
+        # Portfolios, teams and workspaces are expanded into their projects on every fetch
+        self.project_selectors = [
+            (kind, gid)
+            for kind, ids in (("portfolio", portfolio_id), ("team", team_id), ("workspace", workspace_id))
+            for gid in _as_list(ids)
+        ]
         self.fields = fields or DEFAULT_TASK_FIELDS
         self.TIMEZONE = timezone
+        self.max_concurrency = max_concurrency
+        self.fetch_mode = fetch_mode
+        self.page_size = page_size
+        self.render_workers = render_workers
+        self.render_pool = render_pool
+        self.render_chunk_size = render_chunk_size
+        self.story_policy = StoryPolicy(story_types, max_stories, stories_since, skip_completed_stories, timezone)
+        task_fields = list(self.fields.values())
+        if self.story_policy.skip_completed and 'completed' not in task_fields:
+            # Telling completed tasks apart needs their completed flag even when it is not rendered
+            task_fields.append('completed')
+        self.task_opt_fields = ",".join(task_fields)
+        self.index_type = index_type
+        self.embedder = embedder
+        self.request_counts = {}
+        self._request_counts_lock = threading.Lock()
+        self._executor = None
+        self._snapshot = None
+        self._index = None
+        self._render_cache = RenderCache()
+        self._render_stats_start = (0, 0)
+        # Guards the search index against a background refresh updating it mid-search
+        self._index_lock = threading.RLock()
+        # False while context_info holds search results rather than the whole project
+        self._context_is_full = True
+        # Contexts trimmed to a budget, by (budget, count_tokens, timezone), for _budget_snapshot only
+        self._budget_results = collections.OrderedDict()
+        self._budget_snapshot = None
+        self._budget_lock = threading.Lock()
 
         if not self.personal_access_token:
             raise ValueError("Asana personal access token is not set. Please provide it as an argument or define it in the environment variables.")
 
-        if not self.project_id:
+        if not self.project_ids and not self.project_selectors:
             raise ValueError("Asana project ID is not set. Please ensure it is defined in the config.yml file.")
 
-        configuration = asana.Configuration()
-        configuration.access_token = self.personal_access_token
-        self.api_client = asana.ApiClient(configuration)
-        self.projects_api = asana.ProjectsApi(self.api_client)
-        self.tasks_api = asana.TasksApi(self.api_client)
-        self.stories_api = asana.StoriesApi(self.api_client)
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1.")
+
+        if fetch_mode not in FETCH_MODES:
+            raise ValueError(f"Unknown fetch_mode '{fetch_mode}'. Expected one of: {', '.join(FETCH_MODES)}.")
+
+        if not 1 <= page_size <= MAX_PAGE_SIZE:
+            raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}.")
+
+        if render_workers < 0:
+            raise ValueError("render_workers must not be negative.")
+
+        if render_pool not in RENDER_POOLS:
+            raise ValueError(f"Unknown render_pool '{render_pool}'. Expected one of: {', '.join(RENDER_POOLS)}.")
+
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index_type '{index_type}'. Expected one of: {', '.join(INDEX_TYPES)}.")
+
+        # NumPy is only imported when the index is first built, but a missing install is reported now
+        if index_type == "semantic" and importlib.util.find_spec("numpy") is None:
+            raise ImportError("index_type 'semantic' requires NumPy. Install it with "
+                              "`pip install llm-context-providers[semantic]`.")
+
+        self._client_settings = (host, requests_per_minute, pool_size)
+
+    def __getattr__(self, name):
+        # The SDK client is created on first use, so constructing a provider loads nothing heavy
+        if name in CLIENT_ATTRIBUTES and '_client_settings' in self.__dict__:
+            self._connect()
+            return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def _connect(self):
+        # Providers sharing a token share one connection pool and one rate limiter
+        client = get_shared_client(self.personal_access_token, *self._client_settings)
+        self.__dict__.setdefault('client', client)
+        for name in CLIENT_ATTRIBUTES[1:]:
+            self.__dict__.setdefault(name, getattr(client, name))
 
     async def fetch_context_async(self, full_fetch: bool = False):
         self.update_status(Status.FETCHING)
+        self.reset_request_counts()
+        self.begin_metrics()
         try:
-            project = await self.get_project_info()
-            if project:
-                tasks = await self.get_tasks_info()
-                formatter = MarkdownFormatter()
-                self.context_info = formatter.generate_project_markdown(project, tasks, self.fields, self.TIMEZONE)
+            fetched_at = (datetime.now(timezone.utc) - MODIFIED_SINCE_MARGIN).isoformat()
+            with self.metrics.phase('fetch_projects'):
+                project_gids = await self.get_project_ids()
+                projects = await asyncio.gather(*(self.get_project_info(project_gid=gid) for gid in project_gids))
+            if projects and all(projects):
+                if full_fetch or self._snapshot is None:
+                    snapshot = TaskSnapshot(await self.get_tasks_info(project_gids=project_gids), fetched_at)
+                else:
+                    snapshot = self._snapshot.copy()
+                    homes, changed = await self.get_task_changes(snapshot.fetched_at, snapshot.tasks,
+                                                                 project_gids=project_gids)
+                    snapshot.apply_changes(homes, changed, fetched_at)
+                await self._publish_snapshot_async(snapshot, dict(zip(project_gids, projects)), rebuild=full_fetch)
                 self.update_status(Status.FRESH)
             else:
                 self.update_status(Status.STALE)
         except Exception as e:
             self.update_status(Status.STALE)
+            self.end_metrics(e)
             raise RuntimeError(f"Failed to fetch context: {e}")
+        self.end_metrics()
 
     def fetch_context(self, full_fetch: bool = False):
         self.update_status(Status.FETCHING)
+        self.reset_request_counts()
+        self.begin_metrics()
         try:
-            project = self.get_project_info_sync()
-            if project:
-                tasks = self.get_tasks_info_sync()
-                formatter = MarkdownFormatter()
-                self.context_info = formatter.generate_project_markdown(project, tasks, self.fields, self.TIMEZONE)
+            fetched_at = (datetime.now(timezone.utc) - MODIFIED_SINCE_MARGIN).isoformat()
+            with self.metrics.phase('fetch_projects'):
+                project_gids = self.get_project_ids_sync()
+                projects = self._map_sync(lambda gid: self.get_project_info_sync(project_gid=gid), project_gids)
+            if projects and all(projects):
+                if full_fetch or self._snapshot is None:
+                    snapshot = TaskSnapshot(self.get_tasks_info_sync(project_gids=project_gids), fetched_at)
+                else:
+                    snapshot = self._snapshot.copy()
+                    homes, changed = self.get_task_changes_sync(snapshot.fetched_at, snapshot.tasks,
+                                                                project_gids=project_gids)
+                    snapshot.apply_changes(homes, changed, fetched_at)
+                self._publish_snapshot(snapshot, dict(zip(project_gids, projects)), rebuild=full_fetch)
                 self.update_status(Status.FRESH)
             else:
                 self.update_status(Status.STALE)
         except Exception as e:
             self.update_status(Status.STALE)
+            self.end_metrics(e)
             raise RuntimeError(f"Failed to fetch context: {e}")
+        self.end_metrics()
+
+    async def stream_context_async(self, max_buffered=None, retries=3, delay=2):
+        # Renders each task as soon as its page and stories arrive, so the first sections can be sent
+        # on while later pages are still downloading. At most max_buffered listed tasks wait to be
+        # yielded before the next page is requested. Unchanged tasks reuse their rendered section.
+        max_buffered = max_buffered or 2 * self.page_size
+        self.update_status(Status.FETCHING)
+        self.reset_request_counts()
+        metrics = self.begin_metrics()
+        pending = collections.deque()
+        completed = False
+        try:
+            fetched_at = (datetime.now(timezone.utc) - MODIFIED_SINCE_MARGIN).isoformat()
+            with metrics.phase('fetch_projects'):
+                project_gids = await self.get_project_ids(retries, delay)
+                projects = await asyncio.gather(*(self.get_project_info(retries, delay, project_gid=gid) for gid in project_gids))
+            if not projects or not all(projects):
+                self.update_status(Status.STALE)
+                completed = True
+                self.end_metrics()
+                return
+            formatter = MarkdownFormatter()
+            self._render_cache.validate(self.fields, self.TIMEZONE)
+            previous = self._snapshot
+            snapshot = TaskSnapshot([], fetched_at)
+            homes = {}
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def enrich(unit):
+                async with semaphore:
+                    metrics.increment('tasks_enriched', len(unit))
+                    if self.fetch_mode == "per_task":
+                        return [await self._call_async(self._get_task_details, unit[0]['gid'], retries=retries, delay=delay)]
+                    return await self._call_async(self._enrich_batch, unit, retries=retries, delay=delay)
+
+            async def take():
+                gid, source = pending.popleft()
+                if isinstance(source, TaskRecord):
+                    record = source
+                    if gid in previous.token_counts and gid in previous.sections:
+                        snapshot.token_counts[gid] = previous.token_counts[gid]
+                else:
+                    record = next(task for task in await source if task['gid'] == gid)
+                    record.project = homes[gid]
+                snapshot.tasks[gid] = record
+                snapshot.order.append(gid)
+                return self._render_section(snapshot, gid, formatter)
+
+            for project_gid, project in zip(project_gids, projects):
+                snapshot.headers[project_gid] = formatter.generate_project_header(project, self.TIMEZONE)
+                yield snapshot.headers[project_gid]
+                async for page in self._iter_task_pages(project_gid, retries, delay):
+                    metrics.increment('tasks_listed', len(page))
+                    page = [task for task in page if task['gid'] not in homes]
+                    sources = {}
+                    new_tasks = []
+                    for task in page:
+                        homes[task['gid']] = project_gid
+                        known = previous.tasks.get(task['gid']) if previous else None
+                        if (known is not None and 'modified_at' in task
+                                and known.version() == _to_epoch_us(task['modified_at'])
+                                and self._render_cache.contains(task['gid'], known.version())):
+                            sources[task['gid']] = known if known.get('project') == project_gid else known.replace(project=project_gid)
+                        else:
+                            new_tasks.append(task)
+                    units = self._story_batches(new_tasks) if self.fetch_mode == "batch" else [[task] for task in new_tasks]
+                    for unit in units:
+                        future = asyncio.ensure_future(enrich(unit))
+                        sources.update((task['gid'], future) for task in unit)
+                    pending.extend((task['gid'], sources[task['gid']]) for task in page)
+                    # Hand on whatever is ready, and hold back the next page while too much is buffered
+                    while pending and (len(pending) > max_buffered or _is_ready(pending[0][1])):
+                        yield await take()
+                # The next project's header must follow all of this project's sections
+                while pending:
+                    yield await take()
+            self._render_cache.retain(snapshot.tasks)
+            self._swap_snapshot(snapshot, snapshot.join(snapshot.sections))
+            self.update_status(Status.FRESH)
+            completed = True
+            self.end_metrics()
+        except Exception as e:
+            self.update_status(Status.STALE)
+            completed = True
+            self.end_metrics(e)
+            raise RuntimeError(f"Failed to fetch context: {e}")
+        finally:
+            for _, source in pending:
+                if not isinstance(source, TaskRecord):
+                    source.cancel()
+            if not completed:
+                # The consumer stopped early; the previous snapshot and context stay in place
+                self.update_status(Status.STALE)
+                self.end_metrics("stream closed before it finished")
 
     def get_context(self):
         return self.context_info
 
-    async def get_project_info(self, retries=3, delay=2):
-        for attempt in range(retries):
-            try:
-                project = self.projects_api.get_project(self.project_id, {})
-                return project
-            except ApiException as e:
-                if e.status == 503 and attempt < retries - 1:
-                    print(f"Service unavailable, retrying in {delay} seconds...")
-                    time.sleep(delay)
-                else:
-                    raise RuntimeError(f"Exception when calling ProjectsApi->get_project: {e}")
+    def export_snapshot(self):
+        if self._snapshot is None:
+            return None
+        data = self._snapshot.to_dict()
+        # Embeddings are not persisted; a semantic index is rebuilt on its first search after a restart
+        data['index'] = self._index.to_dict() if isinstance(self._index, BM25Index) else None
+        return data
 
-    def get_project_info_sync(self, retries=3, delay=2):
-        for attempt in range(retries):
+    def import_snapshot(self, data):
+        self._snapshot = TaskSnapshot.from_dict(data) if data else None
+        index = data.get('index') if data else None
+        self._index = BM25Index.from_dict(index) if index and self.index_type == "keyword" else None
+        # Persisted sections were rendered with this provider's config, which is part of the cache key.
+        # They back the render cache until the next render, so loading does not touch every task.
+        self._render_cache.clear()
+        self._render_cache.validate(self.fields, self.TIMEZONE)
+        if self._snapshot is not None:
+            self._render_cache.back(self._snapshot.tasks, self._snapshot.sections)
+
+    def get_render_stats(self):
+        return self._render_cache.stats()
+
+    def begin_metrics(self):
+        metrics = super().begin_metrics()
+        if metrics.enabled:
+            self._render_stats_start = (self._render_cache.hits, self._render_cache.misses)
+        return metrics
+
+    def metrics_details(self):
+        # Render cache figures cover this refresh only; the cache's own stats() are cumulative
+        start_hits, start_misses = self._render_stats_start
+        hits = self._render_cache.hits - start_hits
+        misses = self._render_cache.misses - start_misses
+        return {
+            'requests': self.get_request_counts(),
+            'render_cache': {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else None}
+        }
+
+    def get_request_counts(self):
+        with self._request_counts_lock:
+            return dict(self.request_counts)
+
+    def reset_request_counts(self):
+        with self._request_counts_lock:
+            self.request_counts = {}
+
+    async def get_project_ids(self, retries=3, delay=2):
+        try:
+            listings = await asyncio.gather(*(
+                self._call_async(self._list_selected_projects, kind, gid, retries=retries, delay=delay)
+                for kind, gid in self.project_selectors
+            ))
+        except api_error_type() as e:
+            raise RuntimeError(f"Exception when listing Asana projects: {e}")
+        return list(dict.fromkeys(self.project_ids + [gid for listing in listings for gid in listing]))
+
+    def get_project_ids_sync(self, retries=3, delay=2):
+        try:
+            listings = self._map_sync(
+                lambda selector: self._call_sync(self._list_selected_projects, *selector, retries=retries, delay=delay),
+                self.project_selectors)
+        except api_error_type() as e:
+            raise RuntimeError(f"Exception when listing Asana projects: {e}")
+        return list(dict.fromkeys(self.project_ids + [gid for listing in listings for gid in listing]))
+
+    async def get_project_info(self, retries=3, delay=2, project_gid=None):
+        try:
+            return await self._call_async(self._api_call, 'get_project', self.projects_api.get_project,
+                                          project_gid or self.project_ids[0], {}, retries=retries, delay=delay)
+        except api_error_type() as e:
+            raise RuntimeError(f"Exception when calling ProjectsApi->get_project: {e}")
+
+    def get_project_info_sync(self, retries=3, delay=2, project_gid=None):
+        try:
+            return self._call_sync(self._api_call, 'get_project', self.projects_api.get_project,
+                                   project_gid or self.project_ids[0], {}, retries=retries, delay=delay)
+        except api_error_type() as e:
+            raise RuntimeError(f"Exception when calling ProjectsApi->get_project: {e}")
+
+    async def get_tasks_info(self, retries=3, delay=2, project_gids=None):
+        project_gids = project_gids or self.project_ids
+        try:
+            with self.metrics.phase('list_tasks'):
+                listings = await asyncio.gather(*(
+                    self._call_async(self._list_tasks, gid, retries=retries, delay=delay) for gid in project_gids
+                ))
+            homes = self._task_homes(project_gids, listings)
+            self.metrics.increment('tasks_listed', len(homes))
+            tasks = await self._enrich_tasks(self._unique_tasks(listings), retries, delay)
+            return self._assign_projects(tasks, homes)
+        except api_error_type() as e:
+            raise RuntimeError(f"Exception when calling TasksApi->get_tasks: {e}")
+
+    def get_tasks_info_sync(self, retries=3, delay=2, project_gids=None):
+        project_gids = project_gids or self.project_ids
+        try:
+            with self.metrics.phase('list_tasks'):
+                listings = self._map_sync(lambda gid: self._call_sync(self._list_tasks, gid, retries=retries, delay=delay),
+                                          project_gids)
+            homes = self._task_homes(project_gids, listings)
+            self.metrics.increment('tasks_listed', len(homes))
+            tasks = self._enrich_tasks_sync(self._unique_tasks(listings), retries, delay)
+            return self._assign_projects(tasks, homes)
+        except api_error_type() as e:
+            raise RuntimeError(f"Exception when calling TasksApi->get_tasks: {e}")
+
+    async def get_task_changes(self, since, known_tasks, retries=3, delay=2, project_gids=None):
+        project_gids = project_gids or self.project_ids
+        try:
+            with self.metrics.phase('list_tasks'):
+                listings = await asyncio.gather(*(
+                    self._call_async(self._list_task_gids, gid, retries=retries, delay=delay) for gid in project_gids
+                ), *(
+                    self._call_async(self._list_modified_tasks, gid, since, retries=retries, delay=delay) for gid in project_gids
+                ))
+            homes = self._task_homes(project_gids, listings[:len(project_gids)])
+            self.metrics.increment('tasks_listed', len(homes))
+            changed = self._changed_tasks(homes, self._unique_tasks(listings[len(project_gids):]), known_tasks)
+            return homes, self._assign_projects(await self._enrich_tasks(changed, retries, delay), homes)
+        except api_error_type() as e:
+            raise RuntimeError(f"Exception when calling TasksApi->get_tasks: {e}")
+
+    def get_task_changes_sync(self, since, known_tasks, retries=3, delay=2, project_gids=None):
+        project_gids = project_gids or self.project_ids
+        try:
+            with self.metrics.phase('list_tasks'):
+                listings = self._map_sync(
+                    lambda call: self._call_sync(*call, retries=retries, delay=delay),
+                    [(self._list_task_gids, gid) for gid in project_gids] +
+                    [(self._list_modified_tasks, gid, since) for gid in project_gids])
+            homes = self._task_homes(project_gids, listings[:len(project_gids)])
+            self.metrics.increment('tasks_listed', len(homes))
+            changed = self._changed_tasks(homes, self._unique_tasks(listings[len(project_gids):]), known_tasks)
+            return homes, self._assign_projects(self._enrich_tasks_sync(changed, retries, delay), homes)
+        except api_error_type() as e:
+            raise RuntimeError(f"Exception when calling TasksApi->get_tasks: {e}")
+
+    @staticmethod
+    def _task_homes(project_gids, listings):
+        # A task multi-homed in several selected projects is fetched and rendered once, under the first of them
+        homes = {}
+        for project_gid, listing in zip(project_gids, listings):
+            for task in listing:
+                homes.setdefault(task['gid'], project_gid)
+        return homes
+
+    @staticmethod
+    def _unique_tasks(listings):
+        tasks = {}
+        for listing in listings:
+            for task in listing:
+                tasks.setdefault(task['gid'], task)
+        return list(tasks.values())
+
+    @staticmethod
+    def _assign_projects(tasks, homes):
+        for task in tasks:
+            task.project = homes.get(task['gid'])
+        return tasks
+
+    def _changed_tasks(self, homes, modified, known_tasks):
+        changed = [task for task in modified if task['gid'] in homes]
+        # Tasks we have never seen but that were not reported as modified still need fetching
+        seen = known_tasks.keys() | {task['gid'] for task in changed}
+        changed.extend({'gid': gid} for gid in homes if gid not in seen)
+        return changed
+
+    async def _enrich_tasks(self, tasks, retries, delay):
+        self.metrics.increment('tasks_enriched', len(tasks))
+        with self.metrics.phase('enrich_tasks'):
+            return await self._enrich_tasks_concurrently(tasks, retries, delay)
+
+    async def _enrich_tasks_concurrently(self, tasks, retries, delay):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def enrich(task):
+            async with semaphore:
+                return await self._call_async(self._get_task_details, task['gid'], retries=retries, delay=delay)
+
+        async def enrich_batch(batch):
+            async with semaphore:
+                return await self._call_async(self._enrich_batch, batch, retries=retries, delay=delay)
+
+        # gather keeps results in the order the tasks were listed
+        if self.fetch_mode == "per_task":
+            return list(await asyncio.gather(*(enrich(task) for task in tasks)))
+        batches = await asyncio.gather(*(enrich_batch(batch) for batch in self._story_batches(tasks)))
+        return [task for batch in batches for task in batch]
+
+    def _enrich_tasks_sync(self, tasks, retries, delay):
+        self.metrics.increment('tasks_enriched', len(tasks))
+        with self.metrics.phase('enrich_tasks'):
+            if self.fetch_mode == "per_task":
+                return [self._call_sync(self._get_task_details, task['gid'], retries=retries, delay=delay) for task in tasks]
+            return [task for batch in self._story_batches(tasks)
+                    for task in self._call_sync(self._enrich_batch, batch, retries=retries, delay=delay)]
+
+    def _publish_snapshot(self, snapshot, projects, rebuild=False):
+        if self._keep_if_unchanged(snapshot, projects, rebuild):
+            return
+        with self.metrics.phase('render'):
+            missing = self._collect_sections(snapshot)
+            tasks = [snapshot.tasks[gid] for gid in missing]
+            sections = self._render_with_pool(lambda pool: render_task_sections(
+                tasks, self.fields, self.TIMEZONE, pool, self.render_workers, self.render_chunk_size))
+            context_info = self._finish_render(snapshot, missing, sections)
+        self._swap_snapshot(snapshot, context_info)
+
+    async def _publish_snapshot_async(self, snapshot, projects, rebuild=False):
+        # With render workers the event loop only waits on the pool, so it keeps serving while a large project renders
+        if self._keep_if_unchanged(snapshot, projects, rebuild):
+            return
+        with self.metrics.phase('render'):
+            missing = self._collect_sections(snapshot)
+            tasks = [snapshot.tasks[gid] for gid in missing]
+            pool = self._get_render_pool() if missing else None
             try:
-                project = self.projects_api.get_project(self.project_id, {})
-                return project
-            except ApiException as e:
-                if e.status == 503 and attempt < retries - 1:
-                    print(f"Service unavailable, retrying in {delay} seconds...")
-                    time.sleep(delay)
+                sections = await render_task_sections_async(tasks, self.fields, self.TIMEZONE, pool,
+                                                            self.render_workers, self.render_chunk_size)
+            except BrokenExecutor:
+                discard_render_pool(pool)
+                sections = render_task_sections(tasks, self.fields, self.TIMEZONE)
+            context_info = self._finish_render(snapshot, missing, sections)
+        self._swap_snapshot(snapshot, context_info)
+
+    def _keep_if_unchanged(self, snapshot, projects, rebuild=False):
+        # The headers are rendered first so that the snapshot's version covers everything the context is
+        # made of. When it matches the published snapshot's, the published context is already what
+        # rendering would produce, so it stays, along with its token counts and the index. A rebuild
+        # trusts nothing already rendered, so every section is rendered again.
+        formatter = MarkdownFormatter()
+        snapshot.headers = {gid: formatter.generate_project_header(project, self.TIMEZONE)
+                            for gid, project in projects.items()}
+        if rebuild:
+            self._render_cache.invalidate()
+            return False
+        current = self._snapshot
+        if current is None or not self._context_is_full:
+            return False
+        version = snapshot.content_version(self.fields, self.TIMEZONE)
+        if version is None or version != current.content_version(self.fields, self.TIMEZONE):
+            return False
+        # The next incremental refresh asks for changes since this one
+        current.fetched_at = snapshot.fetched_at
+        self.metrics.increment('unchanged_refreshes')
+        return True
+
+    def compute_context_version(self):
+        # Hashing gids and modification times is far cheaper than hashing megabytes of markdown
+        if self._snapshot is not None and self._context_is_full:
+            version = self._snapshot.content_version(self.fields, self.TIMEZONE)
+            if version is not None:
+                return version
+        return super().compute_context_version()
+
+    def _get_render_pool(self):
+        return get_render_pool(self.render_pool, self.render_workers) if self.render_workers else None
+
+    def _render_with_pool(self, render):
+        pool = self._get_render_pool()
+        try:
+            return render(pool)
+        except BrokenExecutor:
+            discard_render_pool(pool)
+            return render(None)
+
+    def _swap_snapshot(self, snapshot, context_info):
+        # The new snapshot is rendered aside and swapped in whole, so readers keep the previous
+        # context for as long as a refresh is in flight
+        self._snapshot = snapshot
+        self.context_info = context_info
+        self._context_is_full = True
+        if self._index is not None:
+            with self.metrics.phase('index'):
+                self._update_index()
+
+    def _collect_sections(self, snapshot):
+        # Fills in every section that is kept or cached and returns the gids that still need rendering
+        if not self._render_cache.validate(self.fields, self.TIMEZONE):
+            snapshot.sections.clear()
+            snapshot.token_counts.clear()
+        return [gid for gid in snapshot.order if self._cached_section(snapshot, gid) is None]
+
+    def _finish_render(self, snapshot, gids, sections):
+        for gid, section in zip(gids, sections):
+            self._render_cache.put(gid, snapshot.tasks[gid].version(), section)
+            snapshot.sections[gid] = section
+        self._render_cache.retain(snapshot.tasks)
+        return snapshot.join(snapshot.sections)
+
+    def _cached_section(self, snapshot, gid):
+        # Sections an incremental refresh kept are current; anything else comes from the render
+        # cache when the task's modified_at has not moved since it was last rendered
+        section = snapshot.sections.get(gid)
+        if section is not None:
+            self._render_cache.hits += 1
+            return section
+        section = self._render_cache.get(gid, snapshot.tasks[gid].version())
+        if section is not None:
+            snapshot.sections[gid] = section
+        return section
+
+    def _render_section(self, snapshot, gid, formatter):
+        section = self._cached_section(snapshot, gid)
+        if section is None:
+            task = snapshot.tasks[gid]
+            section = formatter.generate_task_markdown(task, self.fields, self.TIMEZONE)
+            self._render_cache.put(gid, task.version(), section)
+            snapshot.sections[gid] = section
+        return section
+
+    def get_context_within_budget(self, budget, count_tokens):
+        tokens = self.count_context_tokens(count_tokens)
+        if tokens <= budget or self._snapshot is None or not self._snapshot.headers or not self._context_is_full:
+            return super().get_context_within_budget(budget, count_tokens)
+        return self._trimmed_context(budget, count_tokens)
+
+    def _trimmed_context(self, budget, count_tokens):
+        # Trimming renders every open task several times over, so the result is kept until the
+        # snapshot is replaced and repeated assembly with the same budget costs a lookup
+        snapshot = self._snapshot
+        key = (budget, count_tokens, self.TIMEZONE)
+        with self._budget_lock:
+            if self._budget_snapshot is not snapshot:
+                self._budget_results.clear()
+                self._budget_snapshot = snapshot
+            result = self._budget_results.get(key)
+            if result is not None:
+                self._budget_results.move_to_end(key)
+                return result
+        result = self._render_within_budget(budget, count_tokens)
+        with self._budget_lock:
+            if self._budget_snapshot is snapshot:
+                self._budget_results[key] = result
+                if len(self._budget_results) > MAX_BUDGET_RESULTS:
+                    self._budget_results.popitem(last=False)
+        return result
+
+    def _render_within_budget(self, budget, count_tokens):
+        # Trim whole sections instead of cutting text: completed tasks go first, then the
+        # oldest stories of open tasks, then open tasks, least recently modified first.
+        # Token counts are summed per section, which is exact for character-based estimators.
+        snapshot = self._snapshot
+        available = budget - count_tokens("".join(snapshot.headers.values()))
+        if available < 0:
+            return None, 0
+        drop_order = sorted(snapshot.order, key=lambda gid: (not snapshot.tasks[gid].get('completed', False),
+                                                             snapshot.tasks[gid].sort_key()))
+        section_tokens = {gid: self._section_tokens(gid, count_tokens) for gid in snapshot.order}
+        sections = dict(snapshot.sections)
+        total = sum(section_tokens.values())
+
+        for gid in drop_order:
+            if total <= available or not snapshot.tasks[gid].get('completed', False):
+                break
+            total -= section_tokens.pop(gid)
+            del sections[gid]
+
+        if total > available:
+            formatter = MarkdownFormatter()
+
+            def render_with_recent_stories(limit):
+                rendered = {}
+                for gid in section_tokens:
+                    task = snapshot.tasks[gid]
+                    task = task.replace(stories=task.stories[-limit:] if limit else [])
+                    rendered[gid] = formatter.generate_task_markdown(task, self.fields, self.TIMEZONE)
+                return rendered, {gid: count_tokens(section) for gid, section in rendered.items()}
+
+            # Binary search for the largest number of recent stories per task that still fits
+            low, high = 0, max((len(snapshot.tasks[gid].stories) for gid in section_tokens), default=0)
+            while low < high:
+                limit = (low + high + 1) // 2
+                _, counts = render_with_recent_stories(limit)
+                if sum(counts.values()) <= available:
+                    low = limit
                 else:
-                    raise RuntimeError(f"Exception when calling ProjectsApi->get_project: {e}")
+                    high = limit - 1
+            sections, section_tokens = render_with_recent_stories(low)
+            total = sum(section_tokens.values())
+
+            for gid in drop_order:
+                if total <= available:
+                    break
+                if gid in section_tokens:
+                    total -= section_tokens.pop(gid)
+                    del sections[gid]
+
+        context = snapshot.join(sections)
+        return context, budget - available + total
+
+    def _section_tokens(self, gid, count_tokens):
+        snapshot = self._snapshot
+        return cached_token_count(snapshot.token_counts.setdefault(gid, {}), count_tokens, snapshot.sections[gid])
+
+    def _api_call(self, name, func, *args, **kwargs):
+        self.client.rate_limiter.acquire()
+        with self._request_counts_lock:
+            self.request_counts[name] = self.request_counts.get(name, 0) + 1
+        return func(*args, **kwargs)
+
+    def _list_page(self, name, func, args, opts, offset=None):
+        # Page through list endpoints ourselves so every page is counted and sized by page_size
+        opts = dict(opts, limit=self.page_size)
+        if offset:
+            opts['offset'] = offset
+        return self._api_call(name, func, *args, opts, full_payload=True)
+
+    def _paginate(self, name, func, *args, opts):
+        items = []
+        offset = None
+        while True:
+            response = self._list_page(name, func, args, opts, offset)
+            items.extend(response['data'])
+            next_page = response.get('next_page')
+            if not next_page:
+                return items
+            offset = next_page['offset']
 
-    async def get_tasks_info(self, retries=3, delay=2):
+    async def _iter_task_pages(self, project_gid, retries=3, delay=2):
+        offset = None
+        while True:
+            response = await self._call_async(self._list_page, 'get_tasks_for_project', self.tasks_api.get_tasks_for_project,
+                                              (project_gid,), {"opt_fields": self.task_opt_fields}, offset,
+                                              retries=retries, delay=delay)
+            yield response['data']
+            next_page = response.get('next_page')
+            if not next_page:
+                return
+            offset = next_page['offset']
+
+    def _list_selected_projects(self, kind, gid):
+        if kind == "portfolio":
+            items = self._paginate('get_items_for_portfolio', self.portfolios_api.get_items_for_portfolio, gid,
+                                   opts={"opt_fields": "resource_type"})
+            # Portfolios can nest other portfolios; only their projects are fetched
+            return [item['gid'] for item in items if item.get('resource_type') == 'project']
+        list_projects = getattr(self.projects_api, f"get_projects_for_{kind}")
+        projects = self._paginate(f'get_projects_for_{kind}', list_projects, gid, opts={"archived": False, "opt_fields": "gid"})
+        return [project['gid'] for project in projects]
+
+    def _list_tasks(self, project_gid):
+        return self._paginate('get_tasks_for_project', self.tasks_api.get_tasks_for_project, project_gid,
+                              opts={"opt_fields": self.task_opt_fields})
+
+    def _list_task_gids(self, project_gid):
+        return self._paginate('get_tasks_for_project', self.tasks_api.get_tasks_for_project, project_gid,
+                              opts={"opt_fields": "gid"})
+
+    def _list_modified_tasks(self, project_gid, since):
+        return self._paginate('get_tasks', self.tasks_api.get_tasks, opts={
+            "project": project_gid,
+            "modified_since": since,
+            "opt_fields": self.task_opt_fields
+        })
+
+    def _get_task_details(self, task_gid):
+        task_info = self._api_call('get_task', self.tasks_api.get_task, task_gid, {"opt_fields": self.task_opt_fields})
+        policy = self.story_policy
+        stories = []
+        if policy.wants_stories(task_info):
+            policy.keep(stories, self._api_call('get_stories_for_task', self.stories_api.get_stories_for_task, task_gid,
+                                                {"opt_fields": policy.opt_fields}), policy.cutoff())
+        task_info['stories'] = stories
+        return TaskRecord.from_dict(task_info, self.fields.values())
+
+    def _story_batches(self, tasks):
+        # Up to STORY_BATCH_SIZE tasks that need stories per batch, together with any skipped tasks listed
+        # between them, so skipped tasks take no batch actions. Tasks stay in the order they were listed.
+        batches = []
+        batch = []
+        wanted = 0
+        for task in tasks:
+            wants = self.story_policy.wants_stories(task)
+            if (wants and wanted == STORY_BATCH_SIZE) or len(batch) == MAX_PAGE_SIZE:
+                batches.append(batch)
+                batch = []
+                wanted = 0
+            batch.append(task)
+            wanted += wants
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _enrich_batch(self, tasks):
+        # Fields the list endpoint did not return are the only ones worth a per-task request
+        opt_fields = self.task_opt_fields
+        for task in tasks:
+            if any(field not in task for field in self.fields.values()):
+                task.update(self._api_call('get_task', self.tasks_api.get_task, task['gid'], {"opt_fields": opt_fields}))
+
+        stories = self._get_stories_batch([task['gid'] for task in tasks if self.story_policy.wants_stories(task)])
+        for task in tasks:
+            task['stories'] = stories.get(task['gid'], [])
+        return [TaskRecord.from_dict(task, self.fields.values()) for task in tasks]
+
+    def _get_stories_batch(self, task_gids):
+        policy = self.story_policy
+        cutoff = policy.cutoff()
+        stories = {gid: [] for gid in task_gids}
+        pending = [(gid, None) for gid in task_gids]
+        while pending:
+            chunk, pending = pending[:STORY_BATCH_SIZE], pending[STORY_BATCH_SIZE:]
+            actions = []
+            for gid, offset in chunk:
+                # Batch actions take their fields as a list under "fields", not as opt_fields
+                options = {"limit": MAX_PAGE_SIZE, "fields": policy.opt_fields.split(",")}
+                if offset:
+                    options["offset"] = offset
+                actions.append({"method": "get", "relative_path": f"/tasks/{gid}/stories", "options": options})
+            results = self._api_call('create_batch_request', self.batch_api.create_batch_request,
+                                     {"data": {"actions": actions}}, {})
+            for (gid, _), result in zip(chunk, results):
+                if result['status_code'] >= 400:
+                    raise api_error_type()(status=result['status_code'], reason=f"Batch request for stories of task {gid} failed")
+                body = result['body']
+                # Pages are filtered as they arrive, so a task never holds more than max_stories plus one page
+                policy.keep(stories[gid], body['data'], cutoff)
+                # Stories beyond the first page are requested again in a later batch
+                if body.get('next_page'):
+                    pending.append((gid, body['next_page']['offset']))
+        return stories
+
+    def _map_sync(self, func, items):
+        # The sync path still fetches several projects side by side on the provider's pool
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        return list(self._get_executor().map(func, items))
+
+    def _get_executor(self):
+        # The asana SDK is blocking, so calls run on a pool sized to max_concurrency
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="asana")
+        return self._executor
+
+    def _retry_delay(self, error, attempt, retries, delay):
+        # Returns how long to wait before retrying, or None when the error should propagate
+        if error.status not in RETRYABLE_STATUSES or attempt >= retries - 1:
+            return None
+        retry_after = retry_after_seconds(error) if error.status == 429 else None
+        if retry_after is not None:
+            self.client.rate_limiter.pause(retry_after)
+            wait = retry_after
+        else:
+            wait = backoff_delay(attempt, delay)
+        self.metrics.increment('retries')
+        self.metrics.increment(f'retries_{error.status}')
+        self.metrics.increment('retry_wait_seconds', wait)
+        logger.warning("Asana returned %s, retrying in %.1f seconds", error.status, wait)
+        return wait
+
+    def _call_sync(self, func, *args, retries=3, delay=2):
         for attempt in range(retries):
             try:
-                tasks = self.tasks_api.get_tasks_for_project(self.project_id, {"opt_fields": ",".join(self.fields.values())})
-                tasks_info = []
-                for task in tasks:
-                    task_info = self.tasks_api.get_task(task['gid'], {"opt_fields": ",".join(self.fields.values())})
-                    stories = self.stories_api.get_stories_for_task(task['gid'], {})
-                    task_info['stories'] = list(stories)  # Convert generator to list
-                    tasks_info.append(task_info)
-                return tasks_info
-            except ApiException as e:
-                if e.status == 503 and attempt < retries - 1:
-                    print(f"Service unavailable, retrying in {delay} seconds...")
-                    time.sleep(delay)
-                else:
-                    raise RuntimeError(f"Exception when calling TasksApi->get_tasks: {e}")
+                return func(*args)
+            except api_error_type() as e:
+                wait = self._retry_delay(e, attempt, retries, delay)
+                if wait is None:
+                    raise
+                time.sleep(wait)
 
-    def get_tasks_info_sync(self, retries=3, delay=2):
+    async def _call_async(self, func, *args, retries=3, delay=2):
+        loop = asyncio.get_running_loop()
         for attempt in range(retries):
             try:
-                tasks = self.tasks_api.get_tasks_for_project(self.project_id, {"opt_fields": ",".join(self.fields.values())})
-                tasks_info = []
-                for task in tasks:
-                    task_info = self.tasks_api.get_task(task['gid'], {"opt_fields": ",".join(self.fields.values())})
-                    stories = self.stories_api.get_stories_for_task(task['gid'], {})
-                    task_info['stories'] = list(stories)  # Convert generator to list
-                    tasks_info.append(task_info)
-                return tasks_info
-            except ApiException as e:
-                if e.status == 503 and attempt < retries - 1:
-                    print(f"Service unavailable, retrying in {delay} seconds...")
-                    time.sleep(delay)
-                else:
-                    raise RuntimeError(f"Exception when calling TasksApi->get_tasks: {e}")
+                return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args))
+            except api_error_type() as e:
+                wait = self._retry_delay(e, attempt, retries, delay)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
 
     async def index_context(self):
         self.update_status(Status.INDEXING)
-        # Implement indexing logic for Asana context
+        if self._snapshot is not None:
+            self._update_index()
         self.update_status(Status.FRESH)
 
-    async def search_index(self, query: str):
-        # Implement search logic for Asana context
-        search_results = "Asana search results"  # Replace with actual search logic
-        return search_results
+    async def search_index(self, query: str, limit=10):
+        with self._index_lock:
+            if self._index is None:
+                if self._snapshot is None:
+                    return []
+                self._update_index()
+            return self._index.search(query, limit)
 
     def load_from_index(self, search_results):
-        # Implement logic to load search results into context
-        self.context_info = search_results
+        context = self.render_search_results(search_results, matching_projects_only=False)
+        if context is not None:
+            self.context_info = context
+            self._context_is_full = False
+            self.update_version()
+
+    def render_search_results(self, search_results, matching_projects_only=True):
+        # Accepts (task_gid, score) pairs from search_index or bare task gids, rendered in ranked order.
+        # Unlike load_from_index this leaves the provider's own context alone, so it is safe to call per query.
+        snapshot = self._snapshot
+        if snapshot is None or not snapshot.headers:
+            return None
+        gids = [result[0] if isinstance(result, (tuple, list)) else result for result in search_results]
+        formatter = MarkdownFormatter()
+        sections = {}
+        for gid in gids:
+            if gid not in snapshot.tasks:
+                continue
+            sections[gid] = self._render_section(snapshot, gid, formatter)
+        return snapshot.join(sections, order=gids, matching_projects_only=matching_projects_only)
+
+    def _update_index(self):
+        # Only tasks whose modified_at changed since they were indexed are re-tokenized or re-embedded
+        with self._index_lock:
+            if self._index is None:
+                self._index = self._new_index()
+            tasks = self._snapshot.tasks
+            for gid in [gid for gid in self._index.versions if gid not in tasks]:
+                self._index.remove(gid)
+            changed = []
+            for gid, task in tasks.items():
+                version = task.version()
+                if gid not in self._index or version is None or self._index.versions.get(gid) != version:
+                    changed.append((gid, self._index_text(task), version))
+            self._index.add_many(changed)
+
+    def _new_index(self):
+        if self.index_type == "semantic":
+            from .vector_index import VectorIndex
+            return VectorIndex(self.embedder)
+        return BM25Index()
+
+    @staticmethod
+    def _index_text(task):
+        parts = [task.get('name') or '', task.get('notes') or '']
+        parts.extend(story.text or '' for story in task.stories)
+        return "\n".join(parts)
+
+def _restore_task(state, extra, stories):
+    record = TaskRecord()
+    for key, value in state:
+        setattr(record, key, value)
+    record.extra = extra
+    record.stories = stories
+    return record
+
+def _is_ready(source):
+    return isinstance(source, TaskRecord) or source.done()
+
+def _as_list(value):
+    if not value:
+        return []
+    return [str(item) for item in value] if isinstance(value, (list, tuple)) else [str(value)]
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+def _to_epoch(value):
+    # Full ISO timestamps are held as whole epoch seconds for display, which only shows minutes. Seconds
+    # are too coarse to tell two revisions of a task apart, so versions use _to_epoch_us instead.
+    exact = _to_epoch_us(value)
+    return exact // 1000000 if exact is not value else value
+
+def _to_epoch_us(value):
+    # Exact epoch microseconds of a full ISO timestamp; any other value is returned as it is
+    if isinstance(value, str) and ISO_DATETIME_RE.match(value):
+        return (_parse_date(value) - EPOCH) // timedelta(microseconds=1)
+    return value
+
+class StoryPolicy:
+    # Which of a task's stories are fetched and kept. Asana lists stories oldest first and cannot filter
+    # them by type or date, so those rules and max_per_task are applied to each page as it arrives.
+    # Tasks that need no stories at all are never asked for them.
+    def __init__(self, types="all", max_per_task=None, since=None, skip_completed=False, timezone="UTC"):
+        if types not in STORY_TYPES:
+            raise ValueError(f"Unknown story_types '{types}'. Expected one of: {', '.join(STORY_TYPES)}.")
+        if max_per_task is not None and max_per_task < 0:
+            raise ValueError("max_stories must not be negative.")
+        self.types = types
+        self.max_per_task = max_per_task
+        self.since = since
+        self.skip_completed = skip_completed
+        self.opt_fields = STORY_OPT_FIELDS + (",resource_subtype" if types == "comments" else "")
+        # A number is a window of that many days before each fetch; a date or timestamp is fixed. YAML
+        # loads an unquoted 2024-01-01 as a date rather than a string, so dates are accepted as well.
+        self._since_epoch = None
+        if isinstance(since, (str, date)):
+            if isinstance(since, datetime):
+                moment = since
+            elif isinstance(since, date):
+                moment = datetime(since.year, since.month, since.day)
+            else:
+                try:
+                    moment = _parse_date(since)
+                except (ValueError, OverflowError):
+                    raise ValueError(f"stories_since must be a number of days or an ISO date, not '{since}'.")
+            if moment.tzinfo is None:
+                moment = _get_timezone(timezone).localize(moment)
+            self._since_epoch = moment.timestamp()
+        elif since is not None and (isinstance(since, bool) or not isinstance(since, (int, float))):
+            raise ValueError(f"stories_since must be a number of days or an ISO date, not {since!r}.")
+        elif since is not None and since < 0:
+            raise ValueError("stories_since must not be negative.")
+
+    def wants_stories(self, task):
+        return self.max_per_task != 0 and not (self.skip_completed and task.get('completed'))
+
+    def cutoff(self):
+        if self.since is None or self._since_epoch is not None:
+            return self._since_epoch
+        return time.time() - self.since * 86400
+
+    def keep(self, kept, page, cutoff=None):
+        # Adds the wanted stories of one page to those kept so far, then drops all but the newest max_per_task
+        if self.types == "comments":
+            page = [story for story in page if story.get('resource_subtype') == 'comment_added']
+        if cutoff is not None:
+            page = [story for story in page if not _created_before(story, cutoff)]
+        kept.extend(page)
+        if self.max_per_task is not None and len(kept) > self.max_per_task:
+            del kept[:len(kept) - self.max_per_task]
+        return kept
+
+def _created_before(story, cutoff):
+    created_at = _to_epoch(story.get('created_at'))
+    return isinstance(created_at, (int, float)) and created_at < cutoff
+
+class StoryRecord:
+    __slots__ = ('created_at', 'author', 'text')
+
+    def __init__(self, created_at, author, text):
+        self.created_at = created_at
+        self.author = author
+        self.text = text
+
+    @classmethod
+    def from_dict(cls, story):
+        # Accepts a story from the API or the [created_at, author, text] list it is persisted as
+        if isinstance(story, (list, tuple)):
+            created_at, author, text = story
+            return cls(created_at, _intern(author), text)
+        created_by = story.get('created_by')
+        author = created_by.get('name') if isinstance(created_by, dict) else created_by
+        return cls(_to_epoch(story.get('created_at')), _intern(author), story.get('text'))
+
+    def to_list(self):
+        return [self.created_at, self.author, self.text]
+
+    def __reduce__(self):
+        return (StoryRecord, (self.created_at, self.author, self.text))
+
+_TASK_SLOTS = frozenset(['gid', 'name', 'notes', 'completed', 'created_at', 'modified_at', 'modified_exact',
+                         'due_on', 'assignee', 'project'])
+_MISSING = object()
+
+class TaskRecord:
+    # Common task fields get a slot and any other configured field goes in extra. Unset slots
+    # stand for fields the API did not return, which render as N/A just like a missing dict key.
+    __slots__ = tuple(sorted(_TASK_SLOTS)) + ('extra', 'stories')
+
+    def __init__(self):
+        self.extra = None
+        self.stories = []
+
+    @classmethod
+    def from_dict(cls, task, fields=None):
+        # Accepts a task from the API or from to_dict(); keys outside fields are dropped when it is given
+        record = cls()
+        fields = set(fields) if fields is not None else None
+        for key, value in task.items():
+            if key == 'stories':
+                record.stories = [StoryRecord.from_dict(story) for story in value]
+            elif fields is not None and key not in fields and key != 'gid':
+                continue
+            elif key == 'modified_at':
+                exact = _to_epoch_us(value)
+                if exact is not value:
+                    record.modified_at = exact // 1000000
+                    record.modified_exact = exact
+                else:
+                    record.modified_at = value
+            elif key == 'created_at':
+                record.created_at = _to_epoch(value)
+            elif key == 'assignee':
+                record.assignee = _intern(value.get('name') if isinstance(value, dict) else value)
+            elif key in _TASK_SLOTS:
+                setattr(record, key, value)
+            else:
+                if record.extra is None:
+                    record.extra = {}
+                record.extra[key] = value
+        return record
+
+    def to_dict(self):
+        data = {key: getattr(self, key) for key in self.__slots__[:-2] if hasattr(self, key)}
+        if self.extra:
+            data.update(self.extra)
+        data['stories'] = [story.to_list() for story in self.stories]
+        return data
+
+    def get(self, key, default=None):
+        if key in _TASK_SLOTS:
+            return getattr(self, key, default)
+        if key == 'stories':
+            return self.stories
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def version(self):
+        # The exact modified_at, which tells revisions of the task apart; None when there is none
+        return getattr(self, 'modified_exact', self.get('modified_at'))
+
+    def sort_key(self):
+        modified_at = self.get('modified_at')
+        return modified_at if isinstance(modified_at, int) else 0
+
+    def __reduce__(self):
+        # Slotted objects otherwise pickle through a per-object dict, which dominated process pool rendering
+        state = tuple((key, getattr(self, key)) for key in self.__slots__[:-2] if hasattr(self, key))
+        return (_restore_task, (state, self.extra, self.stories))
+
+    def replace(self, **changes):
+        record = copy.copy(self)
+        for key, value in changes.items():
+            setattr(record, key, value)
+        return record
+
+class RenderCache:
+    # Rendered markdown per task gid, valid while the task's exact modified_at and the provider's
+    # fields and timezone are unchanged. One entry per task, so it never outgrows the project.
+    def __init__(self):
+        self.entries = {}
+        self.signature = None
+        self.hits = 0
+        self.misses = 0
+        # Tasks and sections of a loaded snapshot, consulted for gids without an entry of their own
+        self.backing = None
+
+    def validate(self, fields, timezone):
+        # Returns False when the config changed and everything rendered so far was dropped
+        signature = (tuple(fields.items()), timezone)
+        if signature != self.signature:
+            self.entries = {}
+            self.backing = None
+            valid, self.signature = self.signature is None, signature
+            return valid
+        return True
+
+    def contains(self, gid, version):
+        entry = self.entries.get(gid)
+        if entry is None and self.backing is not None:
+            entry = self._backed_entry(gid)
+        return version is not None and entry is not None and entry[0] == version
+
+    def back(self, tasks, sections):
+        self.backing = (tasks, sections)
+
+    def _backed_entry(self, gid):
+        tasks, sections = self.backing
+        if gid not in sections or gid not in tasks:
+            return None
+        version = tasks[gid].version()
+        if version is None:
+            return None
+        entry = self.entries[gid] = (version, sections[gid])
+        return entry
+
+    def get(self, gid, version):
+        if self.contains(gid, version):
+            self.hits += 1
+            return self.entries[gid][1]
+        self.misses += 1
+        return None
+
+    def put(self, gid, version, section):
+        # A task without modified_at can never be validated again, so it is not kept
+        if version is not None:
+            self.entries[gid] = (version, section)
+
+    def invalidate(self):
+        # Drops every entry but keeps the hit and miss counts
+        self.entries = {}
+        self.backing = None
+
+    def retain(self, gids):
+        if self.backing is not None:
+            # Sections still wanted move out of the backing snapshot, which is then let go
+            for gid in gids:
+                if gid not in self.entries:
+                    self._backed_entry(gid)
+            self.backing = None
+        for gid in [gid for gid in self.entries if gid not in gids]:
+            del self.entries[gid]
+
+    def clear(self):
+        self.entries = {}
+        self.backing = None
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else None,
+            'entries': len(self.entries)
+        }
+
+class TaskSnapshot:
+    def __init__(self, tasks, fetched_at):
+        self.tasks = {task['gid']: task for task in tasks}
+        self.order = [task['gid'] for task in tasks]
+        self.fetched_at = fetched_at
+        # Rendered project header per project gid, in the order the projects are rendered
+        self.headers = {}
+        # Rendered markdown and its token counts per task gid, dropped whenever the task changes
+        self.sections = {}
+        self.token_counts = {}
+        self._version = None
+
+    def content_version(self, fields, timezone):
+        # An ETag for what this snapshot renders to: the config, the project headers and each task's
+        # gid, exact modified_at and project, in order. None when a task has no modified_at to go by.
+        # Worked out once; a snapshot is not changed after it is published.
+        signature = (tuple(fields.items()), timezone)
+        if self._version is not None and self._version[0] == signature:
+            return self._version[1]
+        parts = [repr(signature)]
+        parts.extend(f"{project}\0{header}" for project, header in self.headers.items())
+        for gid in self.order:
+            task = self.tasks[gid]
+            modified_at = task.version()
+            if modified_at is None:
+                return None
+            parts.append(f"{gid}\0{modified_at}\0{task.get('project')}")
+        version = hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()
+        self._version = (signature, version)
+        return version
+
+    def copy(self):
+        # Tasks are replaced rather than mutated on refresh, so a shallow copy is enough
+        snapshot = TaskSnapshot([], self.fetched_at)
+        snapshot.tasks = dict(self.tasks)
+        snapshot.order = list(self.order)
+        snapshot.headers = dict(self.headers)
+        snapshot.sections = dict(self.sections)
+        snapshot.token_counts = dict(self.token_counts)
+        return snapshot
+
+    def apply_changes(self, homes, changed_tasks, fetched_at):
+        # homes maps every task gid, in render order, to the project it is rendered under
+        for task in changed_tasks:
+            self.tasks[task['gid']] = task
+            self.sections.pop(task['gid'], None)
+            self.token_counts.pop(task['gid'], None)
+        for gid in [gid for gid in self.tasks if gid not in homes]:
+            del self.tasks[gid]
+            self.sections.pop(gid, None)
+            self.token_counts.pop(gid, None)
+        for gid, project in homes.items():
+            # An unchanged task moves when the project it was shown under no longer contains it
+            if self.tasks[gid].get('project') != project:
+                self.tasks[gid] = self.tasks[gid].replace(project=project)
+        self.order = list(homes)
+        self.fetched_at = fetched_at
+
+    def join(self, sections, order=None, matching_projects_only=False):
+        # Each project header is followed by the given sections of the tasks rendered under it
+        grouped = {project: [header] for project, header in self.headers.items()}
+        for gid in self.order if order is None else order:
+            if gid in sections:
+                grouped.setdefault(self.tasks[gid].get('project'), []).append(sections[gid])
+        if matching_projects_only:
+            return "".join(part for parts in grouped.values() if len(parts) > 1 for part in parts)
+        return "".join(part for parts in grouped.values() for part in parts)
+
+    def to_dict(self):
+        return {
+            'tasks': [self.tasks[gid].to_dict() for gid in self.order],
+            'fetched_at': self.fetched_at,
+            'headers': [[project, header] for project, header in self.headers.items()],
+            'sections': dict(self.sections)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, MappedSnapshot):
+            return cls.from_mapped(data)
+        snapshot = cls([TaskRecord.from_dict(task) for task in data['tasks']], data['fetched_at'])
+        if 'headers' in data:
+            snapshot.headers = {project: header for project, header in data['headers']}
+        elif data.get('header') is not None:
+            # Snapshots saved before multi-project support had a single header
+            snapshot.headers = {None: data['header']}
+        snapshot.sections = dict(data.get('sections', {}))
+        return snapshot
+
+    @classmethod
+    def from_mapped(cls, mapped):
+        # Tasks and sections are decoded from the mapped file as they are looked up
+        snapshot = cls([], mapped.fetched_at)
+        snapshot.order = mapped.gids()
+        snapshot.tasks = LazyMapping({gid: row for row, gid in enumerate(snapshot.order)},
+                                     lambda row: TaskRecord.from_dict(mapped.task(row)))
+        snapshot.headers = dict(mapped.headers)
+        snapshot.sections = LazyMapping({snapshot.order[row]: row for row in mapped.section_rows()}, mapped.section)
+        return snapshot
+
+@functools.lru_cache(maxsize=None)
+def _get_timezone(name):
+    import pytz
+    return pytz.timezone(name)
+
+def _parse_date(date_str):
+    try:
+        match = ISO_DATETIME_RE.match(date_str)
+        if match:
+            year, month, day, hour, minute, second, fraction, offset = match.groups()
+            if offset == 'Z':
+                tzinfo = timezone.utc
+            else:
+                sign = -1 if offset[0] == '-' else 1
+                tzinfo = timezone(sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6])))
+            microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+            return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond, tzinfo=tzinfo)
+        match = ISO_DATE_RE.match(date_str)
+        if match:
+            # Naive like dateutil's result, so astimezone treats it as local time exactly as before
+            return datetime(*map(int, match.groups()))
+    except ValueError:
+        pass
+    # Only timestamps in neither ISO form reach dateutil, so it is imported on first use
+    from dateutil import parser
+    return parser.parse(date_str)
+
+def _format_datetime(date):
+    day = date.day
+    suffix = 'th' if 4 <= day % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
+    return date.strftime(f'%B {day}{suffix}, %Y %I:%M %p')
+
+@functools.lru_cache(maxsize=FORMAT_DATE_CACHE_SIZE)
+def _format_date_cached(date_str, tz_name):
+    return _format_datetime(_parse_date(date_str).astimezone(_get_timezone(tz_name)))
+
+@functools.lru_cache(maxsize=FORMAT_DATE_CACHE_SIZE)
+def _format_epoch_cached(epoch, tz_name):
+    return _format_datetime(datetime.fromtimestamp(epoch, _get_timezone(tz_name)))
 
 class MarkdownFormatter:
     @staticmethod
@@ -177,44 +1395,83 @@ class MarkdownFormatter:
 
     @staticmethod
     def format_date(date_str, timezone):
+        if isinstance(date_str, int):
+            return _format_epoch_cached(date_str, timezone)
         if date_str:
-            date = parser.parse(date_str)
-            date = date.astimezone(pytz.timezone(timezone))
+            return _format_date_cached(date_str, timezone)
+        return 'N/A'
 
-            day = date.day
-            suffix = 'th' if 4 <= day % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
-            formatted_date = date.strftime(f'%B {day}{suffix}, %Y %I:%M %p')
+    def generate_project_header(self, project, timezone):
+        return "".join([
+            self.heading1(f"Project: {project['name']}"),
+            self.format_field("Project ID", project['gid']),
+            self.format_field("Created At", self.format_date(project['created_at'], timezone)),
+            self.format_field("Modified At", self.format_date(project['modified_at'], timezone)),
+            self.format_field("Owner", project['owner']['name'] if project['owner'] else 'N/A'),
+            self.format_field("Notes", project['notes']),
+            self.format_field("Start On", project.get('start_on', 'N/A')),
+            self.format_field("Due On", project.get('due_on', 'N/A')),
+            "\n",
+            self.heading2("Tasks")
+        ])
 
-            return formatted_date
-        return 'N/A'
+    def generate_task_markdown(self, task, task_fields, timezone):
+        if isinstance(task, dict):
+            task = TaskRecord.from_dict(task)
+        parts = [self.heading3(f"Task: {task['name']}")]
+        for field_name, field in task_fields.items():
+            value = task.get(field, 'N/A')
+            if field in ['created_at', 'modified_at', 'due_on']:
+                value = self.format_date(value, timezone)
+            elif field == 'assignee':
+                value = value if isinstance(value, str) else 'N/A'
+            parts.append(self.format_field(field_name, value))
+        parts.append(self.heading4("Stories"))
 
-    def generate_project_markdown(self, project, tasks, task_fields, timezone):
-        markdown = ""
-        markdown += self.heading1(f"Project: {project['name']}")
-        markdown += self.format_field("Project ID", project['gid'])
-        markdown += self.format_field("Created At", self.format_date(project['created_at'], timezone))
-        markdown += self.format_field("Modified At", self.format_date(project['modified_at'], timezone))
-        markdown += self.format_field("Owner", project['owner']['name'] if project['owner'] else 'N/A')
-        markdown += self.format_field("Notes", project['notes'])
-        markdown += self.format_field("Start On", project.get('start_on', 'N/A'))
-        markdown += self.format_field("Due On", project.get('due_on', 'N/A'))
-        markdown += "\n"
-        markdown += self.heading2("Tasks")
+        for story in task.stories:
+            story_text = f"{self.format_date(story.created_at, timezone)} by {story.author}: {story.text}"
+            parts.append(self.list_item(story_text))
+        parts.append("\n")  # Blank line after each task
+        return "".join(parts)
 
+    def iter_project_markdown(self, project, tasks, task_fields, timezone):
+        # Yields one chunk for the header and one per task so callers never hold more than a task at a time
+        yield self.generate_project_header(project, timezone)
         for task in tasks:
-            markdown += self.heading3(f"Task: {task['name']}")
-            for field_name, field in task_fields.items():
-                value = task.get(field, 'N/A')
-                if field in ['created_at', 'modified_at', 'due_on']:
-                    value = self.format_date(value, timezone)
-                elif field == 'assignee':
-                    value = value.get('name', 'N/A') if isinstance(value, dict) else 'N/A'
-                markdown += self.format_field(field_name, value)
-            markdown += self.heading4("Stories")
-
-            for story in task['stories']:
-                story_text = f"{self.format_date(story['created_at'], timezone)} by {story['created_by']['name']}: {story['text']}"
-                markdown += self.list_item(story_text)
-            markdown += "\n"  # Blank line after each task
-
-        return markdown
+            yield self.generate_task_markdown(task, task_fields, timezone)
+
+    def write_project_markdown(self, sink, project, tasks, task_fields, timezone):
+        for chunk in self.iter_project_markdown(project, tasks, task_fields, timezone):
+            sink.write(chunk)
+
+    def generate_project_markdown(self, project, tasks, task_fields, timezone):
+        return "".join(self.iter_project_markdown(project, tasks, task_fields, timezone))
+
+def _render_tasks(tasks, task_fields, timezone):
+    # Module level so process pool workers can unpickle a reference to it
+    formatter = MarkdownFormatter()
+    return [formatter.generate_task_markdown(task, task_fields, timezone) for task in tasks]
+
+def _render_chunks(tasks, workers, chunk_size=None):
+    # Several chunks per worker even out uneven tasks without paying per-task dispatch overhead
+    chunk_size = chunk_size or max(MIN_RENDER_CHUNK, math.ceil(len(tasks) / (max(workers, 1) * 4)))
+    return [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+
+def render_task_sections(tasks, task_fields, timezone, pool=None, workers=1, chunk_size=None):
+    # Renders tasks into one section each, in order; with a pool, contiguous chunks render in parallel
+    chunks = _render_chunks(tasks, workers, chunk_size)
+    if pool is None or len(chunks) <= 1:
+        return _render_tasks(tasks, task_fields, timezone)
+    results = pool.map(_render_tasks, chunks, itertools.repeat(task_fields), itertools.repeat(timezone))
+    return [section for chunk in results for section in chunk]
+
+async def render_task_sections_async(tasks, task_fields, timezone, pool=None, workers=1, chunk_size=None):
+    # Even a single chunk goes to the pool, since the point is to keep rendering off the event loop
+    if pool is None or not tasks:
+        return _render_tasks(tasks, task_fields, timezone)
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(pool, _render_tasks, chunk, task_fields, timezone)
+        for chunk in _render_chunks(tasks, workers, chunk_size)
+    ))
+    return [section for chunk in results for section in chunk]
@@ -0,0 +1,2 @@
+from .fake_server import FakeAsanaServer
+from .synthetic import make_project, make_tasks
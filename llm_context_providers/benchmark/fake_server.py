@@ -0,0 +1,198 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from dateutil import parser as date_parser
+
+BASE_PATH = "/api/1.0"
+MAX_PAGE_SIZE = 100
+
+ROUTES = [
+    ('GET', re.compile(r'^/projects/(?P<gid>[^/]+)$'), 'get_project'),
+    ('GET', re.compile(r'^/projects/(?P<gid>[^/]+)/tasks$'), 'get_tasks_for_project'),
+    ('GET', re.compile(r'^/tasks$'), 'get_tasks'),
+    ('GET', re.compile(r'^/tasks/(?P<gid>[^/]+)$'), 'get_task'),
+    ('GET', re.compile(r'^/tasks/(?P<gid>[^/]+)/stories$'), 'get_stories_for_task'),
+    ('POST', re.compile(r'^/batch$'), 'create_batch_request'),
+]
+
+class FakeAsanaServer:
+    # A local stand-in for the parts of the Asana REST API the provider uses, with optional
+    # per-request latency and randomly injected 429 (with Retry-After) and 503 responses
+    def __init__(self, project, tasks, latency=0.0, rate_limited=0.0, unavailable=0.0, retry_after=0.05, seed=0):
+        self.project = project
+        self.tasks = {task['gid']: task for task in tasks}
+        self.order = [task['gid'] for task in tasks]
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.unavailable = unavailable
+        self.retry_after = retry_after
+        self.request_counts = {}
+        self.injected_errors = {}
+        # JSON body bytes sent, so savings from opt_fields and skipped requests can be measured
+        self.response_bytes = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{BASE_PATH}"
+
+    def start(self, host='127.0.0.1', port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; without this each response waits on a delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                fake._handle(self, 'GET')
+
+            def do_POST(self):
+                fake._handle(self, 'POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-asana", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.request_counts = {}
+            self.injected_errors = {}
+            self.response_bytes = 0
+
+    def _handle(self, request, method):
+        split = urlsplit(request.path)
+        path = split.path[len(BASE_PATH):] if split.path.startswith(BASE_PATH) else split.path
+        query = {key: values[-1] for key, values in parse_qs(split.query).items()}
+        body = None
+        length = int(request.headers.get('Content-Length') or 0)
+        if length:
+            body = json.loads(request.rfile.read(length))
+        if self.latency:
+            time.sleep(self.latency)
+        status, headers, payload = self._respond(method, path, query, body, count=True)
+        data = json.dumps(payload).encode('utf-8')
+        with self._lock:
+            self.response_bytes += len(data)
+        request.send_response(status)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def _respond(self, method, path, query, body, count=False):
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            return 404, {}, {'errors': [{'message': f"No route for {method} {path}"}]}
+        with self._lock:
+            if count:
+                self.request_counts[name] = self.request_counts.get(name, 0) + 1
+                roll = self._random.random()
+                error = None
+                if roll < self.rate_limited:
+                    error = 429
+                elif roll < self.rate_limited + self.unavailable:
+                    error = 503
+                if error:
+                    self.injected_errors[error] = self.injected_errors.get(error, 0) + 1
+        if count and error == 429:
+            return 429, {'Retry-After': str(self.retry_after)}, {'errors': [{'message': "Rate limit exceeded"}]}
+        if count and error == 503:
+            return 503, {}, {'errors': [{'message': "Service unavailable"}]}
+        try:
+            return 200, {}, getattr(self, f"_{name}")(query, body, **match.groupdict())
+        except KeyError as e:
+            return 404, {}, {'errors': [{'message': f"Unknown object {e}"}]}
+
+    def _get_project(self, query, body, gid):
+        return {'data': dict(self.project, gid=gid)}
+
+    def _get_tasks_for_project(self, query, body, gid):
+        return self._page([self._select(self.tasks[task_gid], query) for task_gid in self.order], query)
+
+    def _get_tasks(self, query, body):
+        gids = self.order
+        if query.get('modified_since'):
+            since = date_parser.parse(query['modified_since'])
+            gids = [gid for gid in gids if date_parser.parse(self.tasks[gid]['modified_at']) >= since]
+        return self._page([self._select(self.tasks[gid], query) for gid in gids], query)
+
+    def _get_task(self, query, body, gid):
+        return {'data': self._select(self.tasks[gid], query)}
+
+    def _get_stories_for_task(self, query, body, gid):
+        return self._page([self._select(story, query) for story in self.tasks[gid]['stories']], query)
+
+    def _create_batch_request(self, query, body):
+        results = []
+        for action in body['data']['actions']:
+            options = dict(action.get('options') or {})
+            if 'opt_fields' in options:
+                results.append({'status_code': 400, 'headers': {},
+                                'body': {'errors': [{'message': "Batch actions take fields, not opt_fields"}]}})
+                continue
+            # Batch actions take fields as a list; the endpoint itself takes them as opt_fields
+            fields = options.pop('fields', None)
+            options = {key: str(value) for key, value in options.items()}
+            if fields:
+                options['opt_fields'] = ",".join(fields)
+            status, headers, payload = self._respond(action['method'].upper(), action['relative_path'], options, action.get('data'))
+            results.append({'status_code': status, 'headers': headers, 'body': payload})
+        return {'data': results}
+
+    @staticmethod
+    def _select(item, query):
+        # Honours opt_fields like the API, including nested fields such as created_by.name
+        fields = {}
+        for field in filter(None, (query.get('opt_fields') or '').split(',')):
+            name, _, nested = field.partition('.')
+            fields.setdefault(name, set()).update([nested] if nested else [])
+        if not fields:
+            return {key: value for key, value in item.items() if key != 'stories'}
+        selected = {'gid': item['gid']} if 'gid' in item else {}
+        for name, nested in fields.items():
+            if name in item and name != 'stories':
+                value = item[name]
+                selected[name] = {key: value[key] for key in nested if key in value} if nested and isinstance(value, dict) else value
+        return selected
+
+    @staticmethod
+    def _page(items, query):
+        limit = min(int(query.get('limit') or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+        offset = int(query.get('offset') or 0)
+        next_page = None
+        if offset + limit < len(items):
+            next_page = {'offset': str(offset + limit), 'path': None, 'uri': None}
+        return {'data': items[offset:offset + limit], 'next_page': next_page}
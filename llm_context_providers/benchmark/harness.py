@@ -0,0 +1,183 @@
+"""Time the Asana provider end to end against a local fake Asana API and report JSON for regression tracking.
+
+    llm-context-providers-bench --tasks 2000 --stories 5 --latency 0.005 --rate-limited 0.01 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+import tracemalloc
+
+from ..asana_context_provider import AsanaContextProvider, MarkdownFormatter, DEFAULT_TASK_FIELDS, MAX_PAGE_SIZE
+from ..context_manager import ContextManager
+from .fake_server import FakeAsanaServer
+from .synthetic import make_project, make_tasks
+
+TOKEN = "benchmark-token"
+SCENARIOS = ('fetch_context', 'fetch_context_async', 'generate_project_markdown', 'get_combined_context')
+
+def percentile(samples, fraction):
+    # Nearest-rank percentile, so p99 of a handful of runs is the slowest run rather than an interpolation
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def provider_settings(server, project_gid, args):
+    return {
+        'project_id': project_gid,
+        'personal_access_token': TOKEN,
+        'host': server.url,
+        'fetch_mode': args.fetch_mode,
+        'page_size': args.page_size,
+        'max_concurrency': args.max_concurrency,
+        # The fake server has no quota; only injected 429s should slow the run down
+        'requests_per_minute': 10 ** 7
+    }
+
+def make_scenarios(server, project, tasks, args, observed):
+    # observed['metrics'] receives the provider's refresh metrics when --metrics is on
+    settings = provider_settings(server, project['gid'], args)
+    formatter = MarkdownFormatter()
+
+    def make_provider():
+        provider = AsanaContextProvider(**settings)
+        provider.enable_metrics(args.metrics)
+        return provider
+
+    def fetch_context():
+        provider = make_provider()
+        provider.fetch_context(full_fetch=True)
+        observed['metrics'] = provider.last_metrics
+        return provider.get_context()
+
+    def fetch_context_async():
+        provider = make_provider()
+        asyncio.run(provider.fetch_context_async(full_fetch=True))
+        observed['metrics'] = provider.last_metrics
+        return provider.get_context()
+
+    def generate_project_markdown():
+        return formatter.generate_project_markdown(project, tasks, DEFAULT_TASK_FIELDS, "America/Toronto")
+
+    def get_combined_context():
+        manager = ContextManager({'context_providers': {'asana': dict(settings, enabled=True)},
+                                  'metrics': {'enabled': args.metrics}})
+        manager.fetch_contexts()
+        observed['metrics'] = manager.context_providers['asana'].last_metrics
+        # The manager keeps provider failures in fetch_report rather than raising them
+        result = manager.fetch_report['asana']
+        if result['error'] or result['timed_out']:
+            raise RuntimeError(f"Asana fetch failed: {result['error'] or 'timed out'}")
+        return manager.get_combined_context()
+
+    return {
+        'fetch_context': fetch_context,
+        'fetch_context_async': fetch_context_async,
+        'generate_project_markdown': generate_project_markdown,
+        'get_combined_context': get_combined_context
+    }
+
+def run_scenario(server, func, repeat, task_count, observed):
+    observed.clear()
+    durations = []
+    failures = []
+    requests = {}
+    errors = {}
+    response_bytes = 0
+    output_chars = 0
+    for _ in range(repeat):
+        server.reset_counts()
+        start = time.perf_counter()
+        try:
+            output = func()
+        except Exception as e:
+            # Failed runs are counted but not timed, so they cannot skew the latency figures
+            failures.append(str(e))
+        else:
+            durations.append(time.perf_counter() - start)
+            output_chars = len(output)
+        response_bytes += server.response_bytes
+        for name, count in server.request_counts.items():
+            requests[name] = requests.get(name, 0) + count
+        for status, count in server.injected_errors.items():
+            errors[str(status)] = errors.get(str(status), 0) + count
+    # Memory comes from a separate run because tracemalloc slows allocation-heavy code down
+    peak = None
+    if durations:
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        except Exception:
+            pass
+        finally:
+            tracemalloc.stop()
+    mean = sum(durations) / len(durations) if durations else None
+    report = {
+        'runs': len(durations),
+        'failed_runs': len(failures),
+        'failures': sorted(set(failures)),
+        'mean_seconds': mean,
+        'p50_seconds': percentile(durations, 0.5) if durations else None,
+        'p99_seconds': percentile(durations, 0.99) if durations else None,
+        'tasks_per_second': task_count / mean if mean else None,
+        'requests_per_run': {name: count / repeat for name, count in sorted(requests.items())},
+        'injected_errors_per_run': {status: count / repeat for status, count in sorted(errors.items())},
+        'response_bytes_per_run': response_bytes / repeat,
+        'output_chars': output_chars,
+        'peak_memory_bytes': peak
+    }
+    if observed.get('metrics'):
+        report['last_refresh_metrics'] = observed['metrics']
+    return report
+
+def run(args, scenarios=SCENARIOS):
+    project = make_project()
+    tasks = make_tasks(args.tasks, args.stories)
+    server = FakeAsanaServer(project, tasks, latency=args.latency, rate_limited=args.rate_limited,
+                             unavailable=args.unavailable, retry_after=args.retry_after)
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'python': sys.version.split()[0],
+        'scenarios': {}
+    }
+    with server:
+        observed = {}
+        funcs = make_scenarios(server, project, tasks, args, observed)
+        for name in scenarios:
+            report['scenarios'][name] = run_scenario(server, funcs[name], args.repeat, args.tasks, observed)
+    return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=1000)
+    parser.add_argument('--stories', type=int, default=5, help="stories per task")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the fake API waits per request")
+    parser.add_argument('--rate-limited', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--unavailable', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--retry-after', type=float, default=0.05, help="Retry-After seconds sent with a 429")
+    parser.add_argument('--page-size', type=int, default=MAX_PAGE_SIZE)
+    parser.add_argument('--fetch-mode', default="batch")
+    parser.add_argument('--max-concurrency', type=int, default=10)
+    parser.add_argument('--metrics', action='store_true', help="enable provider metrics and report the last refresh's")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per scenario")
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="run only these scenarios")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = args.scenario or SCENARIOS
+    del args.scenario
+    report = run(args, scenarios)
+    report['config']['scenarios'] = list(scenarios)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+USERS = [f"User {n}" for n in range(50)]
+WORDS = ("alpha beta gamma delta release deploy review design backend frontend api database "
+         "migration customer invoice billing onboarding latency cache index search report "
+         "budget roadmap launch bug fix test metrics dashboard security audit").split()
+# A Zipf-like vocabulary so that, as in real projects, most terms are rare
+VOCABULARY = WORDS + [f"{word}{n}" for n in range(1, 160) for word in WORDS]
+VOCABULARY_WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+def words(rng, count):
+    return " ".join(rng.choices(VOCABULARY, VOCABULARY_WEIGHTS, k=count))
+
+def make_project(gid="1"):
+    return {
+        'name': 'Synthetic Project',
+        'gid': gid,
+        'created_at': '2024-01-02T03:04:05.000Z',
+        'modified_at': '2024-07-10T12:34:56.789Z',
+        'owner': {'name': 'Project Owner'},
+        'notes': 'Synthetic project used for benchmarks',
+        'start_on': '2024-01-02',
+        'due_on': '2024-12-31'
+    }
+
+def make_tasks(count, stories_per_task=5, seed=0):
+    rng = random.Random(seed)
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    tasks = []
+    for index in range(count):
+        created = base + timedelta(minutes=rng.randrange(0, 60 * 24 * 180))
+        modified = created + timedelta(minutes=rng.randrange(0, 60 * 24 * 30))
+        tasks.append({
+            'gid': str(10 ** 12 + index),
+            'name': words(rng, 4).capitalize(),
+            'created_at': created.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+            'modified_at': modified.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+            'completed': rng.random() < 0.4,
+            'assignee': {'gid': str(rng.randrange(50)), 'name': rng.choice(USERS)},
+            'due_on': (created + timedelta(days=rng.randrange(1, 60))).strftime('%Y-%m-%d'),
+            'notes': words(rng, rng.randrange(5, 40)),
+            'stories': [
+                {
+                    'gid': f"{10 ** 12 + index}{n:04d}",
+                    'created_at': (created + timedelta(minutes=rng.randrange(0, 60 * 24 * 30))).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+                    'created_by': {'gid': str(rng.randrange(50)), 'name': rng.choice(USERS)},
+                    'resource_subtype': 'comment_added' if rng.random() < 0.5 else 'assigned',
+                    'text': words(rng, rng.randrange(3, 25))
+                }
+                for n in range(stories_per_task)
+            ]
+        })
+        # Asana lists stories oldest first; about half of them are system events rather than comments
+        tasks[-1]['stories'].sort(key=lambda story: story['created_at'])
+        for story in tasks[-1]['stories']:
+            story['type'] = 'comment' if story['resource_subtype'] == 'comment_added' else 'system'
+    return tasks
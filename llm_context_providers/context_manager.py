@@ -1,14 +1,57 @@
 import os
+import collections
+import hashlib
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
-from .context_provider import ContextProvider
+from .context_provider import ContextProvider, Status
+from .metrics import format_prometheus
+from .search_index import merge_ranked_results
+from .snapshot_cache import create_snapshot_cache, make_cache_key
+from .token_budget import allocation_order, estimate_tokens
 from copy import deepcopy
 
+logger = logging.getLogger(__name__)
+
 class ContextManager:
     def __init__(self, config):
         load_dotenv()
         self.global_config = config.get('global', {})
         self.context_providers_config = config.get('context_providers', {})
+        self.cache_config = config.get('cache') or {}
+        self.fetch_config = config.get('fetch') or {}
+        self.scheduler_config = config.get('scheduler') or {}
+        self.metrics_config = config.get('metrics') or {}
+        self.render_config = config.get('render') or {}
+        self.retrieval_config = config.get('retrieval') or {}
+        self.retrieval_limit = self.retrieval_config.get('results', 20)
+        self.retrieval_cache_size = self.retrieval_config.get('cache_size', 128)
+        self.max_concurrent_providers = self.fetch_config.get('max_concurrent_providers', 8)
+        self.refresh_jitter = self.scheduler_config.get('jitter', 0.1)
+        self.provider_timeouts = {}
+        self.provider_priorities = {}
+        self.refresh_intervals = {}
+        self.fetch_report = {}
+        self.metrics_listeners = []
+        self.change_listeners = []
+        self._relevant_cache = collections.OrderedDict()
+        self._relevant_cache_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_executor = None
+        self._inflight_refreshes = {}
+        self._scheduler_thread = None
+        self._scheduler_stop = threading.Event()
+        self.snapshot_cache = create_snapshot_cache(self.cache_config) if self.cache_config.get('enabled', False) else None
         self.context_providers = self.initialize_providers()
+        # The version each provider's context had when listeners last heard about it
+        self._notified_versions = {name: provider.context_version for name, provider in self.context_providers.items()}
+        if self.snapshot_cache and self.cache_config.get('refresh_on_start', False):
+            self.refresh_in_background()
+        if self.scheduler_config.get('enabled', False):
+            self.start_scheduler()
 
     def initialize_providers(self):
         providers = {}
@@ -19,40 +62,423 @@ class ContextManager:
                     # Pass a copy of the config to avoid mutating the original
                     config_copy = deepcopy(provider_config)
                     config_copy.pop('enabled', None)
+                    self.provider_timeouts[provider_name] = config_copy.pop('timeout', self.fetch_config.get('timeout'))
+                    self.provider_priorities[provider_name] = config_copy.pop('priority', 0)
+                    self.refresh_intervals[provider_name] = config_copy.pop(
+                        'refresh_interval', self.scheduler_config.get('interval'))
+                    # Providers that do not set their own render options share the render section's
+                    for key in ('workers', 'pool', 'chunk_size'):
+                        if key in self.render_config:
+                            config_copy.setdefault(f'render_{key}', self.render_config[key])
                     # Add global configuration to the context provider's configuration
                     config_copy.update(self.global_config)
-                    providers[provider_name] = provider_class(**config_copy)
+                    provider = provider_class(**config_copy)
+                    if self.metrics_config.get('enabled', False):
+                        provider.enable_metrics()
+                    if self.snapshot_cache:
+                        # Serve the last persisted context straight away; its age decides FRESH or STALE
+                        provider.attach_cache(self.snapshot_cache, make_cache_key(provider_name, config_copy))
+                        provider.load_from_cache(self.cache_config.get('fresh_for'))
+                    providers[provider_name] = provider
                 else:
-                    print(f"Warning: No context provider class found for {provider_name}")
+                    logger.warning("No context provider class found for %s", provider_name)
         return providers
 
-    async def fetch_contexts_async(self, providers=None):
+    def _provider_names(self, providers=None):
         providers = providers or self.context_providers.keys()
-        for provider_name in providers:
-            if provider_name in self.context_providers:
+        return [name for name in providers if name in self.context_providers]
+
+    def _record_fetch(self, provider_name, started, error=None, timed_out=False):
+        self._check_version(provider_name)
+        self.fetch_report[provider_name] = {
+            'duration': time.perf_counter() - started,
+            'error': error,
+            'timed_out': timed_out
+        }
+        if error:
+            logger.error("Error in %s context provider: %s", provider_name, error)
+        if self.metrics_listeners:
+            self._notify_metrics(provider_name)
+
+    def add_metrics_listener(self, listener):
+        # listener(provider_name, report) runs after every fetch or refresh; the report holds the
+        # last_fetch entry plus, with metrics enabled, the provider's per-refresh metrics
+        self.metrics_listeners.append(listener)
+
+    def add_change_listener(self, listener):
+        # listener(provider_name, version) runs only after a refresh that changed the provider's context,
+        # so prompt or embedding caches downstream can invalidate on real changes alone
+        self.change_listeners.append(listener)
+
+    def _check_version(self, provider_name):
+        version = self.context_providers[provider_name].context_version
+        if self._notified_versions.get(provider_name) == version:
+            return
+        self._notified_versions[provider_name] = version
+        self.clear_relevant_cache()
+        for listener in self.change_listeners:
+            try:
+                listener(provider_name, version)
+            except Exception as e:
+                logger.warning("Change listener failed for %s: %s", provider_name, e)
+
+    def get_context_version(self, providers=None):
+        # One version for the combined context of these providers; it moves only when one of theirs does
+        digest = hashlib.sha256()
+        for name in self._provider_names(providers):
+            digest.update(f"{name}\0{self.context_providers[name].context_version}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _notify_metrics(self, provider_name):
+        report = dict(self.fetch_report[provider_name], metrics=self.context_providers[provider_name].last_metrics)
+        for listener in self.metrics_listeners:
+            try:
+                listener(provider_name, report)
+            except Exception as e:
+                logger.warning("Metrics listener failed for %s: %s", provider_name, e)
+
+    def get_metrics(self, providers=None):
+        return {name: self.context_providers[name].get_metrics() for name in self._provider_names(providers)}
+
+    def export_prometheus(self, providers=None):
+        return format_prometheus(self.get_metrics(providers))
+
+    def profile_refresh(self, provider_name, full_fetch=False):
+        # Runs one refresh on the calling thread under cProfile and returns the pstats.Stats.
+        # Work a provider hands to its own thread pool is not captured.
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        error = None
+        profiler.enable()
+        try:
+            self.context_providers[provider_name].fetch_context(full_fetch=full_fetch)
+        except Exception as e:
+            error = str(e)
+        finally:
+            profiler.disable()
+        self._record_fetch(provider_name, started, error)
+        return pstats.Stats(profiler)
+
+    def _mark_timed_out(self, provider_name, started):
+        timeout = self.provider_timeouts.get(provider_name)
+        provider = self.context_providers[provider_name]
+        if provider.status == Status.FETCHING:
+            provider.update_status(Status.STALE)
+        self._record_fetch(provider_name, started, f"timed out after {timeout} seconds", timed_out=True)
+
+    async def fetch_contexts_async(self, providers=None):
+        # asyncio is imported where it is used, since sync-only services never need it
+        import asyncio
+        semaphore = asyncio.Semaphore(self.max_concurrent_providers)
+
+        async def fetch(provider_name):
+            async with semaphore:
+                started = time.perf_counter()
                 try:
-                    await self.context_providers[provider_name].fetch_context_async()
-                except ValueError as e:
-                    print(f"Error in {provider_name} context provider: {e}")
+                    await asyncio.wait_for(self.context_providers[provider_name].fetch_context_async(),
+                                           self.provider_timeouts.get(provider_name))
+                except asyncio.TimeoutError:
+                    self._mark_timed_out(provider_name, started)
+                except Exception as e:
+                    self._record_fetch(provider_name, started, str(e))
+                else:
+                    self._record_fetch(provider_name, started)
+
+        # A failing or slow provider only affects its own entry in fetch_report
+        await asyncio.gather(*(fetch(name) for name in self._provider_names(providers)))
+        return self.fetch_report
 
     def fetch_contexts(self, providers=None):
+        provider_names = self._provider_names(providers)
+        if not provider_names:
+            return self.fetch_report
+        started = {}
+
+        def fetch(provider_name):
+            started[provider_name] = time.perf_counter()
+            self.context_providers[provider_name].fetch_context()
+
+        executor = ThreadPoolExecutor(max_workers=min(self.max_concurrent_providers, len(provider_names)),
+                                      thread_name_prefix="context-fetch")
+        futures = {executor.submit(fetch, name): name for name in provider_names}
+        pending = set(futures)
+        try:
+            while pending:
+                timed = [future for future in pending if self.provider_timeouts.get(futures[future]) is not None]
+                deadlines = {
+                    future: started[futures[future]] + self.provider_timeouts[futures[future]]
+                    for future in timed if futures[future] in started
+                }
+                timeout = max(0, min(deadlines.values()) - time.perf_counter()) if deadlines else None
+                if len(deadlines) < len(timed):
+                    # Queued providers have no deadline until they start, so check back shortly
+                    timeout = 0.05 if timeout is None else min(timeout, 0.05)
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    provider_name = futures[future]
+                    error = future.exception()
+                    self._record_fetch(provider_name, started[provider_name], str(error) if error else None)
+                now = time.perf_counter()
+                for future, deadline in deadlines.items():
+                    if future in pending and now >= deadline:
+                        # A blocking fetch cannot be interrupted, so it is left to finish in the background
+                        pending.discard(future)
+                        self._mark_timed_out(futures[future], started[futures[future]])
+        finally:
+            executor.shutdown(wait=False)
+        return self.fetch_report
+
+    def refresh_in_background(self, providers=None):
         providers = providers or self.context_providers.keys()
-        for provider_name in providers:
-            if provider_name in self.context_providers:
-                try:
-                    self.context_providers[provider_name].fetch_context()
-                except ValueError as e:
-                    print(f"Error in {provider_name} context provider: {e}")
+        stale = [name for name in providers
+                 if name in self.context_providers and self.context_providers[name].status != Status.FRESH]
+        return {name: self.request_refresh(name) for name in stale}
+
+    def request_refresh(self, provider_name, full_fetch=False):
+        # Callers asking while a refresh is already running share it instead of starting another
+        with self._refresh_lock:
+            future = self._inflight_refreshes.get(provider_name)
+            if future is None:
+                if self._refresh_executor is None:
+                    self._refresh_executor = ThreadPoolExecutor(max_workers=self.max_concurrent_providers,
+                                                                thread_name_prefix="context-refresh")
+                future = self._refresh_executor.submit(self._refresh, provider_name, full_fetch)
+                self._inflight_refreshes[provider_name] = future
+            return future
+
+    async def request_refresh_async(self, provider_name, full_fetch=False):
+        import asyncio
+        return await asyncio.wrap_future(self.request_refresh(provider_name, full_fetch))
+
+    def _refresh(self, provider_name, full_fetch):
+        started = time.perf_counter()
+        try:
+            # Providers keep serving their previous context until the new one is swapped in
+            self.context_providers[provider_name].fetch_context(full_fetch=full_fetch)
+        except Exception as e:
+            self._record_fetch(provider_name, started, str(e))
+        else:
+            self._record_fetch(provider_name, started)
+        finally:
+            with self._refresh_lock:
+                self._inflight_refreshes.pop(provider_name, None)
+        return self.fetch_report[provider_name]
+
+    def _next_refresh_delay(self, provider_name):
+        # Jitter keeps providers, and processes sharing a token, from refreshing in lockstep
+        interval = self.refresh_intervals[provider_name]
+        return interval * (1 + random.uniform(-self.refresh_jitter, self.refresh_jitter))
+
+    def start_scheduler(self):
+        if self._scheduler_thread is not None and self._scheduler_thread.is_alive():
+            return self._scheduler_thread
+        self._scheduler_stop.clear()
+        self._scheduler_thread = threading.Thread(target=self._run_scheduler, name="context-scheduler", daemon=True)
+        self._scheduler_thread.start()
+        return self._scheduler_thread
 
-    def get_combined_context(self, providers=None):
+    def stop_scheduler(self, timeout=None):
+        self._scheduler_stop.set()
+        if self._scheduler_thread is not None:
+            self._scheduler_thread.join(timeout)
+            self._scheduler_thread = None
+
+    def _run_scheduler(self):
+        now = time.monotonic()
+        due = {}
+        for provider_name in self._provider_names():
+            if self.refresh_intervals.get(provider_name):
+                # STALE providers refresh straight away, FRESH ones somewhere within their first interval
+                fresh = self.context_providers[provider_name].status == Status.FRESH
+                due[provider_name] = now + (random.uniform(0, self.refresh_intervals[provider_name]) if fresh else 0)
+        while due and not self._scheduler_stop.is_set():
+            now = time.monotonic()
+            for provider_name, due_at in due.items():
+                if due_at <= now:
+                    self.request_refresh(provider_name)
+                    due[provider_name] = now + self._next_refresh_delay(provider_name)
+            self._scheduler_stop.wait(max(0, min(due.values()) - time.monotonic()))
+
+    def get_combined_context_stream(self, providers=None, budget=None, count_tokens=None):
+        if budget is not None:
+            yield from self._iter_budgeted_context(providers, budget, count_tokens or estimate_tokens)
+            return
         providers = providers or self.context_providers.keys()
-        combined_context = ""
         for provider_name in providers:
             if provider_name in self.context_providers:
-                context = self.context_providers[provider_name].get_context()
-                if context:
-                    combined_context += context + "\n"
-        return combined_context
+                has_context = False
+                for chunk in self.context_providers[provider_name].iter_context():
+                    has_context = True
+                    yield chunk
+                if has_context:
+                    yield "\n"
+
+    async def stream_combined_context_async(self, providers=None, max_buffered_chunks=256):
+        # Every provider streams concurrently into its own bounded queue; output follows the configured
+        # order, so later providers' chunks wait (and apply backpressure) until earlier ones are done
+        import asyncio
+        provider_names = self._provider_names(providers)
+        queues = {name: asyncio.Queue(max_buffered_chunks) for name in provider_names}
+        semaphore = asyncio.Semaphore(self.max_concurrent_providers)
+
+        async def pump(provider_name):
+            provider = self.context_providers[provider_name]
+            started = time.perf_counter()
+            streamed = False
+            try:
+                async with semaphore:
+                    async for chunk in provider.stream_context_async():
+                        streamed = True
+                        await queues[provider_name].put(chunk)
+            except Exception as e:
+                self._record_fetch(provider_name, started, str(e))
+                if not streamed:
+                    # Nothing was sent yet, so the last good context can still stand in
+                    for chunk in provider.iter_context():
+                        await queues[provider_name].put(chunk)
+            else:
+                self._record_fetch(provider_name, started)
+            await queues[provider_name].put(None)
+
+        workers = [asyncio.ensure_future(pump(name)) for name in provider_names]
+        try:
+            for provider_name in provider_names:
+                has_context = False
+                while True:
+                    chunk = await queues[provider_name].get()
+                    if chunk is None:
+                        break
+                    has_context = True
+                    yield chunk
+                if has_context:
+                    yield "\n"
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def write_combined_context_async(self, sink, providers=None):
+        written = 0
+        async for chunk in self.stream_combined_context_async(providers):
+            written += len(chunk)
+            sink.write(chunk)
+        return written
+
+    def _iter_budgeted_context(self, providers, budget, count_tokens):
+        provider_names = self._provider_names(providers)
+        separator_tokens = count_tokens("\n")
+        remaining = budget
+        selected = {}
+        # Higher-priority providers claim their share of the budget first
+        for provider_name in allocation_order(provider_names, self.provider_priorities):
+            if remaining <= separator_tokens:
+                break
+            context, tokens = self.context_providers[provider_name].get_context_within_budget(
+                remaining - separator_tokens, count_tokens)
+            if context:
+                selected[provider_name] = context
+                remaining -= tokens + separator_tokens
+        for provider_name in provider_names:
+            if provider_name in selected:
+                yield selected[provider_name]
+                yield "\n"
+
+    def write_combined_context(self, sink, providers=None, budget=None, count_tokens=None):
+        written = 0
+        for chunk in self.get_combined_context_stream(providers, budget, count_tokens):
+            written += len(chunk)
+            sink.write(chunk)
+        return written
+
+    def get_combined_context(self, providers=None, budget=None, count_tokens=None):
+        return "".join(self.get_combined_context_stream(providers, budget, count_tokens))
+
+    def get_relevant_context(self, query, budget=None, providers=None, limit=None, count_tokens=None):
+        # Sync counterpart of get_relevant_context_async; cached answers are returned without starting a loop
+        cached = self._get_relevant_cached(query, budget, providers, limit, count_tokens)
+        if cached is not None:
+            return cached
+        import asyncio
+        return asyncio.run(self.get_relevant_context_async(query, budget, providers, limit, count_tokens))
+
+    async def get_relevant_context_async(self, query, budget=None, providers=None, limit=None, count_tokens=None):
+        # Searches every provider's index at once, merges the hits by normalized score and renders only
+        # the best of them, as many as fit in the budget
+        import asyncio
+        key = self._relevant_cache_key(query, budget, providers, limit, count_tokens)
+        cached = self._get_relevant_cached(key=key)
+        if cached is not None:
+            return cached
+        provider_names = [name for name in self._provider_names(providers)
+                          if type(self.context_providers[name]).render_search_results
+                          is not ContextProvider.render_search_results]
+        limit = limit or self.retrieval_limit
+        results = await asyncio.gather(*(self._search_provider(name, query, limit) for name in provider_names))
+        searched = {name: hits for name, hits in zip(provider_names, results) if hits is not None}
+        hits = merge_ranked_results(searched, self.provider_priorities)[:limit]
+        context = self._render_relevant(provider_names, hits, budget, count_tokens or estimate_tokens)
+        if len(searched) < len(provider_names):
+            # Answers missing a failed provider are not kept
+            return context
+        with self._relevant_cache_lock:
+            self._relevant_cache[key] = context
+            while len(self._relevant_cache) > self.retrieval_cache_size:
+                self._relevant_cache.popitem(last=False)
+        return context
+
+    async def _search_provider(self, provider_name, query, limit):
+        try:
+            return await self.context_providers[provider_name].search_index(query, limit)
+        except Exception as e:
+            logger.warning("Search failed in %s context provider: %s", provider_name, e)
+            return None
+
+    def _render_relevant(self, provider_names, hits, budget, count_tokens):
+        def render(count):
+            selected = {}
+            for provider_name, doc_id, _ in hits[:count]:
+                selected.setdefault(provider_name, []).append(doc_id)
+            parts = []
+            for provider_name in provider_names:
+                if provider_name in selected:
+                    context = self.context_providers[provider_name].render_search_results(selected[provider_name])
+                    if context:
+                        parts.extend((context, "\n"))
+            return "".join(parts)
+
+        context = render(len(hits))
+        if budget is None or count_tokens(context) <= budget:
+            return context
+        # Binary search for the most top-ranked hits that still fit
+        low, high = 0, len(hits) - 1
+        while low < high:
+            count = (low + high + 1) // 2
+            if count_tokens(render(count)) <= budget:
+                low = count
+            else:
+                high = count - 1
+        return render(low)
+
+    def _relevant_cache_key(self, query, budget, providers, limit, count_tokens):
+        # Each provider's context version is part of the key, so a change made outside the manager also misses
+        provider_names = self._provider_names(providers)
+        versions = tuple(self.context_providers[name].context_version for name in provider_names)
+        return (query, budget, tuple(provider_names), limit, count_tokens, versions)
+
+    def _get_relevant_cached(self, query=None, budget=None, providers=None, limit=None, count_tokens=None, key=None):
+        if self.retrieval_cache_size <= 0:
+            return None
+        key = key or self._relevant_cache_key(query, budget, providers, limit, count_tokens)
+        with self._relevant_cache_lock:
+            context = self._relevant_cache.get(key)
+            if context is not None:
+                self._relevant_cache.move_to_end(key)
+            return context
+
+    def clear_relevant_cache(self):
+        with self._relevant_cache_lock:
+            self._relevant_cache.clear()
 
     def get_status(self, providers=None):
         providers = providers or self.context_providers.keys()
@@ -60,4 +486,6 @@ class ContextManager:
         for provider_name in providers:
             if provider_name in self.context_providers:
                 status[provider_name] = self.context_providers[provider_name].provide_status()
+                if provider_name in self.fetch_report:
+                    status[provider_name]['last_fetch'] = self.fetch_report[provider_name]
         return status
@@ -1,6 +1,14 @@
+import hashlib
+import importlib
+import logging
+import time
 from abc import ABC, abstractmethod
 from datetime import datetime
 from enum import Enum
+from .metrics import NULL_METRICS, RefreshMetrics
+from .token_budget import cached_token_count
+
+logger = logging.getLogger(__name__)
 
 class Status(Enum):
     FRESH = "fresh"
@@ -8,8 +16,15 @@ class Status(Enum):
     FETCHING = "fetching"
     INDEXING = "indexing"
 
+# Installed packages can add providers under this entry point group, named after the provider class
+ENTRY_POINT_GROUP = "llm_context_providers.providers"
+
 class ContextProvider(ABC):
     _registry = {}
+    # Built-in providers by class name; a module is only imported once a config asks for its provider
+    _provider_modules = {
+        'AsanaContextProvider': 'llm_context_providers.asana_context_provider'
+    }
 
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
@@ -19,9 +34,33 @@ class ContextProvider(ABC):
         self.status = Status.STALE
         self.last_updated = None
         self.context_info = None
+        # Fingerprint of the context, and when it last changed; last_updated moves on every refresh
+        self.context_version = None
+        self.last_changed = None
+        self._versioned_context = None
+        self.snapshot_cache = None
+        self.cache_key = None
+        self._token_counts = {}
+        self._token_counts_source = None
+        self.metrics = NULL_METRICS
+        self.metrics_enabled = False
+        self.last_metrics = None
+        self._metrics_totals = None
+
+    @classmethod
+    def register_provider(cls, name, module_path):
+        cls._provider_modules[name] = module_path
 
     @classmethod
     def get_provider_class(cls, name):
+        if name not in cls._registry:
+            if name in cls._provider_modules:
+                importlib.import_module(cls._provider_modules[name])
+            else:
+                for entry_point in _provider_entry_points():
+                    if entry_point.name == name:
+                        cls._registry.setdefault(name, entry_point.load())
+                        break
         return cls._registry.get(name)
 
     @abstractmethod
@@ -33,19 +72,168 @@ class ContextProvider(ABC):
         asyncio.run(self.fetch_context_async(full_fetch))
 
     def provide_status(self):
-        return {
+        status = {
             'status': self.status.value,
-            'last_updated': self.last_updated
+            'last_updated': self.last_updated,
+            'version': self.context_version,
+            'last_changed': self.last_changed
+        }
+        if self.metrics_enabled:
+            status['metrics'] = self.get_metrics()
+        return status
+
+    def enable_metrics(self, enabled=True):
+        self.metrics_enabled = enabled
+        self.metrics = NULL_METRICS
+        self.last_metrics = None
+        self._metrics_totals = {'refreshes': 0, 'errors': 0, 'requests': {}, 'counters': {}} if enabled else None
+
+    def begin_metrics(self):
+        # Called as a refresh starts; while metrics are disabled this hands out a shared no-op collector
+        self.metrics = RefreshMetrics() if self.metrics_enabled else NULL_METRICS
+        return self.metrics
+
+    def end_metrics(self, error=None):
+        metrics = self.metrics
+        if not metrics.enabled:
+            return None
+        report = metrics.to_dict()
+        report.update(self.metrics_details())
+        report['error'] = str(error) if error is not None else None
+        report['rendered_bytes'] = len(self.context_info.encode('utf-8')) if error is None and self.context_info else None
+        totals = self._metrics_totals
+        totals['refreshes'] += 1
+        totals['errors'] += error is not None
+        for name, count in report.get('requests', {}).items():
+            totals['requests'][name] = totals['requests'].get(name, 0) + count
+        for name, value in report['counters'].items():
+            totals['counters'][name] = totals['counters'].get(name, 0) + value
+        self.last_metrics = report
+        return report
+
+    def metrics_details(self):
+        # Providers override this to add their own figures, such as API request counts, to each refresh report
+        return {}
+
+    def get_metrics(self):
+        if not self.metrics_enabled:
+            return None
+        totals = self._metrics_totals
+        return {
+            'last_refresh': self.last_metrics,
+            'totals': dict(totals, requests=dict(totals['requests']), counters=dict(totals['counters']))
         }
 
     def update_status(self, status: Status):
         self.status = status
         self.last_updated = datetime.now()
+        if status == Status.FRESH:
+            self.update_version()
+            self.save_to_cache()
+
+    def compute_context_version(self):
+        # Providers that can fingerprint their fetched data more cheaply than their rendered context override this
+        context = self.context_info
+        if context is self._versioned_context:
+            return self.context_version
+        return hashlib.sha256(context.encode('utf-8')).hexdigest() if context else None
+
+    def update_version(self):
+        # Returns True when the context changed since the version was last taken
+        version = self.compute_context_version()
+        self._versioned_context = self.context_info
+        if version == self.context_version:
+            return False
+        self.context_version = version
+        self.last_changed = self.last_updated
+        return True
+
+    def attach_cache(self, snapshot_cache, cache_key):
+        self.snapshot_cache = snapshot_cache
+        self.cache_key = cache_key
+
+    def export_snapshot(self):
+        # Providers override this to persist their raw fetched data alongside the rendered context
+        return None
+
+    def import_snapshot(self, data):
+        pass
+
+    def save_to_cache(self):
+        if self.snapshot_cache is None:
+            return
+        try:
+            self.snapshot_cache.set(self.cache_key, {
+                'context_info': self.context_info,
+                'last_updated': self.last_updated.isoformat() if self.last_updated else None,
+                'version': self.context_version,
+                'last_changed': self.last_changed.isoformat() if self.last_changed else None,
+                'data': self.export_snapshot()
+            })
+        except Exception as e:
+            logger.warning("Failed to save %s snapshot to cache: %s", type(self).__name__, e)
+
+    def load_from_cache(self, fresh_for=None):
+        if self.snapshot_cache is None:
+            return False
+        try:
+            entry = self.snapshot_cache.get(self.cache_key)
+            if entry is None:
+                return False
+            value = entry.value
+            self.import_snapshot(value['data'])
+        except Exception as e:
+            logger.warning("Failed to load %s snapshot from cache: %s", type(self).__name__, e)
+            return False
+        self.context_info = value['context_info']
+        self.last_updated = datetime.fromisoformat(value['last_updated']) if value['last_updated'] else None
+        self.last_changed = datetime.fromisoformat(value['last_changed']) if value.get('last_changed') else self.last_updated
+        # Entries saved before versions existed get theirs computed now
+        self._versioned_context = None
+        self.context_version = value.get('version') or self.compute_context_version()
+        self._versioned_context = self.context_info
+        age = time.time() - entry.saved_at
+        self.status = Status.FRESH if fresh_for is not None and age <= fresh_for else Status.STALE
+        return True
 
     @abstractmethod
     def get_context(self):
         return self.context_info
 
+    def count_context_tokens(self, count_tokens):
+        # Counts are cached per tokenizer until the context string itself is replaced
+        context = self.get_context()
+        if context is not self._token_counts_source:
+            self._token_counts = {}
+            self._token_counts_source = context
+        return cached_token_count(self._token_counts, count_tokens, context)
+
+    def get_context_within_budget(self, budget, count_tokens):
+        # Returns (context, tokens); providers that can trim their context should override this
+        tokens = self.count_context_tokens(count_tokens)
+        if tokens and tokens <= budget:
+            return self.get_context(), tokens
+        return None, 0
+
+    def iter_context(self):
+        # Streaming counterpart of get_context; providers may override it to yield smaller chunks
+        context = self.get_context()
+        if context:
+            yield context
+
+    async def stream_context_async(self):
+        # Providers that can render while they fetch override this to yield context as it arrives
+        await self.fetch_context_async()
+        for chunk in self.iter_context():
+            yield chunk
+
+    async def write_context_async(self, sink):
+        written = 0
+        async for chunk in self.stream_context_async():
+            written += len(chunk)
+            sink.write(chunk)
+        return written
+
     @abstractmethod
     async def index_context(self):
         pass
@@ -57,3 +245,19 @@ class ContextProvider(ABC):
     @abstractmethod
     def load_from_index(self, search_results):
         pass
+
+    def render_search_results(self, search_results):
+        # Returns context for just these search results without replacing get_context(); providers
+        # that return None here are left out of ContextManager.get_relevant_context
+        return None
+
+def _provider_entry_points():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+    found = entry_points()
+    # Python 3.10 added select(); before that entry_points() returned a dict of groups
+    if hasattr(found, 'select'):
+        return found.select(group=ENTRY_POINT_GROUP)
+    return found.get(ENTRY_POINT_GROUP, [])
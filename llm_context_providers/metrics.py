@@ -0,0 +1,97 @@
+import contextlib
+import threading
+import time
+
+_NO_PHASE = contextlib.nullcontext()
+
+class RefreshMetrics:
+    # Timings and counters for a single refresh of one provider
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # Phases that run more than once in a refresh, or concurrently, add up their wall time
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(self.phases, name, time.perf_counter() - start)
+
+    def increment(self, name, amount=1):
+        self.add(self.counters, name, amount)
+
+    def add(self, values, name, amount):
+        with self._lock:
+            values[name] = values.get(name, 0) + amount
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'duration': time.perf_counter() - self.started,
+                'phases': dict(self.phases),
+                'counters': dict(self.counters)
+            }
+
+class NullMetrics:
+    # Stands in while metrics are disabled so instrumented code needs no checks of its own
+    enabled = False
+
+    def phase(self, name):
+        return _NO_PHASE
+
+    def increment(self, name, amount=1):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def format_prometheus(provider_metrics, prefix="llm_context"):
+    # Renders {provider name: provider.get_metrics()} in the Prometheus text exposition format
+    families = {}
+
+    def sample(name, kind, help_text, value, **labels):
+        family = families.setdefault(f"{prefix}_{name}", (kind, help_text, []))
+        family[2].append(f"{prefix}_{name}{_labels(**labels)} {float(value)!r}")
+
+    for provider, metrics in provider_metrics.items():
+        if not metrics:
+            continue
+        totals = metrics['totals']
+        sample('refreshes_total', 'counter', "Refreshes completed", totals['refreshes'], provider=provider)
+        sample('refresh_errors_total', 'counter', "Refreshes that failed", totals['errors'], provider=provider)
+        for endpoint, count in sorted(totals['requests'].items()):
+            sample('api_requests_total', 'counter', "API requests sent", count, provider=provider, endpoint=endpoint)
+        for counter, value in sorted(totals['counters'].items()):
+            sample('events_total', 'counter', "Events counted while refreshing", value, provider=provider, event=counter)
+        last = metrics['last_refresh']
+        if last is None:
+            continue
+        sample('last_refresh_duration_seconds', 'gauge', "Wall time of the last refresh", last['duration'], provider=provider)
+        for phase, seconds in sorted(last['phases'].items()):
+            sample('last_refresh_phase_seconds', 'gauge', "Wall time per phase of the last refresh", seconds,
+                   provider=provider, phase=phase)
+        # A refresh that rendered nothing, such as an unchanged or empty one, has no hit ratio
+        if last.get('render_cache') and last['render_cache']['hit_rate'] is not None:
+            sample('last_refresh_render_cache_hit_ratio', 'gauge', "Rendered sections reused in the last refresh",
+                   last['render_cache']['hit_rate'], provider=provider)
+        if last.get('rendered_bytes') is not None:
+            sample('last_refresh_rendered_bytes', 'gauge', "UTF-8 size of the context the last refresh rendered",
+                   last['rendered_bytes'], provider=provider)
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n" if lines else ""
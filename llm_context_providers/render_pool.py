@@ -0,0 +1,40 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# "thread" keeps the event loop free while rendering; "process" also spreads rendering across cores
+RENDER_POOLS = ("thread", "process")
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_render_pool(kind, workers):
+    # One pool per kind and size, shared by every provider that renders with it
+    if kind not in RENDER_POOLS:
+        raise ValueError(f"Unknown render_pool '{kind}'. Expected one of: {', '.join(RENDER_POOLS)}.")
+    key = (kind, workers)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if kind == "process":
+                # multiprocessing is only imported by providers that ask for a process pool
+                from concurrent.futures import ProcessPoolExecutor
+                pool = ProcessPoolExecutor(max_workers=workers)
+            else:
+                pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+            _pools[key] = pool
+        return pool
+
+def discard_render_pool(pool):
+    # A process pool whose worker died is unusable; the next render gets a new one
+    with _pools_lock:
+        for key, existing in list(_pools.items()):
+            if existing is pool:
+                del _pools[key]
+    pool.shutdown(wait=False)
+
+def shutdown_render_pools(wait=True):
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait)
@@ -0,0 +1,120 @@
+import heapq
+import math
+import re
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> {doc_id: term frequency}
+        self.postings = {}
+        self.doc_lengths = {}
+        self.doc_terms = {}
+        self.versions = {}
+        self.total_length = 0
+        # Length normalisation per document, recomputed lazily after the index changes
+        self._norms = None
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_lengths
+
+    def add(self, doc_id, text, version=None):
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        frequencies = {}
+        tokens = tokenize(text)
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.doc_lengths[doc_id] = len(tokens)
+        self.doc_terms[doc_id] = list(frequencies)
+        self.versions[doc_id] = version
+        self.total_length += len(tokens)
+        self._norms = None
+
+    def add_many(self, documents):
+        for doc_id, text, version in documents:
+            self.add(doc_id, text, version)
+
+    def remove(self, doc_id):
+        if doc_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(doc_id):
+            documents = self.postings[term]
+            del documents[doc_id]
+            if not documents:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        self.versions.pop(doc_id, None)
+        self._norms = None
+
+    def search(self, query, limit=10):
+        if not self.doc_lengths:
+            return []
+        doc_count = len(self.doc_lengths)
+        norms = self._get_norms()
+        k1_plus_one = self.k1 + 1
+        scores = {}
+        for term in set(tokenize(query)):
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+            idf = math.log(1 + (doc_count - len(documents) + 0.5) / (len(documents) + 0.5))
+            weight = idf * k1_plus_one
+            for doc_id, frequency in documents.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * frequency / (frequency + norms[doc_id])
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def _get_norms(self):
+        if self._norms is None:
+            average_length = self.total_length / len(self.doc_lengths) or 1
+            k1, b = self.k1, self.b
+            self._norms = {doc_id: k1 * (1 - b + b * length / average_length)
+                           for doc_id, length in self.doc_lengths.items()}
+        return self._norms
+
+    def to_dict(self):
+        return {
+            'k1': self.k1,
+            'b': self.b,
+            'postings': self.postings,
+            'doc_lengths': self.doc_lengths,
+            'versions': self.versions
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(data['k1'], data['b'])
+        index.postings = data['postings']
+        index.doc_lengths = data['doc_lengths']
+        index.versions = data['versions']
+        index.total_length = sum(index.doc_lengths.values())
+        # Per-document term lists are not persisted; rebuild them from the postings
+        index.doc_terms = {doc_id: [] for doc_id in index.doc_lengths}
+        for term, documents in index.postings.items():
+            for doc_id in documents:
+                index.doc_terms[doc_id].append(term)
+        return index
+
+def merge_ranked_results(results, priorities=None):
+    # results maps a source name to its ranked (doc_id, score) pairs. Scores from different indexes are
+    # not comparable, so each source's are scaled by its own best score before merging. Ties go to the
+    # higher-priority source, then to the order sources were given in, then to each source's own rank.
+    priorities = priorities or {}
+    merged = []
+    for position, (source, hits) in enumerate(results.items()):
+        top = max((score for _, score in hits), default=0)
+        for rank, (doc_id, score) in enumerate(hits):
+            normalized = score / top if top > 0 else 0.0
+            merged.append((-normalized, -priorities.get(source, 0), position, rank, source, doc_id))
+    merged.sort()
+    return [(source, doc_id, -negated) for negated, _, _, _, source, doc_id in merged]
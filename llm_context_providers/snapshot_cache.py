@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import contextmanager
+from .snapshot_format import MappedSnapshot, write_snapshot
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+CacheEntry = namedtuple('CacheEntry', ['value', 'saved_at'])
+
+def make_cache_key(provider_name, config):
+    # Hash the provider config so a changed project or field list never reuses an old snapshot
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return f"{provider_name}-{digest[:16]}"
+
+class SnapshotCache(ABC):
+    def __init__(self, ttl=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value):
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    def is_expired(self, saved_at):
+        return self.ttl is not None and time.time() - saved_at > self.ttl
+
+class FileSnapshotCache(SnapshotCache):
+    suffix = '.json'
+
+    def __init__(self, path, ttl=None, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(ttl, max_bytes)
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, re.sub(r'[^A-Za-z0-9_.-]', '_', key) + self.suffix)
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if self.is_expired(entry['saved_at']):
+            self.delete(key)
+            return None
+        try:
+            # The file's mtime doubles as its last access time for LRU eviction
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return CacheEntry(entry['value'], entry['saved_at'])
+
+    def set(self, key, value):
+        # Write to a temporary file and rename it so readers in other processes never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump({'saved_at': time.time(), 'value': value}, file)
+            os.replace(tmp_path, self._entry_path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict(keep=self._entry_path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix):
+                continue
+            entry_path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry_path == keep:
+                continue
+            try:
+                os.remove(entry_path)
+            except OSError:
+                # Windows refuses to remove a file another process still has open or mapped
+                continue
+            total -= size
+
+class MmapSnapshotCache(FileSnapshotCache):
+    # One binary snapshot file per provider, mapped rather than parsed, so a warm start decodes only the
+    # tasks it touches and processes on one host share the file's pages. Task data is laid out in
+    # columns; the entry's other fields, and any other value, are stored alongside it.
+    # Windows can neither replace nor remove a file while it is mapped, so each save writes a new file
+    # named after its save time in nanoseconds, and older files of the entry are removed where possible.
+    suffix = '.snap'
+
+    def _entry_name(self, key):
+        return os.path.basename(super()._entry_path(key))[:-len(self.suffix)]
+
+    def _entry_paths(self, key):
+        # Every file of the entry, oldest first
+        prefix = self._entry_name(key) + '.'
+        names = sorted(name for name in os.listdir(self.path)
+                       if name.startswith(prefix) and name.endswith(self.suffix)
+                       and name[len(prefix):-len(self.suffix)].isdigit())
+        return [os.path.join(self.path, name) for name in names]
+
+    def _entry_path(self, key):
+        paths = self._entry_paths(key)
+        return paths[-1] if paths else None
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        if entry_path is None:
+            return None
+        try:
+            mapped = MappedSnapshot.open(entry_path)
+            attributes = mapped.attributes()
+            saved_at = attributes.pop('_saved_at')
+        except (OSError, ValueError, KeyError):
+            return None
+        if self.is_expired(saved_at):
+            mapped.close()
+            self.delete(key)
+            return None
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        if '_value' in attributes or 'data' in attributes:
+            # Nothing was laid out in columns, so nothing is left to read from the map
+            mapped.close()
+            return CacheEntry(attributes.get('_value', attributes), saved_at)
+        attributes['data'] = mapped
+        return CacheEntry(attributes, saved_at)
+
+    def set(self, key, value):
+        attributes = dict(value) if isinstance(value, dict) else {'_value': value}
+        data = attributes.get('data')
+        if _is_task_data(data):
+            del attributes['data']
+        else:
+            data = {}
+        attributes['_saved_at'] = time.time()
+        older = self._entry_paths(key)
+        # Never reuse a name, even when the clock has not moved on since the last save
+        version = time.time_ns()
+        if older:
+            version = max(version, int(older[-1][:-len(self.suffix)].rpartition('.')[2]) + 1)
+        entry_path = os.path.join(self.path, f"{self._entry_name(key)}.{version:020d}{self.suffix}")
+        write_snapshot(entry_path, data, attributes)
+        self._remove(older)
+        self._evict(keep=entry_path)
+
+    def delete(self, key):
+        self._remove(self._entry_paths(key))
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                # Still mapped on Windows; a later save or eviction removes it
+                pass
+
+def _is_task_data(data):
+    return (isinstance(data, dict) and isinstance(data.get('tasks'), list)
+            and all(isinstance(task, dict) and 'gid' in task for task in data['tasks']))
+
+class SqliteSnapshotCache(SnapshotCache):
+    def __init__(self, path, ttl=None, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(ttl, max_bytes)
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "saved_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # A connection per operation keeps the cache safe to share across threads and processes
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, saved_at FROM snapshots WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, saved_at = row
+            if self.is_expired(saved_at):
+                conn.execute("DELETE FROM snapshots WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE snapshots SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return CacheEntry(json.loads(value), saved_at)
+
+    def set(self, key, value):
+        payload = json.dumps(value)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots (key, value, size, saved_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now)
+            )
+            total = 0
+            rows = conn.execute("SELECT key, size FROM snapshots ORDER BY accessed_at DESC").fetchall()
+            for row_key, size in rows:
+                total += size
+                if total > self.max_bytes and row_key != key:
+                    conn.execute("DELETE FROM snapshots WHERE key = ?", (row_key,))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM snapshots WHERE key = ?", (key,))
+
+SNAPSHOT_CACHE_BACKENDS = {
+    'file': FileSnapshotCache,
+    'mmap': MmapSnapshotCache,
+    'sqlite': SqliteSnapshotCache
+}
+
+def create_snapshot_cache(cache_config):
+    backend = cache_config.get('backend', 'file')
+    cache_class = SNAPSHOT_CACHE_BACKENDS.get(backend)
+    if cache_class is None:
+        raise ValueError(f"Unknown cache backend '{backend}'. Expected one of: {', '.join(SNAPSHOT_CACHE_BACKENDS)}.")
+    default_path = '.context_cache.sqlite3' if backend == 'sqlite' else '.context_cache'
+    return cache_class(
+        cache_config.get('path', default_path),
+        ttl=cache_config.get('ttl'),
+        max_bytes=cache_config.get('max_bytes', DEFAULT_MAX_BYTES)
+    )
@@ -0,0 +1,336 @@
+# Versioned binary format for a provider's snapshot data, read in place through mmap.
+#
+# The data is the dict a snapshot exports (`tasks`, `sections`, `headers`, `fetched_at` and
+# anything else, such as the search index). Tasks and their stories are stored column by column, and
+# every string is stored once in a shared string table, so repeated user names and field values cost
+# one entry. A reader maps the file and decodes a task only when it is looked up. Processes that open
+# the same file share its pages through the OS page cache instead of each parsing their own copy.
+#
+# Layout, little-endian, every section aligned to 8 bytes:
+#
+#     header    magic, format version, then the offset and length of the metadata and of each section
+#     metadata  UTF-8 JSON: counts, task columns, headers, attributes and the string ids of other data
+#     strings   count, count + 1 offsets into the blob, then the UTF-8 blob
+#     tasks     per column: one tag byte per task, then one 8-byte payload per task
+#     stories   per task: start and count in the story table; then created_at, author and text
+#               columns laid out like the task columns
+#
+# A cell's tag says how to read its payload: missing, None, False, True, an integer, a float, a
+# string id, or the string id of a JSON document for lists and dicts.
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections.abc import MutableMapping
+
+MAGIC = b"LCPSNAP\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sII8Q")
+
+MISSING, NONE, FALSE, TRUE, INT, FLOAT, STRING, JSON = range(8)
+STORY_COLUMNS = ('created_at', 'author', 'text')
+# Keys of the exported data stored column by column; anything else is kept as one JSON document
+COLUMNAR_KEYS = ('tasks', 'sections', 'headers', 'fetched_at')
+
+_INT64 = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_SPAN = struct.Struct("<II")
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+class SnapshotFormatError(ValueError):
+    pass
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, value):
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def to_bytes(self):
+        offsets = array('Q', [0])
+        blob = bytearray()
+        for value in self.strings:
+            blob += value.encode('utf-8', 'surrogatepass')
+            offsets.append(len(blob))
+        return _pack_array(array('Q', [len(self.strings)])) + _pack_array(offsets) + bytes(blob)
+
+class _ColumnWriter:
+    def __init__(self, strings):
+        self.strings = strings
+        self.tags = bytearray()
+        self.payloads = array('q')
+
+    def append(self, value):
+        if value is _ABSENT:
+            self._put(MISSING, 0)
+        elif value is None:
+            self._put(NONE, 0)
+        elif value is True or value is False:
+            self._put(TRUE if value else FALSE, 0)
+        elif isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+            self._put(INT, value)
+        elif isinstance(value, float):
+            self._put(FLOAT, _INT64.unpack(_FLOAT.pack(value))[0])
+        elif isinstance(value, str):
+            self._put(STRING, self.strings.add(value))
+        else:
+            self._put(JSON, self.strings.add(json.dumps(value, sort_keys=True)))
+
+    def _put(self, tag, payload):
+        self.tags.append(tag)
+        self.payloads.append(payload)
+
+    def to_bytes(self):
+        return _pad(bytes(self.tags)) + _pack_array(self.payloads)
+
+_ABSENT = object()
+
+def _pad(data):
+    return data + b"\0" * (-len(data) % 8)
+
+def _pack_array(values):
+    if _BIG_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def encode_snapshot(data, attributes=None):
+    # Attributes are the cache entry's own fields, such as the rendered context, stored next to the data
+    strings = _StringTable()
+    tasks = data.get('tasks') or []
+    columns = ['gid'] if tasks else []
+    seen = {'gid', 'stories'}
+    for task in tasks:
+        for key in task:
+            if key not in seen:
+                seen.add(key)
+                columns.append(key)
+
+    task_columns = {column: _ColumnWriter(strings) for column in columns}
+    story_columns = [_ColumnWriter(strings) for _ in STORY_COLUMNS]
+    spans = array('I')
+    sections = data.get('sections') or {}
+    section_column = _ColumnWriter(strings)
+    for task in tasks:
+        for column, writer in task_columns.items():
+            writer.append(task.get(column, _ABSENT))
+        stories = task.get('stories') or []
+        spans.extend((len(story_columns[0].tags), len(stories)))
+        for story in stories:
+            for writer, value in zip(story_columns, story):
+                writer.append(value)
+        section_column.append(sections.get(task['gid'], _ABSENT))
+
+    metadata = {
+        'tasks': len(tasks),
+        'stories': len(story_columns[0].tags),
+        'columns': columns,
+        'fetched_at': data.get('fetched_at'),
+        'headers': [[project, strings.add(header)] for project, header in data.get('headers') or []],
+        # Other exported data, such as the search index, is one JSON document decoded only when asked for
+        'data': {key: strings.add(json.dumps(value)) for key, value in data.items() if key not in COLUMNAR_KEYS},
+        'attributes': {key: {'string': strings.add(value)} if isinstance(value, str) else {'value': value}
+                       for key, value in (attributes or {}).items()}
+    }
+    # Empty sections are left out, so small entries cost little more than their strings
+    metadata = {key: value for key, value in metadata.items() if value or key in ('tasks', 'stories')}
+    meta = _pad(json.dumps(metadata, separators=(',', ':')).encode('utf-8'))
+    task_bytes = b"".join(task_columns[column].to_bytes() for column in columns) + section_column.to_bytes()
+    story_bytes = _pad(_pack_array(spans)) + b"".join(writer.to_bytes() for writer in story_columns)
+    string_bytes = _pad(strings.to_bytes())
+
+    offset = HEADER.size
+    layout = []
+    for part in (meta, string_bytes, task_bytes, story_bytes):
+        layout.extend((offset, len(part)))
+        offset += len(part)
+    return b"".join([HEADER.pack(MAGIC, FORMAT_VERSION, 0, *layout), meta, string_bytes, task_bytes, story_bytes])
+
+def write_snapshot(path, data, attributes=None):
+    # Written to a temporary file and renamed, so a reader never maps a partial file; readers that
+    # already mapped the old file keep reading it until they close it
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(encode_snapshot(data, attributes))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class MappedSnapshot:
+    # Read-only view of an encoded snapshot that decodes tasks, stories and strings on demand
+    def __init__(self, buffer):
+        self.buffer = buffer
+        view = memoryview(buffer)
+        if len(view) < HEADER.size:
+            raise SnapshotFormatError("Snapshot file is truncated")
+        magic, version, _, *layout = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise SnapshotFormatError("Not a snapshot file")
+        if version != FORMAT_VERSION:
+            raise SnapshotFormatError(f"Unsupported snapshot format version {version}")
+        if layout[-2] + layout[-1] > len(view):
+            raise SnapshotFormatError("Snapshot file is truncated")
+        (meta_offset, meta_length, strings_offset, _, tasks_offset, _, stories_offset, _) = layout
+        self._view = view
+        self.metadata = json.loads(str(view[meta_offset:meta_offset + meta_length], 'utf-8').rstrip("\0"))
+        self.task_count = self.metadata['tasks']
+        self.story_count = self.metadata['stories']
+        self.columns = self.metadata.get('columns', [])
+
+        string_count = struct.unpack_from("<Q", view, strings_offset)[0]
+        self._string_offsets = strings_offset + 8
+        self._string_blob = self._string_offsets + 8 * (string_count + 1)
+
+        # Each column is a (tags offset, payloads offset) pair
+        self._task_columns = {column: _column(tasks_offset, index, self.task_count)
+                              for index, column in enumerate(self.columns)}
+        self._section_column = _column(tasks_offset, len(self.columns), self.task_count)
+        self._spans = stories_offset
+        self._story_columns = [_column(stories_offset + 8 * self.task_count, index, self.story_count)
+                               for index in range(len(STORY_COLUMNS))]
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as file:
+            # The map outlives the file object; its pages are shared with every process mapping the file
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def close(self):
+        # Values already decoded stay valid; nothing more can be read
+        self._view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    @property
+    def fetched_at(self):
+        return self.metadata.get('fetched_at')
+
+    @property
+    def headers(self):
+        return [(project, self.string(string_id)) for project, string_id in self.metadata.get('headers', [])]
+
+    def attributes(self):
+        return {key: self.string(entry['string']) if 'string' in entry else entry['value']
+                for key, entry in self.metadata.get('attributes', {}).items()}
+
+    def get(self, key, default=None):
+        # Exported data kept outside the columns, such as the search index
+        if key in ('fetched_at', 'headers'):
+            return getattr(self, key)
+        string_id = self.metadata.get('data', {}).get(key)
+        return json.loads(self.string(string_id)) if string_id is not None else default
+
+    def string(self, string_id):
+        start, end = struct.unpack_from("<QQ", self._view, self._string_offsets + 8 * string_id)
+        return str(self._view[self._string_blob + start:self._string_blob + end], 'utf-8', 'surrogatepass')
+
+    def gids(self):
+        return [self._cell(self._task_columns['gid'], row) for row in range(self.task_count)]
+
+    def task(self, row):
+        # One task as exported, with its stories as [created_at, author, text] lists
+        task = {}
+        for column, offset in self._task_columns.items():
+            value = self._cell(offset, row)
+            if value is not _ABSENT:
+                task[column] = value
+        start, count = _SPAN.unpack_from(self._view, self._spans + 8 * row)
+        task['stories'] = [[self._cell(offset, story) for offset in self._story_columns]
+                           for story in range(start, start + count)]
+        return task
+
+    def value(self, row, column):
+        # A single field of one task, without decoding the rest of it
+        offset = self._task_columns.get(column)
+        return _ABSENT if offset is None else self._cell(offset, row)
+
+    def section_rows(self):
+        tags = self._view[self._section_column[0]:self._section_column[0] + self.task_count]
+        return [row for row, tag in enumerate(tags) if tag != MISSING]
+
+    def section(self, row):
+        return self._cell(self._section_column, row)
+
+    def _cell(self, column, row):
+        tags, payloads = column
+        tag = self._view[tags + row]
+        if tag == MISSING:
+            return _ABSENT
+        if tag == NONE:
+            return None
+        if tag in (FALSE, TRUE):
+            return tag == TRUE
+        payload = _INT64.unpack_from(self._view, payloads + 8 * row)[0]
+        if tag == INT:
+            return payload
+        if tag == FLOAT:
+            return _FLOAT.unpack(_INT64.pack(payload))[0]
+        if tag == STRING:
+            return self.string(payload)
+        if tag == JSON:
+            return json.loads(self.string(payload))
+        raise SnapshotFormatError(f"Unknown cell tag {tag}")
+
+def _column(start, index, count):
+    tags = start + index * (count + -count % 8 + 8 * count)
+    return tags, tags + count + -count % 8
+
+class LazyMapping(MutableMapping):
+    # A dict over rows of a mapped snapshot. Each value is decoded on first lookup and kept; writes and
+    # deletes behave as on a dict, so a snapshot built on one works like any other.
+    def __init__(self, rows, load):
+        self._rows = rows
+        self._load = load
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            row = self._rows.get(key)
+            if row is None:
+                raise
+        value = self._values[key] = self._load(row)
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        found = self._rows.pop(key, None) is not None
+        if self._values.pop(key, _ABSENT) is _ABSENT and not found:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._values or key in self._rows
+
+    def __iter__(self):
+        yield from self._rows
+        for key in self._values:
+            if key not in self._rows:
+                yield key
+
+    def __len__(self):
+        return len(self._rows) + sum(1 for key in self._values if key not in self._rows)
+
+    def clear(self):
+        self._rows = {}
+        self._values = {}
+
+    def decoded(self):
+        # How many values have been decoded or set so far
+        return len(self._values)
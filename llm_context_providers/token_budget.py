@@ -0,0 +1,24 @@
+CHARS_PER_TOKEN = 4
+# Counts are cached per counting function. Past this many functions the cache starts over, so passing a
+# new lambda on every call costs a recount rather than unbounded memory.
+MAX_TOKEN_COUNTERS = 4
+
+def estimate_tokens(text):
+    # Rough estimate for English prose; pass a real tokenizer's counting function for exact budgets
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def count_characters(text):
+    return len(text)
+
+def cached_token_count(counts, count_tokens, text):
+    # counts maps counting functions to the count of one text
+    count = counts.get(count_tokens)
+    if count is None:
+        if len(counts) >= MAX_TOKEN_COUNTERS:
+            counts.clear()
+        count = counts[count_tokens] = count_tokens(text) if text else 0
+    return count
+
+def allocation_order(provider_names, priorities):
+    # Higher priority first; providers with equal priority keep their configured order
+    return sorted(provider_names, key=lambda name: -priorities.get(name, 0))
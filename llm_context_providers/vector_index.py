@@ -0,0 +1,234 @@
+import importlib
+import zlib
+from .search_index import tokenize
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Words per chunk; longer tasks are split so one long note does not drown out its own details
+DEFAULT_CHUNK_WORDS = 64
+DEFAULT_DIMENSIONS = 256
+# Word hashes are cached up to this many distinct words, then the cache starts over
+MAX_CACHED_WORDS = 1 << 20
+
+def require_numpy():
+    if np is None:
+        raise ImportError("The semantic index requires NumPy. Install it with "
+                          "`pip install llm-context-providers[semantic]`.")
+    return np
+
+def chunk_text(text, chunk_words=DEFAULT_CHUNK_WORDS):
+    # Consecutive windows of chunk_words words, overlapping by a quarter so a phrase is never only split
+    words = text.split() if text else []
+    if len(words) <= chunk_words:
+        return [" ".join(words)]
+    step = max(1, chunk_words - chunk_words // 4)
+    return [" ".join(words[start:start + chunk_words])
+            for start in range(0, len(words) - chunk_words + step, step)]
+
+class HashingEmbedder:
+    # Deterministic embeddings without a model: each word and pair of adjacent words is hashed to a
+    # signed dimension. Texts that share words get similar vectors, and every process gets the same ones.
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS, ngrams=2):
+        if dimensions < 1:
+            raise ValueError("dimensions must be at least 1.")
+        self.dimensions = dimensions
+        self.ngrams = ngrams
+
+    def embed(self, texts):
+        require_numpy()
+        word_hashes = _word_hashes
+        if len(word_hashes) > MAX_CACHED_WORDS:
+            word_hashes.clear()
+        hashes = []
+        lengths = []
+        for text in texts:
+            tokens = tokenize(text)
+            hashes.extend(map(word_hashes.__getitem__, tokens))
+            lengths.append(len(tokens))
+        words = np.asarray(hashes, dtype=np.uint64)
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+        features = [words]
+        feature_rows = [rows]
+        grams = words
+        for n in range(2, self.ngrams + 1):
+            # An n-gram's hash mixes its first n - 1 words' hash with the next word's, so no n-gram
+            # strings are built; n-grams that would span two texts are dropped
+            grams = _mix(grams[:-1], words[n - 1:])
+            same_text = rows[:len(rows) - n + 1] == rows[n - 1:]
+            features.append(grams[same_text])
+            feature_rows.append(rows[n - 1:][same_text])
+        hashes = np.concatenate(features)
+        rows = np.concatenate(feature_rows)
+        # The low bits pick the dimension and bit 31 the sign
+        signs = np.where((hashes >> np.uint64(31)) & np.uint64(1), 1.0, -1.0)
+        columns = (hashes % np.uint64(self.dimensions)).astype(np.int64)
+        counts = np.bincount(rows * self.dimensions + columns, weights=signs,
+                             minlength=len(texts) * self.dimensions)
+        return counts.reshape(len(texts), self.dimensions).astype(np.float32)
+
+class _WordHashes(dict):
+    def __missing__(self, word):
+        # crc32 rather than hash(), which is salted per process
+        value = self[word] = zlib.crc32(word.encode('utf-8'))
+        return value
+
+_word_hashes = _WordHashes()
+
+def _mix(left, right):
+    # splitmix64-style mixing; uint64 arithmetic wraps, as intended
+    mixed = left * np.uint64(0x9E3779B97F4A7C15) + right
+    mixed ^= mixed >> np.uint64(30)
+    mixed *= np.uint64(0xBF58476D1CE4E5B9)
+    mixed ^= mixed >> np.uint64(31)
+    return mixed
+
+EMBEDDERS = {'hashing': HashingEmbedder}
+
+def create_embedder(spec=None):
+    # None, a name from EMBEDDERS, "package.module:factory", a dict with one of those under 'name' plus
+    # keyword arguments, or an embedder itself: an object with a dimensions attribute and an embed(texts)
+    # method returning one row of that many floats per text
+    if spec is None:
+        return HashingEmbedder()
+    options = {}
+    if isinstance(spec, dict):
+        options = dict(spec)
+        spec = options.pop('name', 'hashing')
+    if not isinstance(spec, str):
+        return spec
+    if spec in EMBEDDERS:
+        return EMBEDDERS[spec](**options)
+    module, _, attribute = spec.partition(':')
+    if not attribute:
+        raise ValueError(f"Unknown embedder '{spec}'. Expected one of: {', '.join(EMBEDDERS)}, "
+                         "or 'package.module:factory'.")
+    return getattr(importlib.import_module(module), attribute)(**options)
+
+class VectorIndex:
+    # Chunk embeddings in one contiguous float32 matrix, one row per chunk. Documents are re-embedded only
+    # when their version changes; rows freed by removed documents are reused by later ones.
+    def __init__(self, embedder=None, chunk_words=DEFAULT_CHUNK_WORDS):
+        require_numpy()
+        self.embedder = create_embedder(embedder)
+        self.chunk_words = chunk_words
+        self.versions = {}
+        self.rows = {}
+        self.embedded_chunks = 0
+        self._vectors = None
+        self._row_docs = []
+        self._free = []
+
+    def __len__(self):
+        return len(self.versions)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.versions
+
+    @property
+    def chunk_count(self):
+        return len(self._row_docs) - len(self._free)
+
+    def add(self, doc_id, text, version=None):
+        self.add_many([(doc_id, text, version)])
+
+    def add_many(self, documents):
+        # Every chunk of every document is embedded in one call, which batched embedders need to be fast
+        documents = list(documents)
+        if not documents:
+            return
+        chunks = []
+        spans = []
+        for doc_id, text, version in documents:
+            pieces = chunk_text(text, self.chunk_words)
+            spans.append((doc_id, version, len(chunks), len(pieces)))
+            chunks.extend(pieces)
+        vectors = self._normalize(self.embedder.embed(chunks), len(chunks))
+        self.embedded_chunks += len(chunks)
+        for doc_id, version, start, count in spans:
+            self.remove(doc_id)
+            rows = self._allocate(count)
+            self._vectors[rows] = vectors[start:start + count]
+            for row in rows:
+                self._row_docs[row] = doc_id
+            self.rows[doc_id] = rows
+            self.versions[doc_id] = version
+
+    def remove(self, doc_id):
+        rows = self.rows.pop(doc_id, None)
+        if rows is None:
+            return
+        self.versions.pop(doc_id, None)
+        # A zero row scores zero against every query, so it never shows up in results
+        self._vectors[rows] = 0
+        for row in rows:
+            self._row_docs[row] = None
+        self._free.extend(rows)
+
+    def search(self, query, limit=10):
+        return self.search_many([query], limit)[0]
+
+    def search_many(self, queries, limit=10):
+        # All queries are scored against all chunks with one matrix multiplication. Each document
+        # scores as its best chunk; only positive cosine similarities are returned.
+        if not queries or not self.versions:
+            return [[] for _ in queries]
+        embedded = self._normalize(self.embedder.embed(list(queries)), len(queries))
+        scores = embedded @ self._vectors[:len(self._row_docs)].T
+        return [self._top(row, limit) for row in scores]
+
+    def _top(self, scores, limit):
+        # A document can own several of the best chunks, so candidates are widened until limit distinct
+        # documents are found or no positive scores remain
+        total = len(scores)
+        count = min(total, limit * 4)
+        while True:
+            candidates = np.argpartition(-scores, count - 1)[:count] if count < total else np.arange(total)
+            candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+            hits = {}
+            for row in candidates.tolist():
+                score = float(scores[row])
+                if score <= 0:
+                    return list(hits.items())
+                doc_id = self._row_docs[row]
+                if doc_id not in hits:
+                    hits[doc_id] = score
+                    if len(hits) == limit:
+                        return list(hits.items())
+            if count == total:
+                return list(hits.items())
+            count = min(total, count * 4)
+
+    def _allocate(self, count):
+        rows = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        start = len(self._row_docs)
+        needed = count - len(rows)
+        if needed:
+            self._reserve(start + needed)
+            self._row_docs.extend([None] * needed)
+            rows.extend(range(start, start + needed))
+        return rows
+
+    def _reserve(self, size):
+        # Capacity doubles, so adding n chunks one document at a time copies O(n) rows in total
+        capacity = 0 if self._vectors is None else len(self._vectors)
+        if size <= capacity:
+            return
+        vectors = np.zeros((max(size, capacity * 2, 64), self.dimensions), dtype=np.float32)
+        if self._vectors is not None:
+            vectors[:capacity] = self._vectors
+        self._vectors = vectors
+
+    @property
+    def dimensions(self):
+        return self.embedder.dimensions
+
+    def _normalize(self, vectors, count):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape != (count, self.dimensions):
+            raise ValueError(f"Embedder returned shape {vectors.shape}, expected ({count}, {self.dimensions}).")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
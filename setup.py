@@ -8,7 +8,7 @@ with open(os.path.join(os.path.dirname(__file__), 'README.md'), encoding='utf-8'
 setup(
     name='llm-context-providers',
     version='0.1.1',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     install_requires=[
         'asana',
@@ -17,9 +17,12 @@ setup(
         'pytz',
         'pyyaml'
     ],
+    extras_require={
+        'semantic': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
-            # Add any command line scripts here if needed
+            'llm-context-providers-bench=llm_context_providers.benchmark.harness:main',
         ],
     },
     classifiers=[
@@ -0,0 +1,218 @@
+import threading
+import time
+from datetime import datetime, timezone
+from dateutil import parser
+from llm_context_providers.asana_client import TokenBucket
+
+
+def make_project(gid="12345", name='Test Project'):
+    return {
+        'name': name,
+        'gid': gid,
+        'created_at': '2024-07-07T11:00:00Z',
+        'modified_at': '2024-07-10T12:34:00Z',
+        'owner': {'name': 'Test Owner'},
+        'notes': '',
+        'start_on': None,
+        'due_on': None
+    }
+
+
+def make_task(index, stories=1):
+    gid = str(1000 + index)
+    return {
+        'gid': gid,
+        'name': f'Task {index}',
+        'created_at': '2024-07-07T11:00:00Z',
+        'modified_at': '2024-07-10T12:34:00Z',
+        'completed': False,
+        'assignee': {'name': 'Test Assignee'},
+        'due_on': '2024-08-01',
+        'notes': f'Notes for task {index}',
+        'stories': [
+            {
+                'gid': f'{gid}-{n}',
+                'created_at': '2024-07-08T09:15:00Z',
+                'created_by': {'name': 'Test Author'},
+                'resource_subtype': 'comment_added',
+                'type': 'comment',
+                'text': f'Comment {n} on task {index}'
+            }
+            for n in range(stories)
+        ]
+    }
+
+
+class FakeAsana:
+    """In-memory stand-in for the asana SDK APIs with injectable latency."""
+
+    def __init__(self, tasks, project=None, latency=0.0, list_fields=None, projects=None):
+        self.project = project or make_project()
+        self.tasks = {task['gid']: task for task in tasks}
+        self.order = [task['gid'] for task in tasks]
+        # Task gids per project gid; without it every project lists every task
+        self.projects = projects
+        self.latency = latency
+        # Restricts which opt_fields the list endpoint honours; None means all of them
+        self.list_fields = list_fields
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.projects_api = _FakeProjectsApi(self)
+        self.portfolios_api = _FakePortfoliosApi(self)
+        self.tasks_api = _FakeTasksApi(self)
+        self.stories_api = _FakeStoriesApi(self)
+        self.batch_api = _FakeBatchApi(self)
+        self.rate_limiter = TokenBucket(60 * 10 ** 6)
+
+    def record(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def install(self, provider):
+        provider.client = self
+        provider.projects_api = self.projects_api
+        provider.portfolios_api = self.portfolios_api
+        provider.tasks_api = self.tasks_api
+        provider.stories_api = self.stories_api
+        provider.batch_api = self.batch_api
+
+    def touch(self, gid, **changes):
+        self.tasks[gid].update(changes, modified_at=datetime.now(timezone.utc).isoformat())
+
+    def add(self, task):
+        self.tasks[task['gid']] = dict(task, modified_at=datetime.now(timezone.utc).isoformat())
+        self.order.append(task['gid'])
+
+    def remove(self, gid, project_gid=None):
+        if project_gid is not None:
+            self.projects[project_gid].remove(gid)
+            return
+        self.order.remove(gid)
+        del self.tasks[gid]
+        for gids in (self.projects or {}).values():
+            if gid in gids:
+                gids.remove(gid)
+
+    def project_order(self, project_gid):
+        if self.projects is None:
+            return self.order
+        return self.projects.get(project_gid, [])
+
+    def stories(self, task_gid, opts):
+        stories = [dict(story) for story in self.tasks[task_gid]['stories']]
+        if not opts.get('opt_fields'):
+            return stories
+        # Like the API, nested fields such as created_by.name only return what was asked for
+        fields = {}
+        for field in opts['opt_fields'].split(','):
+            name, _, nested = field.partition('.')
+            fields.setdefault(name, set()).update([nested] if nested else [])
+        return [
+            {
+                name: {key: story[name][key] for key in nested} if nested and story[name] else story[name]
+                for name, nested in fields.items() if name in story
+            }
+            for story in stories
+        ]
+
+    def page(self, items, opts):
+        limit = opts.get('limit', 100)
+        offset = int(opts.get('offset') or 0)
+        next_page = {'offset': str(offset + limit)} if offset + limit < len(items) else None
+        return {'data': items[offset:offset + limit], 'next_page': next_page}
+
+
+class _FakeProjectsApi:
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get_project(self, project_gid, opts):
+        self.fake.record('get_project')
+        if self.fake.projects is not None:
+            return make_project(project_gid, name=f'Project {project_gid}')
+        return dict(self.fake.project)
+
+    def get_projects_for_team(self, team_gid, opts, full_payload=False):
+        self.fake.record('get_projects_for_team')
+        return self.fake.page([{'gid': gid} for gid in self.fake.projects or []], opts)
+
+    def get_projects_for_workspace(self, workspace_gid, opts, full_payload=False):
+        self.fake.record('get_projects_for_workspace')
+        return self.fake.page([{'gid': gid} for gid in self.fake.projects or []], opts)
+
+
+class _FakePortfoliosApi:
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get_items_for_portfolio(self, portfolio_gid, opts, full_payload=False):
+        self.fake.record('get_items_for_portfolio')
+        items = [{'gid': gid, 'resource_type': 'project'} for gid in self.fake.projects or []]
+        items.append({'gid': 'nested', 'resource_type': 'portfolio'})
+        return self.fake.page(items, opts)
+
+
+class _FakeTasksApi:
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get_tasks_for_project(self, project_gid, opts, full_payload=False):
+        self.fake.record('get_tasks_for_project')
+        return self._list(self.fake.project_order(project_gid), opts, full_payload)
+
+    def get_tasks(self, opts, full_payload=False):
+        self.fake.record('get_tasks')
+        gids = self.fake.project_order(opts['project']) if opts.get('project') else self.fake.order
+        if opts.get('modified_since'):
+            since = parser.parse(opts['modified_since'])
+            gids = [gid for gid in gids if parser.parse(self.fake.tasks[gid]['modified_at']) >= since]
+        return self._list(gids, opts, full_payload)
+
+    def _list(self, gids, opts, full_payload):
+        fields = set(opts.get('opt_fields', '').split(',')) | {'gid'}
+        if self.fake.list_fields is not None:
+            fields &= set(self.fake.list_fields) | {'gid'}
+        tasks = [
+            {field: value for field, value in self.fake.tasks[gid].items() if field in fields}
+            for gid in gids
+        ]
+        if full_payload:
+            return self.fake.page(tasks, opts)
+        return iter(tasks)
+
+    def get_task(self, task_gid, opts):
+        self.fake.record('get_task')
+        task = dict(self.fake.tasks[task_gid])
+        task.pop('stories', None)
+        return task
+
+
+class _FakeStoriesApi:
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get_stories_for_task(self, task_gid, opts):
+        self.fake.record('get_stories_for_task')
+        return iter(self.fake.stories(task_gid, opts))
+
+
+class _FakeBatchApi:
+    def __init__(self, fake):
+        self.fake = fake
+
+    def create_batch_request(self, body, opts):
+        self.fake.record('create_batch_request')
+        actions = body['data']['actions']
+        assert len(actions) <= 10
+        results = []
+        for action in actions:
+            task_gid = action['relative_path'].split('/')[2]
+            options = dict(action.get('options', {}))
+            # Like the API, batch actions take fields as a list rather than opt_fields
+            assert 'opt_fields' not in options
+            options['opt_fields'] = ",".join(options.pop('fields', []))
+            stories = self.fake.stories(task_gid, options)
+            results.append({'status_code': 200, 'body': self.fake.page(stories, options)})
+        return iter(results)
@@ -0,0 +1,119 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from unittest.mock import patch
+from llm_context_providers import AsanaContextProvider
+from llm_context_providers.asana_client import (
+    TokenBucket, backoff_delay, clear_shared_clients, get_shared_client, retry_after_seconds
+)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def stub_server():
+    # Serves GET /projects/<gid>, replying with the queued (status, headers) responses before a 200
+    responses = []
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            status, headers = responses.pop(0) if responses else (200, {})
+            body = {'data': {'gid': '1', 'name': 'Stub Project'}} if status == 200 else {'errors': [{'message': 'nope'}]}
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", responses, requests
+    server.shutdown()
+    server.server_close()
+    clear_shared_clients()
+
+def test_token_bucket_limits_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(60, capacity=2, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(1.0)
+    clock.now += 10
+    assert bucket.acquire() == 0
+
+def test_token_bucket_pause_holds_back_callers():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock, sleep=clock.sleep)
+    bucket.pause(5)
+    assert bucket.acquire() == pytest.approx(5.0)
+
+def test_backoff_delay_is_jittered_and_capped():
+    delays = [backoff_delay(3, 2) for _ in range(50)]
+    assert all(8 <= delay <= 16 for delay in delays)
+    assert len(set(delays)) > 1
+    assert backoff_delay(20, 2, max_delay=60) <= 60
+
+def test_shared_client_per_token():
+    try:
+        first = AsanaContextProvider(project_id="1", personal_access_token="shared-token")
+        second = AsanaContextProvider(project_id="2", personal_access_token="shared-token")
+        other = AsanaContextProvider(project_id="3", personal_access_token="other-token")
+        assert first.api_client is second.api_client
+        assert first.client.rate_limiter is second.client.rate_limiter
+        assert first.api_client is not other.api_client
+        assert get_shared_client("shared-token") is first.client
+    finally:
+        clear_shared_clients()
+
+def test_retries_honour_retry_after_and_back_off(stub_server):
+    host, responses, requests = stub_server
+    responses.extend([(429, {'Retry-After': '3'}), (503, {})])
+    provider = AsanaContextProvider(project_id="1", personal_access_token="stub-token", host=host)
+
+    with patch('llm_context_providers.asana_context_provider.time.sleep') as mock_sleep, \
+         patch.object(provider.client.rate_limiter, 'pause') as mock_pause:
+        project = provider.get_project_info_sync(retries=3, delay=0.5)
+
+    assert project['name'] == 'Stub Project'
+    assert len(requests) == 3
+    mock_pause.assert_called_once_with(3.0)
+    assert mock_sleep.call_args_list[0].args[0] == 3.0
+    assert 0.5 <= mock_sleep.call_args_list[1].args[0] <= 1.0
+
+@pytest.mark.asyncio
+async def test_async_retries_give_up_after_limit(stub_server):
+    host, responses, requests = stub_server
+    responses.extend([(503, {})] * 3)
+    provider = AsanaContextProvider(project_id="1", personal_access_token="stub-token", host=host)
+
+    with pytest.raises(RuntimeError, match="ProjectsApi->get_project"):
+        await provider.get_project_info(retries=3, delay=0.01)
+    assert len(requests) == 3
+
+def test_retry_after_parsing():
+    class Error:
+        headers = {'Retry-After': '2.5'}
+    assert retry_after_seconds(Error()) == 2.5
+    Error.headers = {'Retry-After': 'soon'}
+    assert retry_after_seconds(Error()) is None
+    Error.headers = None
+    assert retry_after_seconds(Error()) is None
@@ -1,7 +1,21 @@
+import io
 import os
+import pickle
+import time
+from datetime import datetime, timedelta, timezone
 import pytest
+import pytz
+import yaml
+from dateutil import parser
 from unittest.mock import patch, AsyncMock
-from llm_context_providers import AsanaContextProvider
+from asana.rest import ApiException
+from llm_context_providers import AsanaContextProvider, ContextManager, Status
+from llm_context_providers.asana_context_provider import (
+    MAX_BUDGET_RESULTS, MarkdownFormatter, StoryPolicy, TaskRecord, TaskSnapshot, DEFAULT_TASK_FIELDS
+)
+from llm_context_providers.render_pool import shutdown_render_pools
+from llm_context_providers.token_budget import MAX_TOKEN_COUNTERS, count_characters
+from .fake_asana import FakeAsana, make_project, make_task
 
 @pytest.fixture(autouse=True)
 def mock_env_vars(monkeypatch):
@@ -107,3 +121,702 @@ def test_missing_token():
                 "Notes": "notes"
             }
         )
+
+@pytest.mark.asyncio
+async def test_get_tasks_info_runs_concurrently_and_preserves_order():
+    fake = FakeAsana([make_task(i) for i in range(20)], latency=0.05)
+    provider = AsanaContextProvider(project_id="test_project_id", max_concurrency=10, fetch_mode="per_task")
+    fake.install(provider)
+
+    start = time.perf_counter()
+    tasks = await provider.get_tasks_info()
+    elapsed = time.perf_counter() - start
+
+    # 41 calls of 50ms each would take ~2s serially; with 10 in flight it is ~0.25s
+    assert elapsed < 1.0
+    assert [task['name'] for task in tasks] == [f'Task {i}' for i in range(20)]
+    assert all(len(task['stories']) == 1 for task in tasks)
+
+@pytest.mark.asyncio
+async def test_get_tasks_info_retries_with_async_sleep():
+    fake = FakeAsana([make_task(0)])
+    provider = AsanaContextProvider(project_id="test_project_id", fetch_mode="per_task")
+    fake.install(provider)
+    get_task = fake.tasks_api.get_task
+    failures = [ApiException(status=503)]
+
+    def flaky_get_task(task_gid, opts):
+        if failures:
+            raise failures.pop()
+        return get_task(task_gid, opts)
+
+    fake.tasks_api.get_task = flaky_get_task
+    with patch('llm_context_providers.asana_context_provider.asyncio.sleep', new=AsyncMock()) as mock_sleep:
+        tasks = await provider.get_tasks_info(delay=2)
+    mock_sleep.assert_awaited_once()
+    assert 1 <= mock_sleep.await_args.args[0] <= 2
+    assert tasks[0]['name'] == 'Task 0'
+
+def test_invalid_max_concurrency():
+    with pytest.raises(ValueError, match="max_concurrency"):
+        AsanaContextProvider(project_id="test_project_id", max_concurrency=0)
+
+def test_batch_fetch_mode_avoids_per_task_requests():
+    fake = FakeAsana([make_task(i, stories=3) for i in range(1000)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+
+    provider.fetch_context()
+
+    assert provider.get_request_counts() == {
+        'get_project': 1,
+        'get_tasks_for_project': 10,
+        'create_batch_request': 100
+    }
+    assert "Comment 2 on task 999" in provider.get_context()
+
+@pytest.mark.asyncio
+async def test_batch_fetch_mode_matches_per_task_output():
+    tasks = [make_task(i, stories=150) for i in range(12)]
+    batch_provider = AsanaContextProvider(project_id="test_project_id", page_size=5)
+    per_task_provider = AsanaContextProvider(project_id="test_project_id", fetch_mode="per_task")
+    FakeAsana(tasks).install(batch_provider)
+    per_task_fake = FakeAsana(tasks)
+    per_task_fake.install(per_task_provider)
+
+    await batch_provider.fetch_context_async()
+    await per_task_provider.fetch_context_async()
+
+    assert batch_provider.get_context() == per_task_provider.get_context()
+    # Second pages of stories are requested in follow-up batches
+    assert batch_provider.get_request_counts()['create_batch_request'] == 4
+    assert per_task_provider.get_request_counts()['get_task'] == 12
+
+def test_batch_fetch_mode_falls_back_for_missing_fields():
+    fake = FakeAsana([make_task(i) for i in range(3)], list_fields=['created_at'])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+
+    tasks = provider.get_tasks_info_sync()
+
+    assert provider.get_request_counts()['get_task'] == 3
+    assert tasks[0]['notes'] == 'Notes for task 0'
+
+def test_incremental_fetch_only_refetches_changed_tasks():
+    fake = FakeAsana([make_task(i) for i in range(30)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    provider.fetch_context()
+
+    fake.touch('1003', name='Renamed task')
+    fake.remove('1004')
+    fake.add(make_task(30))
+    with patch.object(MarkdownFormatter, 'generate_task_markdown', autospec=True,
+                      side_effect=MarkdownFormatter.generate_task_markdown) as render_task:
+        provider.fetch_context()
+
+    context = provider.get_context()
+    assert "Task: Renamed task" in context
+    assert "Task: Task 4\n" not in context
+    assert context.index("Task: Task 29") < context.index("Task: Task 30")
+    assert render_task.call_count == 2
+    assert provider.get_request_counts() == {
+        'get_project': 1,
+        'get_tasks_for_project': 1,
+        'get_tasks': 1,
+        'create_batch_request': 1
+    }
+
+    full = AsanaContextProvider(project_id="test_project_id")
+    fake.install(full)
+    full.fetch_context()
+    assert context == full.get_context()
+
+@pytest.mark.asyncio
+async def test_full_fetch_rebuilds_snapshot():
+    fake = FakeAsana([make_task(i) for i in range(30)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    await provider.fetch_context_async()
+
+    await provider.fetch_context_async(full_fetch=True)
+
+    counts = provider.get_request_counts()
+    assert 'get_tasks' not in counts
+    assert counts['create_batch_request'] == 3
+
+def test_streaming_render_matches_generate_project_markdown():
+    tasks = [make_task(i, stories=2) for i in range(3)]
+    formatter = MarkdownFormatter()
+    args = (make_project(), tasks, DEFAULT_TASK_FIELDS, "America/Toronto")
+
+    chunks = list(formatter.iter_project_markdown(*args))
+    sink = io.StringIO()
+    formatter.write_project_markdown(sink, *args)
+
+    assert len(chunks) == 4
+    assert "".join(chunks) == formatter.generate_project_markdown(*args) == sink.getvalue()
+
+def legacy_format_date(date_str, timezone):
+    date = parser.parse(date_str).astimezone(pytz.timezone(timezone))
+    day = date.day
+    suffix = 'th' if 4 <= day % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
+    return date.strftime(f'%B {day}{suffix}, %Y %I:%M %p')
+
+@pytest.mark.parametrize("date_str", [
+    '2024-07-07T11:00:00Z',
+    '2024-07-10T12:34:56.789Z',
+    '2024-03-10T06:59:59.999999Z',
+    '2024-11-03T05:30:00.1Z',
+    '2024-01-01T00:15:00+05:30',
+    '2023-12-31T23:45:00-08:00',
+    '2024-08-01',
+    '2024-02-29',
+    'July 22 2024 10:00 PM',
+    '2024-07-10 12:34:56',
+])
+@pytest.mark.parametrize("timezone", ["America/Toronto", "Asia/Kolkata", "UTC"])
+def test_format_date_matches_dateutil(date_str, timezone):
+    assert MarkdownFormatter.format_date(date_str, timezone) == legacy_format_date(date_str, timezone)
+
+@pytest.mark.parametrize("date_str", ['2024-07-10T12:34:56.789Z', '2024-03-10T06:59:59.999999Z', '2024-01-01T00:15:00+05:30'])
+@pytest.mark.parametrize("timezone", ["America/Toronto", "Asia/Kolkata", "UTC"])
+def test_format_date_renders_epoch_seconds_like_timestamps(date_str, timezone):
+    epoch = int(parser.parse(date_str).timestamp())
+    assert MarkdownFormatter.format_date(epoch, timezone) == legacy_format_date(date_str, timezone)
+
+def test_format_date_handles_missing_and_invalid_values():
+    assert MarkdownFormatter.format_date(None, "UTC") == 'N/A'
+    assert MarkdownFormatter.format_date('', "UTC") == 'N/A'
+    with pytest.raises(ValueError):
+        MarkdownFormatter.format_date('2024-02-30T10:00:00Z', "UTC")
+
+def make_budget_provider():
+    tasks = [make_task(i, stories=4) for i in range(6)]
+    for task in tasks[:3]:
+        task['completed'] = True
+    provider = AsanaContextProvider(project_id="test_project_id")
+    FakeAsana(tasks).install(provider)
+    provider.fetch_context()
+    return provider
+
+def test_budget_drops_completed_tasks_first():
+    provider = make_budget_provider()
+    full = provider.get_context()
+    budget = len(full) - 10
+
+    context, tokens = provider.get_context_within_budget(budget, count_characters)
+
+    assert tokens == len(context) <= budget
+    assert "Task: Task 0\n" not in context
+    assert all(f"Task: Task {i}\n" in context for i in range(1, 6))
+    assert context.count("Comment") == full.count("Comment") - 4
+
+def test_budget_trims_oldest_stories_before_open_tasks():
+    provider = make_budget_provider()
+    open_sections = "".join(provider._snapshot.sections[gid] for gid in provider._snapshot.order[3:])
+    budget = len("".join(provider._snapshot.headers.values())) + len(open_sections) - 60
+
+    context, tokens = provider.get_context_within_budget(budget, count_characters)
+
+    assert tokens == len(context) <= budget
+    assert all(f"Task: Task {i}\n" in context for i in range(3, 6))
+    assert "Comment 3 on task 5" in context
+    assert "Comment 0 on task 5" not in context
+    # Every kept task is rendered completely
+    assert context.count("### Task:") == context.count("#### Stories") == 3
+
+def test_budget_too_small_for_header():
+    provider = make_budget_provider()
+    assert provider.get_context_within_budget(10, count_characters) == (None, 0)
+
+def test_budget_trims_are_reused_until_the_snapshot_changes():
+    provider = make_budget_provider()
+    open_sections = "".join(provider._snapshot.sections[gid] for gid in provider._snapshot.order[3:])
+    budget = len("".join(provider._snapshot.headers.values())) + len(open_sections) - 60
+    trimmed = provider.get_context_within_budget(budget, count_characters)
+    with patch.object(MarkdownFormatter, 'generate_task_markdown', autospec=True,
+                      side_effect=MarkdownFormatter.generate_task_markdown) as render_task:
+        assert provider.get_context_within_budget(budget, count_characters) == trimmed
+        assert render_task.call_count == 0
+        provider._snapshot = provider._snapshot.copy()
+        assert provider.get_context_within_budget(budget, count_characters) == trimmed
+        assert render_task.call_count > 0
+
+def test_token_counts_are_kept_for_a_few_counters_only():
+    provider = make_budget_provider()
+    for _ in range(20):
+        provider.count_context_tokens(lambda text: len(text))
+        provider.get_context_within_budget(100, lambda text: len(text))
+    assert len(provider._token_counts) <= MAX_TOKEN_COUNTERS
+    assert all(len(counts) <= MAX_TOKEN_COUNTERS for counts in provider._snapshot.token_counts.values())
+    assert len(provider._budget_results) <= MAX_BUDGET_RESULTS
+
+@pytest.mark.asyncio
+async def test_search_index_ranks_tasks_and_loads_only_matches():
+    tasks = [make_task(i) for i in range(10)]
+    tasks[7]['notes'] = 'Investigate the flaky payment gateway timeout'
+    fake = FakeAsana(tasks)
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    await provider.fetch_context_async()
+    await provider.index_context()
+
+    results = await provider.search_index("payment timeout")
+    assert [gid for gid, _ in results] == ['1007']
+
+    provider.load_from_index(results)
+    context = provider.get_context()
+    assert context.startswith("# Project: Test Project")
+    assert context.count("### Task:") == 1
+    assert "Investigate the flaky payment gateway timeout" in context
+
+@pytest.mark.asyncio
+async def test_search_index_updates_incrementally_after_refresh():
+    fake = FakeAsana([make_task(i) for i in range(10)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    await provider.fetch_context_async()
+    await provider.index_context()
+
+    fake.touch('1002', notes='Migrate the reporting database')
+    fake.remove('1003')
+    with patch.object(provider._index, 'add', wraps=provider._index.add) as index_add:
+        await provider.fetch_context_async()
+
+    assert index_add.call_count == 1
+    assert [gid for gid, _ in await provider.search_index("reporting database")] == ['1002']
+    assert '1003' not in provider._index
+
+@pytest.mark.parametrize("fetch_mode", ["batch", "per_task"])
+def test_snapshot_holds_compact_records(fetch_mode):
+    tasks = [make_task(i, stories=3) for i in range(4)]
+    tasks[1]['assignee'] = None
+    del tasks[2]['notes']
+    provider = AsanaContextProvider(project_id="test_project_id", fetch_mode=fetch_mode)
+    FakeAsana(tasks).install(provider)
+    provider.fetch_context()
+
+    formatter = MarkdownFormatter()
+    expected = formatter.generate_project_markdown(make_project(), tasks, DEFAULT_TASK_FIELDS, provider.TIMEZONE)
+    assert provider.get_context() == expected
+    assert "**Assignee**: N/A" in expected and "**Notes**: N/A" in expected
+
+    records = [provider._snapshot.tasks[task['gid']] for task in tasks]
+    assert all(isinstance(record, TaskRecord) for record in records)
+    assert isinstance(records[0].created_at, int) and records[0].due_on == '2024-08-01'
+    stories = [story for record in records for story in record.stories]
+    assert all(story.author is stories[0].author for story in stories)
+    assert not hasattr(stories[0], '__dict__')
+
+    restored = TaskSnapshot.from_dict(provider._snapshot.to_dict())
+    assert "".join(formatter.generate_task_markdown(restored.tasks[gid], DEFAULT_TASK_FIELDS, provider.TIMEZONE)
+                   for gid in restored.order) == "".join(provider._snapshot.sections[gid] for gid in restored.order)
+
+def make_multi_project_fake():
+    tasks = [make_task(i) for i in range(6)]
+    # Task 2 is multi-homed in projects 1 and 2, task 5 in projects 2 and 3
+    projects = {'1': ['1000', '1001', '1002'], '2': ['1002', '1003', '1005'], '3': ['1004', '1005']}
+    return FakeAsana(tasks, projects=projects)
+
+def section_owner(context, task_name):
+    # The project header that precedes a task's section
+    before = context[:context.index(f"### Task: {task_name}\n")]
+    return before[before.rindex("# Project: "):].split("\n", 1)[0]
+
+@pytest.mark.asyncio
+async def test_multi_project_fetch_dedupes_multi_homed_tasks():
+    fake = make_multi_project_fake()
+    provider = AsanaContextProvider(project_id=['1', '2', '3'], fetch_mode="per_task")
+    fake.install(provider)
+    await provider.fetch_context_async()
+
+    context = provider.get_context()
+    assert [line for line in context.splitlines() if line.startswith("# Project:")] == [
+        "# Project: Project 1", "# Project: Project 2", "# Project: Project 3"]
+    assert all(context.count(f"### Task: Task {i}\n") == 1 for i in range(6))
+    assert section_owner(context, "Task 2") == "# Project: Project 1"
+    assert section_owner(context, "Task 5") == "# Project: Project 2"
+    assert fake.calls['get_task'] == 6
+    assert provider.get_request_counts()['get_tasks_for_project'] == 3
+
+def test_multi_project_refresh_moves_task_to_remaining_project():
+    fake = make_multi_project_fake()
+    provider = AsanaContextProvider(project_id=['1', '2', '3'])
+    fake.install(provider)
+    provider.fetch_context()
+
+    fake.remove('1002', project_gid='1')
+    fake.remove('1004')
+    provider.fetch_context()
+
+    context = provider.get_context()
+    assert section_owner(context, "Task 2") == "# Project: Project 2"
+    assert "Task: Task 4\n" not in context
+    assert context.count("### Task: Task 5\n") == 1
+    restored = TaskSnapshot.from_dict(provider._snapshot.to_dict())
+    assert restored.join(restored.sections) == context
+
+@pytest.mark.parametrize("selector", ["portfolio_id", "team_id", "workspace_id"])
+def test_project_selectors_expand_to_projects(selector):
+    fake = make_multi_project_fake()
+    provider = AsanaContextProvider(**{selector: 'selector-gid'}, project_id='3')
+    fake.install(provider)
+    provider.fetch_context()
+
+    context = provider.get_context()
+    # Explicit projects come first, selected projects follow without repeats
+    assert [line for line in context.splitlines() if line.startswith("# Project:")] == [
+        "# Project: Project 3", "# Project: Project 1", "# Project: Project 2"]
+    assert all(context.count(f"### Task: Task {i}\n") == 1 for i in range(6))
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fetch_mode", ["batch", "per_task"])
+async def test_stream_context_renders_pages_as_they_arrive(fetch_mode):
+    fake = FakeAsana([make_task(i, stories=2) for i in range(40)], latency=0.005)
+    provider = AsanaContextProvider(project_id="test_project_id", fetch_mode=fetch_mode, page_size=5)
+    fake.install(provider)
+
+    chunks = []
+    pages_at_first_task = None
+    async for chunk in provider.stream_context_async(max_buffered=5):
+        if pages_at_first_task is None and chunk.startswith("### Task"):
+            pages_at_first_task = fake.calls['get_tasks_for_project']
+        chunks.append(chunk)
+
+    # The first task is sent on while most of the 8 pages have not been requested yet
+    assert pages_at_first_task <= 3
+    assert fake.calls['get_tasks_for_project'] == 8
+    assert "".join(chunks) == provider.get_context()
+    expected = AsanaContextProvider(project_id="test_project_id", fetch_mode=fetch_mode)
+    fake.install(expected)
+    expected.fetch_context()
+    assert provider.get_context() == expected.get_context()
+    assert provider.status == Status.FRESH
+
+@pytest.mark.asyncio
+async def test_stream_context_reuses_unchanged_sections():
+    fake = make_multi_project_fake()
+    provider = AsanaContextProvider(project_id=['1', '2', '3'])
+    fake.install(provider)
+    provider.fetch_context()
+
+    fake.touch('1003', name='Renamed task')
+    batches = fake.calls['create_batch_request']
+    sink = io.StringIO()
+    written = await provider.write_context_async(sink)
+
+    assert fake.calls['create_batch_request'] == batches + 1
+    assert written == len(sink.getvalue())
+    assert sink.getvalue() == provider.get_context()
+    assert "### Task: Renamed task\n" in sink.getvalue()
+    assert sink.getvalue().count("### Task: Task 2\n") == 1
+
+@pytest.mark.asyncio
+async def test_stream_context_stopped_early_keeps_previous_snapshot():
+    fake = FakeAsana([make_task(i) for i in range(20)])
+    provider = AsanaContextProvider(project_id="test_project_id", page_size=5)
+    fake.install(provider)
+    provider.fetch_context()
+    context = provider.get_context()
+
+    fake.touch('1000', name='Changed')
+    stream = provider.stream_context_async()
+    async for chunk in stream:
+        if chunk.startswith("### Task"):
+            break
+    await stream.aclose()
+
+    assert provider.status == Status.STALE
+    assert provider.get_context() == context
+
+def test_render_cache_survives_refresh_and_warm_start():
+    fake = FakeAsana([make_task(i) for i in range(30)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    provider.fetch_context()
+    assert provider.get_render_stats()['misses'] == 30
+
+    fake.touch('1003', name='Renamed task')
+    fake.touch('1007', name='Another rename')
+    fake.remove('1010')
+    with patch.object(MarkdownFormatter, 'generate_task_markdown', autospec=True,
+                      side_effect=MarkdownFormatter.generate_task_markdown) as render_task:
+        provider.fetch_context()
+
+    assert render_task.call_count == 2
+    stats = provider.get_render_stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (27, 32, 29)
+
+    restarted = AsanaContextProvider(project_id="test_project_id")
+    fake.install(restarted)
+    restarted.import_snapshot(provider.export_snapshot())
+    fake.touch('1000', name='Changed again')
+    with patch.object(MarkdownFormatter, 'generate_task_markdown', autospec=True,
+                      side_effect=MarkdownFormatter.generate_task_markdown) as render_task:
+        restarted.fetch_context()
+    assert render_task.call_count == 1
+    assert restarted.get_render_stats()['hits'] == 28
+
+    # Sections rendered for another timezone are dropped even by an incremental refresh
+    restarted.TIMEZONE = "UTC"
+    restarted.fetch_context()
+    assert restarted.get_render_stats()['entries'] == 29
+    assert restarted.get_render_stats()['misses'] == 30
+    assert "July 7th, 2024 11:00 AM" in restarted.get_context()
+    assert "July 7th, 2024 07:00 AM" not in restarted.get_context()
+
+    # A full fetch trusts nothing already rendered
+    with patch.object(MarkdownFormatter, 'generate_task_markdown', autospec=True,
+                      side_effect=MarkdownFormatter.generate_task_markdown) as render_task:
+        restarted.fetch_context(full_fetch=True)
+    assert render_task.call_count == 29
+
+def test_render_cache_tells_apart_edits_within_one_second():
+    task = make_task(0)
+    task['modified_at'] = "2024-07-10T12:34:00.100Z"
+    provider = AsanaContextProvider(project_id="test_project_id")
+    FakeAsana([task]).install(provider)
+    provider.fetch_context()
+
+    edited = TaskRecord.from_dict(dict(task, modified_at="2024-07-10T12:34:00.900Z"))
+    known = provider._snapshot.tasks['1000']
+    # Rendering shows whole seconds, but the render cache compares the exact time
+    assert edited.modified_at == known.modified_at
+    assert edited.version() != known.version()
+    assert not provider._render_cache.contains('1000', edited.version())
+    assert provider._render_cache.contains('1000', known.version())
+
+def test_metrics_report_phases_requests_and_render_cache(caplog, capsys):
+    fake = FakeAsana([make_task(i, stories=2) for i in range(30)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    provider.enable_metrics()
+    provider.fetch_context()
+
+    report = provider.last_metrics
+    assert set(report['phases']) == {'fetch_projects', 'list_tasks', 'enrich_tasks', 'render'}
+    assert report['counters']['tasks_listed'] == report['counters']['tasks_enriched'] == 30
+    assert report['requests'] == {'get_project': 1, 'get_tasks_for_project': 1, 'create_batch_request': 3}
+    assert report['render_cache'] == {'hits': 0, 'misses': 30, 'hit_rate': 0.0}
+    assert report['rendered_bytes'] == len(provider.get_context().encode('utf-8'))
+    assert report['error'] is None
+
+    fake.touch('1003', name='Renamed task')
+    get_tasks = fake.tasks_api.get_tasks
+    failures = [ApiException(status=503)]
+
+    def flaky_get_tasks(opts, full_payload=False):
+        if failures:
+            raise failures.pop()
+        return get_tasks(opts, full_payload)
+
+    fake.tasks_api.get_tasks = flaky_get_tasks
+    with patch('llm_context_providers.asana_context_provider.time.sleep'):
+        provider.fetch_context()
+    assert provider.last_metrics['counters']['retries'] == provider.last_metrics['counters']['retries_503'] == 1
+    # Retries are logged rather than printed
+    assert "Asana returned 503, retrying" in caplog.text
+    assert capsys.readouterr().out == ""
+    assert provider.last_metrics['render_cache'] == {'hits': 29, 'misses': 1, 'hit_rate': 29 / 30}
+    assert provider.provide_status()['metrics']['totals']['refreshes'] == 2
+
+def test_metrics_disabled_by_default():
+    fake = FakeAsana([make_task(i) for i in range(3)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    provider.fetch_context()
+    assert provider.last_metrics is None
+    assert provider.get_metrics() is None
+    assert 'metrics' not in provider.provide_status()
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("render_pool", ["thread", "process"])
+async def test_render_pool_matches_inline_render(render_pool):
+    fake = FakeAsana([make_task(i, stories=2) for i in range(30)])
+    inline = AsanaContextProvider(project_id="test_project_id")
+    fake.install(inline)
+    inline.fetch_context()
+
+    provider = AsanaContextProvider(project_id="test_project_id", render_workers=2, render_pool=render_pool,
+                                    render_chunk_size=7)
+    fake.install(provider)
+    try:
+        await provider.fetch_context_async()
+        assert provider.get_context() == inline.get_context()
+        assert provider.get_render_stats()['misses'] == 30
+
+        fake.touch('1003', name='Renamed task')
+        provider.fetch_context()
+        inline.fetch_context()
+        assert provider.get_context() == inline.get_context()
+        assert provider.get_render_stats()['hits'] == 29
+    finally:
+        shutdown_render_pools()
+
+def test_task_records_pickle_compactly():
+    record = TaskRecord.from_dict(dict(make_task(0, stories=2), custom='value'))
+    del record.due_on
+    restored = pickle.loads(pickle.dumps(record))
+    assert restored.to_dict() == record.to_dict()
+    assert not hasattr(restored, 'due_on')
+    assert restored.stories[1].text == 'Comment 1 on task 0'
+
+def test_invalid_render_options():
+    with pytest.raises(ValueError, match="render_workers"):
+        AsanaContextProvider(project_id="test_project_id", render_workers=-1)
+    with pytest.raises(ValueError, match="render_pool"):
+        AsanaContextProvider(project_id="test_project_id", render_pool="gpu")
+
+def test_unchanged_refresh_keeps_context_and_version():
+    fake = FakeAsana([make_task(i, stories=2) for i in range(6)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    provider.enable_metrics()
+    fake.install(provider)
+    provider.fetch_context()
+    context, version, changed = provider.get_context(), provider.context_version, provider.last_changed
+
+    with patch.object(MarkdownFormatter, 'generate_task_markdown') as render:
+        provider.fetch_context()
+    render.assert_not_called()
+    assert provider.get_context() is context
+    assert provider.context_version == version and provider.last_changed == changed
+    assert provider.last_updated > changed
+    assert provider.last_metrics['counters']['unchanged_refreshes'] == 1
+
+    # A full fetch renders everything again, but the same data still has the same version
+    with patch.object(MarkdownFormatter, 'generate_task_markdown', autospec=True,
+                      side_effect=MarkdownFormatter.generate_task_markdown) as render:
+        provider.fetch_context(full_fetch=True)
+    assert render.call_count == 6
+    assert provider.get_context() == context
+    assert provider.context_version == version and provider.last_changed == changed
+
+    fake.touch('1003', notes='Changed notes')
+    provider.fetch_context()
+    assert "Changed notes" in provider.get_context()
+    assert provider.context_version != version and provider.last_changed > changed
+
+def test_edits_within_one_second_are_not_mistaken_for_unchanged_data():
+    # Both revisions fall inside one second, after the first fetch starts
+    second = (datetime.now(timezone.utc) + timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%S')
+    task = make_task(0)
+    task['modified_at'] = f"{second}.100Z"
+    fake = FakeAsana([task, make_task(1)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    provider.fetch_context()
+    version = provider.context_version
+
+    fake.tasks['1000'].update(name='Renamed within the second', modified_at=f"{second}.900Z")
+    provider.fetch_context()
+    assert "Renamed within the second" in provider.get_context()
+    assert provider.context_version != version
+
+def test_refresh_picks_up_edits_stamped_by_a_server_clock_behind_ours():
+    fake = FakeAsana([make_task(i) for i in range(3)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    provider.fetch_context()
+
+    behind = (datetime.now(timezone.utc) - timedelta(seconds=20)).isoformat()
+    fake.tasks['1001'].update(name='Saved by a slow clock', modified_at=behind)
+    provider.fetch_context()
+    assert "Saved by a slow clock" in provider.get_context()
+
+def test_context_version_falls_back_to_hashing_partial_context():
+    fake = FakeAsana([make_task(i) for i in range(4)])
+    provider = AsanaContextProvider(project_id="test_project_id")
+    fake.install(provider)
+    provider.fetch_context()
+    version = provider.context_version
+    provider.load_from_index(['1001'])
+    assert provider.context_version not in (None, version)
+    # The next refresh renders the full context again rather than keeping the partial one
+    provider.fetch_context()
+    assert provider.context_version == version
+    assert provider.get_context().count("### Task:") == 4
+
+def make_story_tasks():
+    # 250 stories per task, oldest first as Asana lists them, alternating comments and system events
+    tasks = [make_task(i, stories=250) for i in range(4)]
+    tasks[3]['completed'] = True
+    for task in tasks:
+        for n, story in enumerate(task['stories']):
+            story['created_at'] = f"2024-07-{1 + n // 10:02d}T{n % 10:02d}:00:00Z"
+            if n % 2:
+                story.update(resource_subtype='assigned', type='system', text=f'System event {n}')
+    return tasks
+
+@pytest.mark.parametrize("fetch_mode", ["batch", "per_task"])
+def test_story_policy_filters_stories_at_fetch_time(fetch_mode):
+    fake = FakeAsana(make_story_tasks())
+    provider = AsanaContextProvider(project_id="test_project_id", fields={"Task": "name"}, fetch_mode=fetch_mode,
+                                    story_types="comments", max_stories=5, stories_since="2024-07-20",
+                                    skip_completed_stories=True, timezone="UTC")
+    fake.install(provider)
+    provider.fetch_context()
+
+    assert 'completed' in provider.task_opt_fields.split(',')
+    tasks = provider._snapshot.tasks
+    # Comments from July 20th on, of which only the newest five are kept
+    assert [story.text for story in tasks['1000'].stories] == [f'Comment {n} on task 0' for n in range(240, 250, 2)]
+    assert tasks['1003'].stories == []
+    counts = provider.get_request_counts()
+    if fetch_mode == "batch":
+        # Three pages of stories for each of the three open tasks, in one batch per page
+        assert counts['create_batch_request'] == 3
+    else:
+        assert counts['get_stories_for_task'] == 3
+
+def test_skipped_tasks_take_no_batch_actions():
+    tasks = [make_task(i) for i in range(20)]
+    for task in tasks[::2]:
+        task['completed'] = True
+    fake = FakeAsana(tasks)
+    provider = AsanaContextProvider(project_id="test_project_id", skip_completed_stories=True)
+    fake.install(provider)
+    provider.fetch_context()
+    # The ten open tasks share one batch request
+    assert provider.get_request_counts()['create_batch_request'] == 1
+    assert [gid for gid in provider._snapshot.order] == [task['gid'] for task in tasks]
+    assert provider._snapshot.tasks['1001'].stories[0].text == 'Comment 0 on task 1'
+
+def test_story_policy_window_in_days_and_no_stories():
+    policy = StoryPolicy(since=7)
+    now = time.time()
+    assert now - 7 * 86400 - 1 <= policy.cutoff() <= now - 7 * 86400 + 1
+    assert not StoryPolicy(max_per_task=0).wants_stories({'completed': False})
+    assert StoryPolicy(skip_completed=True).wants_stories({'completed': False})
+
+    fake = FakeAsana([make_task(i, stories=3) for i in range(3)])
+    provider = AsanaContextProvider(project_id="test_project_id", max_stories=0)
+    fake.install(provider)
+    provider.fetch_context()
+    assert 'create_batch_request' not in provider.get_request_counts()
+    assert "Comment 0" not in provider.get_context()
+
+def test_invalid_story_options():
+    with pytest.raises(ValueError, match="story_types"):
+        AsanaContextProvider(project_id="test_project_id", story_types="likes")
+    with pytest.raises(ValueError, match="max_stories"):
+        AsanaContextProvider(project_id="test_project_id", max_stories=-1)
+    with pytest.raises(ValueError, match="stories_since"):
+        AsanaContextProvider(project_id="test_project_id", stories_since="last tuesday-ish")
+    with pytest.raises(ValueError, match="stories_since"):
+        AsanaContextProvider(project_id="test_project_id", stories_since=[90])
+
+def test_stories_since_accepts_unquoted_yaml_dates():
+    quoted = AsanaContextProvider(project_id="test_project_id", stories_since="2024-07-20")
+    for value in ("2024-07-20", "2024-07-20 00:00:00"):
+        config = yaml.safe_load(
+            "context_providers:\n"
+            "  asana:\n"
+            "    enabled: true\n"
+            "    project_id: test_project_id\n"
+            "    personal_access_token: token\n"
+            f"    stories_since: {value}\n"
+        )
+        assert not isinstance(config['context_providers']['asana']['stories_since'], str)
+        provider = ContextManager(config).context_providers['asana']
+        assert provider.story_policy.cutoff() == quoted.story_policy.cutoff()
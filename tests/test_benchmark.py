@@ -0,0 +1,92 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from llm_context_providers import AsanaContextProvider
+from llm_context_providers.asana_context_provider import MarkdownFormatter, DEFAULT_TASK_FIELDS
+from llm_context_providers.benchmark import FakeAsanaServer, make_project, make_tasks
+from llm_context_providers.benchmark.harness import main, parse_args, percentile, run
+
+def make_provider(server, **kwargs):
+    return AsanaContextProvider(project_id="1", personal_access_token="benchmark-token", host=server.url,
+                                requests_per_minute=10 ** 7, **kwargs)
+
+def test_fake_server_serves_provider():
+    project = make_project()
+    tasks = make_tasks(130, 3)
+    expected = MarkdownFormatter().generate_project_markdown(project, tasks, DEFAULT_TASK_FIELDS, "America/Toronto")
+    with FakeAsanaServer(project, tasks) as server:
+        for fetch_mode in ("batch", "per_task"):
+            server.reset_counts()
+            provider = make_provider(server, fetch_mode=fetch_mode, page_size=50)
+            asyncio.run(provider.fetch_context_async())
+            assert provider.get_context() == expected
+            assert server.request_counts['get_tasks_for_project'] == 3
+
+        # Incremental refreshes go through GET /tasks?modified_since=
+        server.tasks[tasks[5]['gid']]['name'] = "Renamed task"
+        server.tasks[tasks[5]['gid']]['modified_at'] = datetime.now(timezone.utc).isoformat()
+        server.reset_counts()
+        provider.fetch_context()
+        assert server.request_counts['get_tasks'] == 1
+        assert "Task: Renamed task" in provider.get_context()
+
+def test_fake_server_injects_errors():
+    tasks = make_tasks(20, 1)
+    with FakeAsanaServer(make_project(), tasks, rate_limited=0.3, unavailable=0.1, retry_after=0.01) as server:
+        provider = make_provider(server)
+        provider.fetch_context()
+        assert provider.get_context().count("### Task:") == 20
+        assert server.injected_errors[429] > 0
+        assert sum(server.request_counts.values()) > 3
+
+def test_percentile_uses_nearest_rank():
+    samples = [5, 1, 4, 2, 3]
+    assert percentile(samples, 0.5) == 3
+    assert percentile(samples, 0.99) == 5
+    assert percentile([7], 0.99) == 7
+
+def test_harness_reports_every_scenario():
+    args = parse_args(['--tasks', '25', '--stories', '1', '--repeat', '2', '--rate-limited', '0.2', '--retry-after', '0.01'])
+    del args.scenario
+    report = run(args)
+    assert set(report['scenarios']) == {'fetch_context', 'fetch_context_async', 'generate_project_markdown',
+                                        'get_combined_context'}
+    for name, result in report['scenarios'].items():
+        assert (result['runs'], result['failed_runs']) == (2, 0)
+        assert result['p50_seconds'] <= result['p99_seconds']
+        assert result['tasks_per_second'] > 0
+        assert result['peak_memory_bytes'] > 0
+    assert report['scenarios']['generate_project_markdown']['requests_per_run'] == {}
+    fetch = report['scenarios']['fetch_context']
+    assert fetch['requests_per_run']['get_project'] >= 1
+    assert fetch['output_chars'] == report['scenarios']['generate_project_markdown']['output_chars']
+
+def test_harness_counts_failed_runs_separately(monkeypatch):
+    fetch_context = AsanaContextProvider.fetch_context
+    calls = []
+
+    def fail_first_fetch(self, full_fetch=False):
+        calls.append(full_fetch)
+        if len(calls) == 1:
+            raise RuntimeError("Failed to fetch context: boom")
+        return fetch_context(self, full_fetch)
+
+    monkeypatch.setattr(AsanaContextProvider, 'fetch_context', fail_first_fetch)
+    args = parse_args(['--tasks', '5', '--stories', '1', '--repeat', '3'])
+    del args.scenario
+    result = run(args, ['get_combined_context'])['scenarios']['get_combined_context']
+    assert (result['runs'], result['failed_runs']) == (2, 1)
+    assert result['failures'] == ["Asana fetch failed: Failed to fetch context: boom"]
+    assert result['output_chars'] > 0 and result['peak_memory_bytes'] > 0
+
+    monkeypatch.setattr(AsanaContextProvider, 'fetch_context', lambda self, full_fetch=False: 1 / 0)
+    result = run(args, ['get_combined_context'])['scenarios']['get_combined_context']
+    assert (result['runs'], result['failed_runs']) == (0, 3)
+    assert result['p50_seconds'] is None and result['tasks_per_second'] is None
+
+def test_harness_writes_json(tmp_path, capsys):
+    output = tmp_path / "bench.json"
+    main(['--tasks', '5', '--stories', '1', '--repeat', '1', '--scenario', 'fetch_context', '--output', str(output)])
+    report = json.loads(output.read_text())
+    assert list(report['scenarios']) == ['fetch_context']
+    assert capsys.readouterr().out == ""
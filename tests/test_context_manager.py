@@ -1,6 +1,13 @@
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import time
 import pytest
-from unittest.mock import patch, AsyncMock
-from llm_context_providers import ContextManager, AsanaContextProvider
+from unittest.mock import patch, AsyncMock, Mock
+from llm_context_providers import ContextManager, ContextProvider, AsanaContextProvider, Status, context_provider
+from .fake_asana import FakeAsana, make_project, make_task
 
 @pytest.mark.asyncio
 async def test_fetch_all_contexts_async():
@@ -60,3 +67,391 @@ def test_fetch_all_contexts():
         with patch.object(AsanaContextProvider, 'fetch_context', return_value=None) as mock_fetch:
             manager.fetch_contexts()
             mock_fetch.assert_called_once()
+
+@pytest.mark.parametrize('backend', ['file', 'mmap'])
+def test_warm_start_from_snapshot_cache(tmp_path, monkeypatch, backend):
+    config = {
+        'global': {'timezone': 'America/Toronto'},
+        'cache': {'enabled': True, 'backend': backend, 'path': str(tmp_path), 'fresh_for': 600},
+        'context_providers': {
+            'asana': {
+                'enabled': True,
+                'project_id': 'test_project_id',
+                'personal_access_token': 'mock_personal_access_token'
+            }
+        }
+    }
+    fake = FakeAsana([make_task(i) for i in range(5)])
+    manager = ContextManager(config)
+    fake.install(manager.context_providers['asana'])
+    manager.fetch_contexts()
+    context = manager.get_combined_context()
+
+    restarted = ContextManager(config)
+    provider = restarted.context_providers['asana']
+    assert restarted.get_combined_context() == context
+    assert restarted.get_context_version() == manager.get_context_version()
+    assert provider.status == Status.FRESH
+    assert restarted.refresh_in_background() == {}
+    if backend == 'mmap':
+        # Mapped tasks are only decoded once a refresh or render needs them
+        assert provider._snapshot.tasks.decoded() == 0
+
+    # Persisted task data lets the first refresh after a restart be incremental
+    fake.install(provider)
+    restarted.fetch_contexts()
+    assert 'get_tasks' in provider.get_request_counts()
+    assert restarted.get_combined_context() == context
+    fake.touch('1002', name='Renamed task')
+    restarted.fetch_contexts()
+    # The refresh is saved even while the loaded snapshot is still mapped
+    saved = provider.snapshot_cache.get(provider.cache_key).value
+    assert "Renamed task" in saved['context_info']
+    assert saved['version'] == provider.context_version
+
+    config['cache']['fresh_for'] = 0
+    monkeypatch.setattr(time, 'time', lambda: 10 ** 12)
+    assert ContextManager(config).context_providers['asana'].status == Status.STALE
+
+def make_manager(**provider_overrides):
+    config = {
+        'global': {'timezone': 'America/Toronto'},
+        'fetch': {'max_concurrent_providers': 4},
+        'context_providers': {
+            'asana': dict({
+                'enabled': True,
+                'project_id': 'test_project_id',
+                'personal_access_token': 'mock_personal_access_token'
+            }, **provider_overrides)
+        }
+    }
+    manager = ContextManager(config)
+    for name in ('second', 'third'):
+        manager.context_providers[name] = AsanaContextProvider(project_id=name, personal_access_token='token')
+        manager.provider_timeouts[name] = manager.provider_timeouts['asana']
+    return manager
+
+@pytest.mark.asyncio
+async def test_fetch_contexts_async_runs_providers_concurrently():
+    manager = make_manager()
+
+    async def slow_fetch(self, full_fetch=False):
+        await asyncio.sleep(0.2)
+        if self.project_id == 'second':
+            raise RuntimeError("boom")
+        self.context_info = f"# {self.project_id}"
+
+    with patch.object(AsanaContextProvider, 'fetch_context_async', new=slow_fetch):
+        start = time.perf_counter()
+        await manager.fetch_contexts_async()
+        elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.5
+    status = manager.get_status()
+    assert status['second']['last_fetch']['error'] == "boom"
+    assert status['asana']['last_fetch']['error'] is None
+    assert status['asana']['last_fetch']['duration'] >= 0.2
+    assert manager.get_combined_context() == "# test_project_id\n# third\n"
+
+@pytest.mark.asyncio
+async def test_fetch_contexts_async_applies_timeout():
+    manager = make_manager(timeout=0.1)
+
+    async def hanging_fetch(self, full_fetch=False):
+        self.update_status(Status.FETCHING)
+        await asyncio.sleep(10)
+
+    with patch.object(AsanaContextProvider, 'fetch_context_async', new=hanging_fetch):
+        report = await manager.fetch_contexts_async(providers=['asana'])
+
+    assert report['asana']['timed_out'] is True
+    assert manager.context_providers['asana'].status == Status.STALE
+
+def test_fetch_contexts_uses_thread_pool_with_timeout():
+    manager = make_manager(timeout=0.5)
+
+    def blocking_fetch(self, full_fetch=False):
+        time.sleep(2 if self.project_id == 'third' else 0.2)
+        self.context_info = f"# {self.project_id}"
+
+    with patch.object(AsanaContextProvider, 'fetch_context', new=blocking_fetch):
+        start = time.perf_counter()
+        report = manager.fetch_contexts()
+        elapsed = time.perf_counter() - start
+
+    assert elapsed < 1.5
+    assert report['third']['timed_out'] is True
+    assert report['asana']['error'] is None
+    assert manager.get_combined_context(providers=['asana', 'second']) == "# test_project_id\n# second\n"
+
+def test_combined_context_stream():
+    manager = make_manager()
+    manager.context_providers['asana'].context_info = "# first"
+    manager.context_providers['third'].context_info = "# third"
+
+    assert list(manager.get_combined_context_stream()) == ["# first", "\n", "# third", "\n"]
+    sink = io.StringIO()
+    assert manager.write_combined_context(sink) == len(manager.get_combined_context())
+    assert sink.getvalue() == manager.get_combined_context() == "# first\n# third\n"
+
+def test_budgeted_context_respects_priority_and_caches_token_counts():
+    manager = make_manager()
+    manager.context_providers['asana'].context_info = "a" * 40
+    manager.context_providers['second'].context_info = "b" * 40
+    manager.context_providers['third'].context_info = "c" * 40
+    manager.provider_priorities.update({'third': 10, 'asana': 5})
+    count_tokens = Mock(side_effect=len)
+
+    context = manager.get_combined_context(budget=90, count_tokens=count_tokens)
+    assert context == "a" * 40 + "\n" + "c" * 40 + "\n"
+    calls = count_tokens.call_count
+
+    assert manager.get_combined_context(budget=90, count_tokens=count_tokens) == context
+    # Only the separator is counted again; provider contexts reuse their cached counts
+    assert count_tokens.call_count == calls + 1
+
+    manager.context_providers['third'].context_info = "d" * 40
+    assert manager.get_combined_context(budget=90, count_tokens=count_tokens) == "a" * 40 + "\n" + "d" * 40 + "\n"
+    assert manager.get_combined_context() == "a" * 40 + "\n" + "b" * 40 + "\n" + "d" * 40 + "\n"
+
+def test_request_refresh_coalesces_and_serves_previous_context():
+    manager = make_manager()
+    provider = manager.context_providers['asana']
+    provider.context_info = "# old"
+    calls = []
+
+    def slow_fetch(self, full_fetch=False):
+        calls.append(self.project_id)
+        time.sleep(0.3)
+        self.context_info = "# new"
+
+    with patch.object(AsanaContextProvider, 'fetch_context', new=slow_fetch):
+        futures = [manager.request_refresh('asana') for _ in range(3)]
+        start = time.perf_counter()
+        assert manager.get_combined_context(providers=['asana']) == "# old\n"
+        assert time.perf_counter() - start < 0.1
+        assert futures[0] is futures[1] is futures[2]
+        assert futures[0].result(timeout=2)['error'] is None
+
+    assert calls == ['test_project_id']
+    assert manager.get_combined_context(providers=['asana']) == "# new\n"
+
+def test_scheduler_refreshes_each_provider_on_its_interval():
+    manager = make_manager(refresh_interval=0.05)
+    manager.refresh_intervals.update({'second': None, 'third': 10})
+    manager.refresh_jitter = 0
+    calls = []
+
+    def fetch(self, full_fetch=False):
+        calls.append(self.project_id)
+
+    with patch.object(AsanaContextProvider, 'fetch_context', new=fetch):
+        manager.start_scheduler()
+        time.sleep(0.4)
+        manager.stop_scheduler(timeout=1)
+
+    assert calls.count('test_project_id') >= 3
+    assert 'second' not in calls
+    # A provider that is not yet FRESH is refreshed as soon as the scheduler starts
+    assert calls.count('third') == 1
+
+def test_refresh_jitter_stays_within_bounds():
+    manager = make_manager(refresh_interval=100)
+    delays = [manager._next_refresh_delay('asana') for _ in range(200)]
+    assert all(90 <= delay <= 110 for delay in delays)
+    assert len(set(delays)) > 1
+
+@pytest.mark.asyncio
+async def test_stream_combined_context_keeps_order_and_falls_back_on_failure():
+    manager = make_manager()
+    manager.context_providers['second'].context_info = "# second (cached)"
+
+    async def stream(self):
+        if self.project_id == 'second':
+            raise RuntimeError("boom")
+        await asyncio.sleep(0.1 if self.project_id == 'test_project_id' else 0)
+        for part in (f"# {self.project_id}", " done"):
+            yield part
+
+    with patch.object(AsanaContextProvider, 'stream_context_async', new=stream):
+        sink = io.StringIO()
+        written = await manager.write_combined_context_async(sink)
+
+    assert sink.getvalue() == "# test_project_id done\n# second (cached)\n# third done\n"
+    assert written == len(sink.getvalue())
+    assert manager.fetch_report['second']['error'] == "boom"
+    assert manager.fetch_report['third']['error'] is None
+
+def test_metrics_listener_prometheus_export_and_profile():
+    manager = make_manager()
+    manager.context_providers = {'asana': manager.context_providers['asana']}
+    provider = manager.context_providers['asana']
+    provider.enable_metrics()
+    FakeAsana([make_task(i) for i in range(5)]).install(provider)
+    reports = []
+    manager.add_metrics_listener(lambda name, report: reports.append((name, report)))
+
+    manager.fetch_contexts()
+    name, report = reports[0]
+    assert name == 'asana' and report['error'] is None
+    assert report['metrics']['counters']['tasks_listed'] == 5
+    assert manager.get_status()['asana']['metrics']['last_refresh'] is report['metrics']
+
+    text = manager.export_prometheus()
+    assert '# TYPE llm_context_refreshes_total counter' in text
+    assert 'llm_context_refreshes_total{provider="asana"} 1.0' in text
+    assert 'llm_context_api_requests_total{provider="asana",endpoint="create_batch_request"} 1.0' in text
+    assert 'llm_context_last_refresh_phase_seconds{provider="asana",phase="render"}' in text
+
+    stats = manager.profile_refresh('asana', full_fetch=True)
+    assert any(function[2] == 'fetch_context' for function in stats.stats)
+    assert len(reports) == 2
+    assert manager.get_metrics()['asana']['totals']['refreshes'] == 2
+
+def test_prometheus_export_after_refreshes_that_render_nothing():
+    manager = make_manager()
+    manager.context_providers = {'asana': manager.context_providers['asana']}
+    provider = manager.context_providers['asana']
+    provider.enable_metrics()
+    fake = FakeAsana([])
+    fake.install(provider)
+    manager.fetch_contexts()
+    assert manager.fetch_report['asana']['error'] is None
+    assert 'render_cache_hit_ratio' not in manager.export_prometheus()
+
+    fake.tasks['1000'] = make_task(0)
+    fake.order.append('1000')
+    provider.fetch_context(full_fetch=True)
+    assert 'render_cache_hit_ratio{provider="asana"} 0.0' in manager.export_prometheus()
+    manager.fetch_contexts()
+    assert provider.last_metrics['counters']['unchanged_refreshes'] == 1
+    text = manager.export_prometheus()
+    assert 'llm_context_refreshes_total{provider="asana"} 3.0' in text
+    assert 'render_cache_hit_ratio' not in text
+
+def test_metrics_config_enables_providers():
+    config = {'context_providers': {'asana': {'enabled': True, 'project_id': 'p', 'personal_access_token': 't'}},
+              'metrics': {'enabled': True}}
+    manager = ContextManager(config)
+    assert manager.context_providers['asana'].metrics_enabled
+    assert manager.export_prometheus() == (
+        '# HELP llm_context_refreshes_total Refreshes completed\n'
+        '# TYPE llm_context_refreshes_total counter\n'
+        'llm_context_refreshes_total{provider="asana"} 0.0\n'
+        '# HELP llm_context_refresh_errors_total Refreshes that failed\n'
+        '# TYPE llm_context_refresh_errors_total counter\n'
+        'llm_context_refresh_errors_total{provider="asana"} 0.0\n'
+    )
+
+def test_render_section_sets_provider_defaults():
+    config = {
+        'render': {'workers': 4, 'pool': 'process'},
+        'context_providers': {
+            'asana': {'enabled': True, 'project_id': 'p', 'personal_access_token': 't', 'render_workers': 2}
+        }
+    }
+    provider = ContextManager(config).context_providers['asana']
+    assert (provider.render_workers, provider.render_pool) == (2, 'process')
+
+def test_import_and_construction_defer_provider_dependencies():
+    # A fresh interpreter, since this test session has long since imported the SDK
+    script = (
+        "import sys\n"
+        "from llm_context_providers import ContextManager\n"
+        "config = {'context_providers': {'asana': {'enabled': True, 'project_id': 'p', 'personal_access_token': 't'}}}\n"
+        "provider = ContextManager(config).context_providers['asana']\n"
+        "heavy = ('asana', 'pytz', 'dateutil', 'urllib3')\n"
+        "print(sorted(name for name in heavy if name in sys.modules))\n"
+        "provider.tasks_api\n"
+        "print(sorted(name for name in heavy if name in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    before, after = result.stdout.splitlines()
+    assert before == "[]"
+    assert "'asana'" in after
+
+def test_provider_classes_resolve_from_entry_points(monkeypatch):
+    class FakeEntryPoint:
+        name = 'PluginContextProvider'
+
+        def load(self):
+            return Mock(name='PluginContextProvider')
+
+    monkeypatch.setattr(context_provider, '_provider_entry_points', lambda: [FakeEntryPoint()])
+    monkeypatch.setattr(ContextProvider, '_registry', dict(ContextProvider._registry))
+    plugin = ContextProvider.get_provider_class('PluginContextProvider')
+    assert plugin is ContextProvider.get_provider_class('PluginContextProvider')
+    assert ContextProvider.get_provider_class('MissingContextProvider') is None
+
+def test_relevant_context_merges_providers_within_budget_and_caches():
+    manager = make_manager()
+    asana, second, third = (manager.context_providers[name] for name in ('asana', 'second', 'third'))
+    asana_tasks = [make_task(i) for i in range(6)]
+    asana_tasks[2]['notes'] = 'Payment gateway timeout during checkout'
+    second_tasks = [make_task(i) for i in range(10, 16)]
+    second_tasks[1]['notes'] = 'Payment retries'
+    fake = FakeAsana(asana_tasks)
+    fake.install(asana)
+    FakeAsana(second_tasks, project=dict(make_project(gid='2'), name='Second Project')).install(second)
+    manager.fetch_contexts(['asana', 'second'])
+    third.search_index = AsyncMock(side_effect=RuntimeError("index offline"))
+
+    context = manager.get_relevant_context("payment gateway timeout")
+    # Each provider's best hit scores 1.0 after normalization, so both make it in, in configured order
+    assert context.index("# Project: Test Project") < context.index("# Project: Second Project")
+    assert context.count("### Task:") == 2
+    assert "Payment gateway timeout during checkout" in context and "Payment retries" in context
+    # The providers' own contexts are untouched
+    assert asana.get_context().count("### Task:") == 6
+
+    one_task = manager.get_relevant_context("payment gateway timeout", budget=len(context) - 1,
+                                            count_tokens=len)
+    assert one_task.count("### Task:") == 1 and "Second Project" not in one_task
+    assert manager.get_relevant_context("payment", budget=1, count_tokens=len) == ""
+
+    # The failing provider kept those answers out of the cache
+    assert manager._relevant_cache == {}
+    third.search_index = AsyncMock(return_value=[])
+    manager.get_relevant_context("payment gateway timeout")
+    with patch.object(asana, 'search_index', wraps=asana.search_index) as search:
+        assert manager.get_relevant_context("payment gateway timeout") == context
+        assert search.call_count == 0
+        # A refresh that changes nothing keeps cached answers; a real change drops them
+        manager.fetch_contexts(['asana', 'second'])
+        manager.get_relevant_context("payment gateway timeout")
+        assert search.call_count == 0
+        fake.touch('1004', notes='Unrelated cleanup')
+        manager.fetch_contexts(['asana', 'second'])
+        assert manager.get_relevant_context("payment gateway timeout") == context
+        assert search.call_count == 1
+
+def test_relevant_context_cache_is_bounded():
+    manager = make_manager(project_id='test_project_id')
+    manager.retrieval_cache_size = 2
+    manager.context_providers = {'asana': manager.context_providers['asana']}
+    FakeAsana([make_task(i) for i in range(3)]).install(manager.context_providers['asana'])
+    manager.fetch_contexts()
+    for query in ("task 0", "task 1", "task 2"):
+        manager.get_relevant_context(query)
+    assert [key[0] for key in manager._relevant_cache] == ["task 1", "task 2"]
+
+def test_change_listeners_only_hear_about_real_changes():
+    manager = make_manager()
+    manager.context_providers = {'asana': manager.context_providers['asana']}
+    fake = FakeAsana([make_task(i) for i in range(5)])
+    fake.install(manager.context_providers['asana'])
+    changes = []
+    manager.add_change_listener(lambda name, version: changes.append((name, version)))
+
+    manager.fetch_contexts()
+    version = manager.get_context_version()
+    assert changes == [('asana', manager.context_providers['asana'].context_version)]
+    manager.fetch_contexts()
+    manager.fetch_contexts()
+    assert len(changes) == 1 and manager.get_context_version() == version
+
+    fake.touch('1002', notes='Changed')
+    manager.fetch_contexts()
+    assert len(changes) == 2 and manager.get_context_version() != version
+    assert manager.get_status()['asana']['version'] == changes[-1][1]
@@ -0,0 +1,38 @@
+import json
+from llm_context_providers.search_index import BM25Index, tokenize
+
+def make_index():
+    index = BM25Index()
+    index.add('1', "Fix login bug on the billing page", version='v1')
+    index.add('2', "Design the billing dashboard", version='v1')
+    index.add('3', "Quarterly roadmap review", version='v1')
+    return index
+
+def test_tokenize():
+    assert tokenize("Fix BUG-42, then deploy!") == ['fix', 'bug', '42', 'then', 'deploy']
+    assert tokenize(None) == []
+
+def test_search_ranks_matching_documents():
+    index = make_index()
+    results = index.search("billing bug")
+    assert [doc_id for doc_id, _ in results] == ['1', '2']
+    assert results[0][1] > results[1][1] > 0
+    assert index.search("nothing matches") == []
+
+def test_add_replaces_and_remove_drops_documents():
+    index = make_index()
+    index.add('1', "Roadmap planning", version='v2')
+    assert {doc_id for doc_id, _ in index.search("roadmap")} == {'1', '3'}
+    assert index.search("login") == []
+    index.remove('3')
+    assert '3' not in index
+    assert len(index) == 2
+    assert index.total_length == sum(index.doc_lengths.values())
+    assert 'quarterly' not in index.postings
+
+def test_round_trip_through_json():
+    index = make_index()
+    restored = BM25Index.from_dict(json.loads(json.dumps(index.to_dict())))
+    assert restored.search("billing bug") == index.search("billing bug")
+    restored.remove('1')
+    assert 'login' not in restored.postings
@@ -0,0 +1,97 @@
+import os
+import re
+import time
+import pytest
+from llm_context_providers.snapshot_cache import (
+    FileSnapshotCache, MmapSnapshotCache, SqliteSnapshotCache, create_snapshot_cache, make_cache_key
+)
+from llm_context_providers.snapshot_format import MappedSnapshot
+
+@pytest.fixture(params=['file', 'mmap', 'sqlite'])
+def make_cache(request, tmp_path):
+    def factory(**kwargs):
+        if request.param == 'file':
+            return FileSnapshotCache(str(tmp_path / 'cache'), **kwargs)
+        if request.param == 'mmap':
+            return MmapSnapshotCache(str(tmp_path / 'cache'), **kwargs)
+        return SqliteSnapshotCache(str(tmp_path / 'cache.sqlite3'), **kwargs)
+    return factory
+
+def test_round_trip(make_cache):
+    cache = make_cache()
+    cache.set('asana-1', {'context_info': '# Project', 'data': {'tasks': [1, 2]}})
+    entry = cache.get('asana-1')
+    assert entry.value == {'context_info': '# Project', 'data': {'tasks': [1, 2]}}
+    assert entry.saved_at <= time.time()
+    assert cache.get('missing') is None
+
+def test_expired_entries_are_dropped(make_cache):
+    cache = make_cache(ttl=60)
+    cache.set('asana-1', 'value')
+    cache.ttl = -1
+    assert cache.get('asana-1') is None
+    cache.ttl = None
+    assert cache.get('asana-1') is None
+
+def test_least_recently_used_entries_are_evicted(make_cache):
+    cache = make_cache(max_bytes=2500)
+    payload = 'x' * 1000
+    cache.set('a', payload)
+    time.sleep(0.01)
+    cache.set('b', payload)
+    time.sleep(0.01)
+    cache.get('a')
+    time.sleep(0.01)
+    cache.set('c', payload)
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+
+def test_file_cache_leaves_no_temporary_files(tmp_path):
+    cache = FileSnapshotCache(str(tmp_path))
+    cache.set('asana-1', 'value')
+    assert os.listdir(tmp_path) == ['asana-1.json']
+
+def test_mmap_cache_maps_task_data(tmp_path):
+    cache = MmapSnapshotCache(str(tmp_path))
+    data = {'tasks': [{'gid': '1', 'name': 'Task', 'stories': [[1720000000, 'Ann', 'Hi']]}], 'fetched_at': 'now',
+            'headers': [['p', '# Project']], 'sections': {'1': '### Task'}, 'index': None}
+    cache.set('asana-1', {'context_info': '# Project', 'version': 'abc', 'data': data})
+    assert [re.fullmatch(r'asana-1\.\d{20}\.snap', name) is not None for name in os.listdir(tmp_path)] == [True]
+    value = cache.get('asana-1').value
+    assert value['context_info'] == '# Project' and value['version'] == 'abc'
+    assert isinstance(value['data'], MappedSnapshot)
+    assert value['data'].task(0) == data['tasks'][0]
+
+def test_mmap_cache_saves_while_an_entry_is_mapped(tmp_path, monkeypatch):
+    cache = MmapSnapshotCache(str(tmp_path))
+    data = {'tasks': [{'gid': '1', 'stories': []}], 'fetched_at': 'now', 'headers': [], 'sections': {}, 'index': None}
+    cache.set('asana-1', {'version': 'a', 'data': data})
+    mapped = cache.get('asana-1').value['data']
+    # Like Windows, which refuses to remove a mapped file
+    remove = os.remove
+    monkeypatch.setattr(os, 'remove', lambda path: (_ for _ in ()).throw(PermissionError(path)))
+    cache.set('asana-1', {'version': 'b', 'data': data})
+    cache.set('asana-1', {'version': 'c', 'data': data})
+    assert cache.get('asana-1').value['version'] == 'c'
+    assert len(os.listdir(tmp_path)) == 3
+    assert mapped.task(0) == data['tasks'][0]
+
+    mapped.close()
+    monkeypatch.setattr(os, 'remove', remove)
+    cache.set('asana-1', {'version': 'd', 'data': data})
+    assert cache.get('asana-1').value['version'] == 'd'
+    assert len(os.listdir(tmp_path)) == 1
+    cache.delete('asana-1')
+    assert cache.get('asana-1') is None and os.listdir(tmp_path) == []
+
+def test_create_snapshot_cache(tmp_path):
+    cache = create_snapshot_cache({'backend': 'sqlite', 'path': str(tmp_path / 'c.db'), 'ttl': 10})
+    assert isinstance(cache, SqliteSnapshotCache)
+    assert cache.ttl == 10
+    with pytest.raises(ValueError, match="Unknown cache backend"):
+        create_snapshot_cache({'backend': 'redis'})
+
+def test_cache_key_depends_on_config():
+    assert make_cache_key('asana', {'project_id': '1'}) == make_cache_key('asana', {'project_id': '1'})
+    assert make_cache_key('asana', {'project_id': '1'}) != make_cache_key('asana', {'project_id': '2'})
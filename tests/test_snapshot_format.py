@@ -0,0 +1,85 @@
+import pytest
+from llm_context_providers import AsanaContextProvider
+from llm_context_providers.asana_context_provider import TaskSnapshot
+from llm_context_providers.snapshot_format import (
+    LazyMapping, MappedSnapshot, SnapshotFormatError, encode_snapshot, write_snapshot
+)
+from .fake_asana import FakeAsana, make_task
+
+def make_data():
+    tasks = [
+        {'gid': '1', 'name': 'Café \U0001f600', 'completed': True, 'modified_at': 1720000000.5,
+         'num_likes': 3, 'tags': ['a', 'b'], 'stories': [[1720000000, 'Ann', 'First'], [None, None, 'Second']]},
+        {'gid': '2', 'name': None, 'completed': False, 'custom': {'x': 1}, 'stories': []},
+        {'gid': '3', 'stories': []},
+    ]
+    return {'tasks': tasks, 'fetched_at': '2024-07-10T12:34:00Z', 'headers': [['p', '# Project']],
+            'sections': {'1': '### Café', '3': ''}, 'index': {'terms': {'cafe': [0]}}}
+
+def test_round_trip_preserves_tasks_sections_and_data():
+    data = make_data()
+    mapped = MappedSnapshot(encode_snapshot(data, {'context_info': '# Project', 'version': None, 'saved_at': 1.5}))
+    assert mapped.gids() == ['1', '2', '3']
+    assert [mapped.task(row) for row in range(3)] == data['tasks']
+    assert mapped.value(0, 'num_likes') == 3 and mapped.value(2, 'name') is not None
+    assert {mapped.gids()[row]: mapped.section(row) for row in mapped.section_rows()} == data['sections']
+    assert mapped.headers == [('p', '# Project')]
+    assert mapped.get('fetched_at') == data['fetched_at']
+    assert mapped.get('index') == data['index']
+    assert mapped.get('missing', 'default') == 'default'
+    assert mapped.attributes() == {'context_info': '# Project', 'version': None, 'saved_at': 1.5}
+
+def test_task_snapshot_loads_lazily_from_a_mapped_file(tmp_path):
+    snapshot = TaskSnapshot.from_dict(make_data())
+    path = str(tmp_path / 'asana.snap')
+    write_snapshot(path, snapshot.to_dict())
+    mapped = MappedSnapshot.open(path)
+    loaded = TaskSnapshot.from_dict(mapped)
+    assert loaded.tasks.decoded() == 0 and loaded.sections.decoded() == 0
+    assert loaded.tasks['2'].get('custom') == {'x': 1}
+    assert loaded.tasks.decoded() == 1
+    assert loaded.to_dict() == snapshot.to_dict()
+    mapped.close()
+    # Decoded values outlive the map
+    assert loaded.tasks['1'].stories[0].text == 'First'
+
+def test_import_of_mapped_snapshot_reuses_rendered_sections(tmp_path):
+    fake = FakeAsana([make_task(i) for i in range(20)])
+    provider = AsanaContextProvider(project_id="test_project_id", personal_access_token="token")
+    fake.install(provider)
+    provider.fetch_context()
+    path = str(tmp_path / 'asana.snap')
+    write_snapshot(path, provider.export_snapshot())
+
+    restarted = AsanaContextProvider(project_id="test_project_id", personal_access_token="token")
+    fake.install(restarted)
+    restarted.import_snapshot(MappedSnapshot.open(path))
+    fake.touch('1004', name='Renamed task')
+    restarted.fetch_context()
+    stats = restarted.get_render_stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (19, 1, 20)
+    assert "Renamed task" in restarted.get_context()
+
+def test_lazy_mapping_behaves_like_a_dict():
+    loads = []
+    mapping = LazyMapping({'a': 0, 'b': 1}, lambda row: loads.append(row) or row * 10)
+    assert mapping['b'] == 10 and mapping['b'] == 10
+    assert loads == [1]
+    mapping['c'] = 30
+    del mapping['a']
+    assert 'a' not in mapping and 'c' in mapping
+    assert dict(mapping) == {'b': 10, 'c': 30}
+    with pytest.raises(KeyError):
+        mapping['a']
+    with pytest.raises(KeyError):
+        del mapping['a']
+
+@pytest.mark.parametrize('corrupt, message', [
+    (lambda data: b'NOTASNAP' + data[8:], "Not a snapshot"),
+    (lambda data: data[:8] + b'\x63\x00\x00\x00' + data[12:], "version 99"),
+    (lambda data: data[:-16], "truncated"),
+    (lambda data: data[:20], "truncated"),
+])
+def test_invalid_files_are_rejected(corrupt, message):
+    with pytest.raises(SnapshotFormatError, match=message):
+        MappedSnapshot(corrupt(encode_snapshot(make_data())))
@@ -0,0 +1,104 @@
+import pytest
+from llm_context_providers import AsanaContextProvider
+from .fake_asana import FakeAsana, make_task
+
+np = pytest.importorskip("numpy")
+
+from llm_context_providers.vector_index import HashingEmbedder, VectorIndex, chunk_text, create_embedder
+
+@pytest.fixture(autouse=True)
+def set_token(monkeypatch):
+    monkeypatch.setenv('ASANA_PERSONAL_ACCESS_TOKEN', 'mock_token')
+
+def make_index(**kwargs):
+    index = VectorIndex(**kwargs)
+    index.add_many([
+        ('1', "Fix login bug on the billing page", 'v1'),
+        ('2', "Design the billing dashboard", 'v1'),
+        ('3', "Quarterly roadmap review", 'v1'),
+    ])
+    return index
+
+class ConstantEmbedder:
+    dimensions = 3
+
+    def __init__(self, rows=None):
+        self.rows = rows
+
+    def embed(self, texts):
+        return [[1.0, 0.0, 0.0]] * (self.rows if self.rows is not None else len(texts))
+
+def test_hashing_embedder_is_deterministic():
+    texts = ["Fix the billing bug", "", "fix THE billing, bug!"]
+    vectors = HashingEmbedder(64).embed(texts)
+    assert vectors.shape == (3, 64) and vectors.dtype == np.float32
+    assert np.array_equal(vectors, HashingEmbedder(64).embed(texts))
+    assert np.array_equal(vectors[0], vectors[2])
+    assert not vectors[1].any()
+    # Four words and three word pairs
+    assert np.abs(vectors[0]).sum() <= 7
+
+def test_chunk_text_splits_long_text_into_overlapping_windows():
+    assert chunk_text("") == [""]
+    assert chunk_text("one two three", chunk_words=4) == ["one two three"]
+    chunks = chunk_text(" ".join(str(n) for n in range(10)), chunk_words=4)
+    assert chunks == ["0 1 2 3", "3 4 5 6", "6 7 8 9"]
+
+def test_search_ranks_documents_by_their_best_chunk():
+    index = make_index()
+    results = index.search("billing bug")
+    assert [doc_id for doc_id, _ in results] == ['1', '2']
+    assert results[0][1] > results[1][1] > 0
+    assert index.search("billing", limit=1)[0][0] in ('1', '2')
+    assert index.search_many(["billing bug", "roadmap"]) == [results, index.search("roadmap")]
+    assert VectorIndex().search("anything") == []
+
+def test_only_changed_documents_are_embedded_and_rows_are_reused():
+    index = make_index()
+    assert (index.chunk_count, index.embedded_chunks) == (3, 3)
+    index.add('1', "Roadmap planning", 'v2')
+    assert index.embedded_chunks == 4
+    assert {doc_id for doc_id, _ in index.search("roadmap")} == {'1', '3'}
+    index.remove('3')
+    assert '3' not in index and len(index) == 2
+    assert index.search("quarterly") == []
+    index.add('4', "Release checklist", 'v1')
+    assert index.chunk_count == 3 and len(index._row_docs) == 3
+
+def test_embedders_are_pluggable():
+    assert isinstance(create_embedder("hashing"), HashingEmbedder)
+    assert create_embedder({'name': 'hashing', 'dimensions': 32}).dimensions == 32
+    custom = create_embedder({'name': f"{__name__}:ConstantEmbedder"})
+    assert isinstance(custom, ConstantEmbedder)
+    index = VectorIndex(custom)
+    index.add('1', "anything", 'v1')
+    assert index.search("something else") == [('1', pytest.approx(1.0))]
+    with pytest.raises(ValueError, match="shape"):
+        VectorIndex(ConstantEmbedder(rows=5)).add('1', "text")
+    with pytest.raises(ValueError, match="Unknown embedder"):
+        create_embedder("missing")
+
+@pytest.mark.asyncio
+async def test_semantic_index_type_searches_and_reembeds_only_changed_tasks():
+    tasks = [make_task(i) for i in range(10)]
+    tasks[7]['notes'] = 'Investigate the flaky payment gateway timeout'
+    fake = FakeAsana(tasks)
+    provider = AsanaContextProvider(project_id="test_project_id", index_type="semantic",
+                                    embedder={'name': 'hashing', 'dimensions': 512})
+    fake.install(provider)
+    await provider.fetch_context_async()
+    await provider.index_context()
+    assert isinstance(provider._index, VectorIndex)
+    assert (await provider.search_index("payment gateway timeout"))[0][0] == '1007'
+
+    embedded = provider._index.embedded_chunks
+    fake.touch('1002', notes='Migrate the reporting database')
+    await provider.fetch_context_async()
+    assert provider._index.embedded_chunks == embedded + 1
+    assert (await provider.search_index("reporting database"))[0][0] == '1002'
+    # Embeddings are rebuilt after a restart rather than persisted
+    assert provider.export_snapshot()['index'] is None
+
+def test_unknown_index_type_is_rejected():
+    with pytest.raises(ValueError, match="index_type"):
+        AsanaContextProvider(project_id="test_project_id", index_type="fuzzy")